@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+'''
+Cost of constructing, comparing and looking up addresses in
+switchyard.lib.address, as done per packet by a learning switch or
+router.
+
+    python3 benchmarks/bench_addr.py
+'''
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from switchyard.lib.packet import *
+from switchyard.lib.address import EthAddr, IPAddr
+
+def rate(fn, number):
+    best = min(timeit.repeat(fn, number=number, repeat=5))
+    return number / best
+
+def main():
+    number = 200000
+    mac = EthAddr("11:22:33:44:55:66")
+    other = EthAddr("66:55:44:33:22:11")
+    macraw = mac.raw
+    ip = IPAddr("10.0.0.1")
+    otherip = IPAddr("10.0.0.2")
+    ipraw = ip.packed
+    mactable = {EthAddr(bytes([0, 0, 0, 0, i >> 8, i & 0xff])): i
+                for i in range(1000)}
+    mactable[mac] = -1
+    iptable = {IPAddr(0x0a000000 + i): i for i in range(1000)}
+    eth = Ethernet(src=mac, dst=other)
+
+    tests = [
+        ("EthAddr(bytes)", lambda: EthAddr(macraw)),
+        ("EthAddr(EthAddr)", lambda: EthAddr(mac)),
+        ("EthAddr ==", lambda: mac == other),
+        ("EthAddr dict lookup", lambda: mactable[mac]),
+        ("Ethernet.src = EthAddr", lambda: setattr(eth, 'src', other)),
+        ("IPAddr(bytes)", lambda: IPAddr(ipraw)),
+        ("IPAddr(IPAddr)", lambda: IPAddr(ip)),
+        ("IPAddr ==", lambda: ip == otherip),
+        ("IPAddr dict lookup", lambda: iptable[ip]),
+    ]
+    print("{:24s} {:>14s}".format("operation", "ops/s"))
+    for name, fn in tests:
+        print("{:24s} {:14,.0f}".format(name, rate(fn, number)))
+
+    number = 20000
+    pkt = Ethernet(src=mac, dst=other) + \
+        IPv4(src="10.0.0.1", dst="10.0.0.2", protocol=IPProtocol.UDP, ttl=64) + \
+        UDP(src=1234, dst=53) + b'x' * 64
+    raw = pkt.to_bytes()
+    def parse():
+        p = Packet(raw=raw)
+        return mactable[p[0].src], iptable[p[1].src]
+    print("{:24s} {:14,.0f}".format("parse + lookups", rate(parse, number)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+'''
+Microbenchmark for the internet checksum in switchyard.lib.packet.common.
+
+Compares the original array-based implementation with the current one
+(with and without numpy) and with checksum_many on a batch of buffers.
+
+    python3 benchmarks/bench_checksum.py
+'''
+
+import array
+import os
+import struct
+import sys
+import timeit
+from socket import ntohs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import switchyard.lib.packet.common as common
+from switchyard.lib.packet.common import checksum, checksum_many
+
+def legacy_checksum(data, start=0, skip_word=None):
+    if len(data) % 2 != 0:
+        arr = array.array('H', data[:-1])
+    else:
+        arr = array.array('H', data)
+    for i in range(0, len(arr)):
+        if i == skip_word:
+            continue
+        start += arr[i]
+    if len(data) % 2 != 0:
+        start += struct.unpack('H', data[-1:]+b'\x00')[0]
+    start = (start >> 16) + (start & 0xffff)
+    start += (start >> 16)
+    return ntohs(~start & 0xffff)
+
+def usec(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+def main():
+    sizes = (64, 576, 1500)
+    batch = 32
+    numpy = common._numpy
+    print("{:>6} {:>10} {:>10} {:>10} {:>8}   per-buffer, batch of {}".format(
+        "bytes", "legacy", "int", "numpy", "speedup", batch))
+    for size in sizes:
+        data = os.urandom(size)
+        bufs = [os.urandom(size) for _ in range(batch)]
+        assert checksum(data) == legacy_checksum(data)
+        number = 20000 if size < 1000 else 5000
+
+        old = usec(lambda: legacy_checksum(data), number)
+        common._numpy = None
+        new = usec(lambda: checksum(data), number)
+        many = usec(lambda: checksum_many(bufs), number // batch) / batch
+        common._numpy = numpy
+        if numpy is not None:
+            npnew = usec(lambda: checksum(data), number)
+            npmany = usec(lambda: checksum_many(bufs), number // batch) / batch
+            npcol = "{:8.2f}us".format(min(npnew, new))
+            best = min(new, npnew)
+            manycol = "{:.2f}us / {:.2f}us (numpy)".format(many, npmany)
+        else:
+            npcol = "{:>10}".format("n/a")
+            best = new
+            manycol = "{:.2f}us".format(many)
+        print("{:6d} {:8.2f}us {:8.2f}us {} {:7.1f}x   {}".format(
+            size, old, new, npcol, old / best, manycol))
+
+if __name__ == '__main__':
+    main()
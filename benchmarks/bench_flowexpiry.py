@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+'''
+Cost of FlowTable.expire_entries as the table grows: a pass when
+nothing has timed out (as on most turns of the controller loop), and
+a pass that expires every entry at once.  For comparison, the time to
+check every entry with has_expired, as a full-table scan would.
+
+    python3 benchmarks/bench_flowexpiry.py [max entries]
+'''
+
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from switchyard.lib.packet import *
+from switchyard.lib.openflow import openflow10 as of10
+from switchyard.lib.openflow.ofswitch import FlowTable, SwitchActionCallbacks
+
+def build_table(nentries):
+    table = FlowTable(SwitchActionCallbacks())
+    for i in range(nentries):
+        pkt = Ethernet() + IPv4(src="10.{}.{}.{}".format(i >> 16, i >> 8 & 255, i & 255),
+            dst="192.168.0.1", protocol=IPProtocol.UDP, ttl=64) + UDP(src=1, dst=2)
+        fmod = of10.OpenflowFlowMod(of10.OpenflowMatch.build_from_packet(pkt))
+        fmod.idle_timeout = 60
+        fmod.hard_timeout = 60 + i % 60
+        fmod.set_flag(of10.FlowModFlags.SendFlowRemove)
+        table.add(fmod)
+    return table
+
+def main():
+    maxentries = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print("{:>8s} {:>16s} {:>16s} {:>16s}".format("entries", "idle pass", "expire all", "full scan"))
+    nentries = 1000
+    while nentries <= maxentries:
+        table = build_table(nentries)
+        now = time.time()
+        idle = min(timeit.repeat(lambda: table.expire_entries(now), number=1000, repeat=5)) / 1000
+        scan = min(timeit.repeat(lambda: [e for e in table._table if e.has_expired(now)],
+                   number=1, repeat=3))
+        start = time.perf_counter()
+        expired = table.expire_entries(now + 1000)
+        expire = time.perf_counter() - start
+        assert len(expired) == nentries and not len(table)
+        print("{:8d} {:14.2f}us {:14.1f}ms {:14.1f}ms".format(nentries, idle * 1e6, expire * 1e3, scan * 1e3))
+        nentries *= 10
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+'''
+Lookup cost in switchyard.lib.openflow.ofswitch.FlowTable as the
+table grows, against a linear scan with OpenflowMatch.matches_packet.
+
+The table holds one exact-match entry per flow plus a few wildcarded
+rules (a per-subnet rule and a default route); lookups are for a
+packet that hits an exact-match entry from the middle of the table,
+one that only hits the subnet rule, and an ARP packet, which lacks
+most of the fields.  These go through a table with its flow cache
+turned off; the last column is the exact-match packet again, hitting
+in the cache.  Last, the subnet-rule packet again, with 125 more
+distinct wildcard masks (at higher priority) for a lookup to probe.
+
+    python3 benchmarks/bench_flowtable.py [max entries]
+'''
+
+import itertools
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from switchyard.lib.packet import *
+from switchyard.lib.openflow import openflow10 as of10
+from switchyard.lib.openflow.ofswitch import FlowTable, SwitchActionCallbacks
+
+def rate(fn, number):
+    best = min(timeit.repeat(fn, number=number, repeat=5))
+    return number / best
+
+def flow_packet(i, sport=None):
+    return Ethernet(src="11:22:33:44:55:66", dst="66:55:44:33:22:11") + \
+        IPv4(src="10.{}.{}.1".format(i // 256 % 256, i % 256), dst="192.168.0.1",
+             protocol=IPProtocol.TCP, ttl=64) + \
+        TCP(src=1024 + i // 65536 if sport is None else sport, dst=80)
+
+def flowmod(match, priority, port):
+    fmod = of10.OpenflowFlowMod(match)
+    fmod.priority = priority
+    fmod.actions.append(of10.ActionOutput(port=port))
+    return fmod
+
+def build_table(nentries, cache_size):
+    table = FlowTable(SwitchActionCallbacks(), cache_size=cache_size)
+    anything = of10.OpenflowMatch()
+    anything.wildcard_all()
+    table.add(flowmod(anything, 0, 1))
+    subnet = of10.OpenflowMatch.build_from_packet(flow_packet(0))
+    for w in (of10.OpenflowWildcard.InPort, of10.OpenflowWildcard.TpSrc):
+        subnet.add_wildcard(w)
+    subnet.nwsrc_wildcard = 24
+    table.add(flowmod(subnet, 100, 2))
+    for i in range(nentries):
+        m = of10.OpenflowMatch.build_from_packet(flow_packet(i))
+        m.in_port = 1
+        table.add(flowmod(m, 1000, 3))
+    return table
+
+def add_masks(table):
+    W = of10.OpenflowWildcard
+    wildcards = (W.DlSrc, W.DlDst, W.TpSrc, W.TpDst, W.NwTos, W.DlVlanPcp)
+    for n in range(1, 4):
+        for combo in itertools.combinations(wildcards, n):
+            for bits in (8, 16, 24):
+                m = of10.OpenflowMatch.build_from_packet(flow_packet(0))
+                m.nw_src = "172.16.0.1"
+                for w in combo + (W.InPort,):
+                    m.add_wildcard(w)
+                m.nwsrc_wildcard = bits
+                table.add(flowmod(m, 500, 4))
+
+def linear_lookup(table, in_port, pkt):
+    for entry in sorted(table._table, key=lambda e: -e.priority):
+        if entry.match.matches_packet(pkt) and entry.match.in_port in (in_port, of10.OpenflowPort.NoPort):
+            return entry.actions
+
+def main():
+    maxentries = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    labels = ("exact hit", "subnet hit", "arp")
+    print("{:>8s}".format("entries") + "".join("{:>14s}".format(l) for l in labels) + "{:>14s}".format("cached") + "{:>16s}".format("linear (exact)"))
+    nentries = 100
+    while nentries <= maxentries:
+        table = build_table(nentries, 0)
+        lookups = (flow_packet(nentries // 2), flow_packet(0, sport=9999),
+            create_ip_arp_request("11:22:33:44:55:66", "10.0.0.1", "10.0.0.2"))
+        results = [ rate(lambda: table.match_packet(1, pkt), 2000) for pkt in lookups ]
+        table._cache_size = 65536
+        results.append(rate(lambda: table.match_packet(1, lookups[0]), 2000))
+        line = "{:8d}".format(nentries) + "".join("{:12.0f}/s".format(r) for r in results)
+        if nentries <= 1000:
+            pkt = lookups[0]
+            line += "{:14.0f}/s".format(rate(lambda: linear_lookup(table, 1, pkt), 10))
+        print(line)
+        nentries *= 10
+
+    pkt = flow_packet(0, sport=9999)
+    for cache_size in (0, 65536):
+        table = build_table(1000, cache_size)
+        add_masks(table)
+        print("1000 entries, {} masks, cache {}: {:.0f}/s".format(len(table._groups),
+            "on" if cache_size else "off", rate(lambda: table.match_packet(1, pkt), 2000)))
+
+if __name__ == '__main__':
+    main()
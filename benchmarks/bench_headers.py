@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+'''
+Throughput of header decoding and encoding in switchyard.lib.packet.
+
+For each header type, measures from_bytes and to_bytes on an existing
+header object, and then parsing and serializing whole packets.
+
+    python3 benchmarks/bench_headers.py
+'''
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from switchyard.lib.packet import *
+from switchyard.lib.address import IPv6Address
+
+def rate(fn, number):
+    best = min(timeit.repeat(fn, number=number, repeat=5))
+    return number / best
+
+def headers():
+    yield Ethernet(src="11:22:33:44:55:66", dst="66:55:44:33:22:11")
+    yield Vlan(vlanid=10, ethertype=EtherType.IPv4)
+    yield Arp(senderhwaddr="11:22:33:44:55:66", senderprotoaddr="10.0.0.1",
+              targetprotoaddr="10.0.0.2")
+    yield IPv4(src="10.0.0.1", dst="10.0.0.2", protocol=IPProtocol.TCP, ttl=64)
+    yield IPv6(src=IPv6Address("fe80::1"), dst=IPv6Address("fe80::2"),
+               nextheader=IPProtocol.UDP)
+    yield TCP(src=1234, dst=80, seq=1, ack=2, window=1000, ACK=1)
+    yield UDP(src=1234, dst=53)
+
+def packets():
+    yield "Ethernet/IPv4/TCP", Ethernet() + \
+        IPv4(src="10.0.0.1", dst="10.0.0.2", protocol=IPProtocol.TCP, ttl=64) + \
+        TCP(src=1234, dst=80) + b'x' * 1400
+    yield "Ethernet/IPv6/UDP", Ethernet(ethertype=EtherType.IPv6) + \
+        IPv6(src=IPv6Address("fe80::1"), dst=IPv6Address("fe80::2"),
+             nextheader=IPProtocol.UDP) + UDP(src=1, dst=2) + b'x' * 100
+    yield "Ethernet/Arp", create_ip_arp_request("11:22:33:44:55:66",
+        "10.0.0.1", "10.0.0.2")
+
+def main():
+    number = 50000
+    print("{:20s} {:>14s} {:>14s}".format("header", "decode/s", "encode/s"))
+    for hdr in headers():
+        raw = hdr.to_bytes()
+        dec = rate(lambda: hdr.from_bytes(raw), number)
+        enc = rate(hdr.to_bytes, number)
+        print("{:20s} {:14,.0f} {:14,.0f}".format(hdr.__class__.__name__,
+            dec, enc))
+
+    number = 20000
+    print()
+    print("{:20s} {:>14s} {:>14s}".format("packet", "parse/s", "to_bytes/s"))
+    for name, pkt in packets():
+        raw = pkt.to_bytes()
+        parse = rate(lambda: Packet(raw), number)
+        # a packet that wasn't parsed, so every header is serialized
+        ser = rate(pkt.to_bytes, number)
+        print("{:20s} {:14,.0f} {:14,.0f}".format(name, parse, ser))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+'''
+Message rates through switchyard.lib.openflow.ofswitch.ControllerConnection
+over a local socket pair: receiving a burst of flow mods (as a reactive
+controller sends them), and sending a burst of small messages (barrier
+replies), flushed once at the end.
+
+    python3 benchmarks/bench_ofchannel.py [nmessages]
+'''
+
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from switchyard.lib.openflow import openflow10 as of10
+from switchyard.lib.openflow.ofswitch import ControllerConnection
+
+def connection():
+    ours,theirs = socket.socketpair()
+    cc = ControllerConnection('localhost', 6633, usetls=False)
+    ours.settimeout(1.0)
+    cc._socket = ours
+    cc._connected = True
+    return cc, theirs
+
+def receive_rate(nmessages):
+    fmod = of10.OpenflowHeader.build(of10.OpenflowType.FlowMod, xid=1)
+    fmod[1].match.nw_src = "10.0.0.1"
+    fmod[1].match.nw_dst = "10.0.0.2"
+    fmod[1].actions.append(of10.ActionOutput(port=1))
+    burst = fmod.to_bytes() * nmessages
+    cc,theirs = connection()
+    writer = threading.Thread(target=theirs.sendall, args=(burst,))
+    start = time.perf_counter()
+    writer.start()
+    for i in range(nmessages):
+        while cc.receive_openflow_message() is None:
+            pass
+    elapsed = time.perf_counter() - start
+    writer.join()
+    theirs.close()
+    return nmessages / elapsed
+
+def send_rate(nmessages):
+    reply = of10.OpenflowHeader.build(of10.OpenflowType.BarrierReply, xid=1)
+    total = len(reply.to_bytes()) * nmessages
+    cc,theirs = connection()
+    def drain():
+        remain = total
+        while remain:
+            remain -= len(theirs.recv(1 << 16))
+    reader = threading.Thread(target=drain)
+    reader.start()
+    start = time.perf_counter()
+    for i in range(nmessages):
+        cc.send_openflow_message(reply)
+    if hasattr(cc, 'flush'):
+        cc.flush()
+    reader.join()
+    elapsed = time.perf_counter() - start
+    theirs.close()
+    return nmessages / elapsed
+
+def main():
+    nmessages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print("receive flow mods: {:.0f}/s".format(max(receive_rate(nmessages) for i in range(3))))
+    print("send barrier replies: {:.0f}/s".format(max(send_rate(nmessages) for i in range(3))))
+
+if __name__ == '__main__':
+    main()
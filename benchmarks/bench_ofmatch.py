@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+'''
+Cost of testing a packet against one OpenflowMatch (OF1.0), for an
+exact match, a match with some fields and an IP prefix wildcarded, and
+a match that wildcards everything.
+
+matches_packet extracts the packet's fields and runs the compiled
+test; matches_key runs only the test, on fields extracted once with
+OpenflowMatch.packet_key (as a flow table does for all its entries).
+
+    python3 benchmarks/bench_ofmatch.py
+'''
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from switchyard.lib.packet import *
+from switchyard.lib.openflow.openflow10 import OpenflowMatch, OpenflowWildcard
+
+def rate(fn, number):
+    best = min(timeit.repeat(fn, number=number, repeat=5))
+    return number / best
+
+def matches(pkt):
+    exact = OpenflowMatch.build_from_packet(pkt)
+    yield "exact", exact
+    prefix = OpenflowMatch.build_from_packet(pkt)
+    for w in (OpenflowWildcard.InPort, OpenflowWildcard.DlSrc, OpenflowWildcard.TpSrc):
+        prefix.add_wildcard(w)
+    prefix.nwsrc_wildcard = 8
+    yield "prefix", prefix
+    anything = OpenflowMatch()
+    anything.wildcard_all()
+    yield "all wildcarded", anything
+
+def main():
+    pkt = Ethernet(src="11:22:33:44:55:66", dst="66:55:44:33:22:11") + \
+        IPv4(src="10.0.0.1", dst="10.0.0.2", protocol=IPProtocol.TCP, ttl=64) + \
+        TCP(src=1234, dst=80)
+    number = 20000
+    haskey = hasattr(OpenflowMatch, 'packet_key')
+    if haskey:
+        key = OpenflowMatch.packet_key(pkt)
+        print("packet_key: {:.0f}/s".format(rate(lambda: OpenflowMatch.packet_key(pkt), number)))
+    print("{:16s} {:>16s} {:>16s}".format("match", "matches_packet", "matches_key"))
+    for label,m in matches(pkt):
+        assert m.matches_packet(pkt)
+        line = "{:16s} {:14.0f}/s".format(label, rate(lambda: m.matches_packet(pkt), number))
+        if haskey:
+            line += " {:14.0f}/s".format(rate(lambda: m.matches_key(key), number))
+        print(line)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+'''
+Reading a capture file with libpcap (switchyard.pcapffi.PcapReader)
+versus the memory-mapped reader in switchyard.pcapfile, with and
+without parsing each packet.
+
+    python3 benchmarks/bench_pcapfile.py [npackets]
+'''
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from switchyard.lib.packet import *
+from switchyard.pcapfile import PcapFile
+
+def write_capture(name, npackets):
+    from switchyard.pcapffi import PcapDumper
+    dumper = PcapDumper(name)
+    for i in range(npackets):
+        p = Ethernet(src="11:22:33:44:55:66", dst="66:55:44:33:22:11") + \
+            IPv4(src="10.0.0.1", dst="10.0.{}.{}".format(i // 256 % 256, i % 256),
+                 protocol=IPProtocol.UDP, ttl=64) + \
+            UDP(src=1024 + i % 1000, dst=53) + bytes(64 + i % 1000)
+        dumper.write_packet(p.to_bytes(), ts_ns=i * 1000)
+    dumper.close()
+
+def libpcap_read(name, parse):
+    from switchyard.pcapffi import PcapReader
+    reader = PcapReader(name)
+    n = 0
+    while True:
+        pkt = reader.recv_packet()
+        if pkt is None:
+            break
+        if parse:
+            Packet(raw=pkt.raw)
+        n += 1
+    reader.close()
+    return n
+
+def mmap_read(name, parse):
+    n = 0
+    with PcapFile(name) as reader:
+        for pkt in reader:
+            if parse:
+                Packet(raw=pkt.raw)
+            n += 1
+    return n
+
+def parse_udp(pkt):
+    return Packet(raw=pkt.raw)[UDP].src
+
+def mmap_parallel(name, parse):
+    with PcapFile(name) as reader:
+        return sum(1 for x in reader.map_packets(parse_udp))
+
+def rate(fn, name, parse):
+    best = None
+    for i in range(3):
+        start = time.perf_counter()
+        n = fn(name, parse)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return n / best
+
+def main():
+    npackets = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    fd,name = tempfile.mkstemp(suffix='.pcap')
+    os.close(fd)
+    try:
+        write_capture(name, npackets)
+        print("{} packets, {:.1f} MB, {} CPUs".format(npackets, os.path.getsize(name) / 1e6, os.cpu_count()))
+        print("{:>24} {:>14} {:>14}".format("", "read only", "read+parse"))
+        for label,fn in (("libpcap (PcapReader)", libpcap_read), ("mmap (PcapFile)", mmap_read)):
+            print("{:>24} {:10.0f}/s {:10.0f}/s".format(label, rate(fn, name, False), rate(fn, name, True)))
+        print("{:>24} {:>12} {:10.0f}/s".format("mmap, map_packets", "", rate(mmap_parallel, name, True)))
+    finally:
+        os.unlink(name)
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,7 @@ and prints packets to stdout.
 '''
 
 import sys
-from switchyard.pcapffi import *
+from switchyard.pcapfile import PcapFile
 from switchyard.lib.packet import *
 
 files = ['sydump.pcap']
@@ -14,14 +14,10 @@ if len(sys.argv) > 1:
 
 for infile in files:
     print("Opening {}.".format(infile))
-    reader = PcapReader(infile)
     count = 0
-    while True:
-        pkt = reader.recv_packet()
-        if pkt is None:
-            break
-        p = Packet(raw=pkt.raw)
-        print (p)
-        count += 1
+    with PcapFile(infile) as reader:
+        for pkt in reader:
+            p = Packet(raw=pkt.raw)
+            print (p)
+            count += 1
     print ("Got {} packets from {}.".format(count, infile))
-    reader.close()
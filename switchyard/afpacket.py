@@ -0,0 +1,359 @@
+import sys
+import socket
+import struct
+import mmap
+import ctypes
+from select import select
+from time import monotonic
+
+from .pcapffi import Dlt, PcapStats, PcapPacket, PcapException, bpf_compile
+
+'''
+Linux packet capture/injection through an AF_PACKET socket with
+memory-mapped TPACKET_V3 receive and transmit rings, as an alternative
+to libpcap.
+
+The kernel fills the receive ring a block at a time, so each wakeup
+yields a block of packets that are read straight out of shared memory
+without a system call (or a trip through libpcap and a cffi callback)
+per packet.  Outgoing frames are written into the transmit ring and
+handed to the kernel with a single send().
+'''
+
+# from linux/if_packet.h and linux/if_ether.h
+SOL_PACKET = 263
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_MR_PROMISC = 1
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+PACKET_TX_RING = 13
+TPACKET_V3 = 2
+ETH_P_ALL = 3
+SO_ATTACH_FILTER = 26
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+TP_STATUS_AVAILABLE = 0
+TP_STATUS_SEND_REQUEST = 1
+TP_STATUS_SENDING = 2
+TP_STATUS_WRONG_FORMAT = 4
+
+ARPHRD_ETHER = 1
+ARPHRD_LOOPBACK = 772
+
+# struct tpacket_req3
+_tpacket_req3 = struct.Struct('=7I')
+# struct tpacket_block_desc: version, offset_to_priv, then
+# tpacket_hdr_v1: block_status, num_pkts, offset_to_first_pkt
+_block_desc = struct.Struct('=5I')
+_block_status_offset = 8
+# struct tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec, tp_snaplen,
+# tp_len, tp_status, tp_mac
+_tpacket3_hdr = struct.Struct('=6IH')
+_tp_len_offset = 16
+_tp_status_offset = 20
+# TPACKET_ALIGN(sizeof(struct tpacket3_hdr)); where transmit data starts
+_tx_data_offset = 48
+# struct tpacket_stats_v3 (only the first two fields)
+_tpacket_stats = struct.Struct('=2I')
+# struct packet_mreq
+_packet_mreq = struct.Struct('=iHH8s')
+# how long to wait for the kernel to free a transmit frame (seconds)
+_tx_wait_timeout = 1.0
+
+
+class AfPacketDevice(object):
+    '''
+    A live capture/injection device using an AF_PACKET socket with
+    TPACKET_V3 rings (Linux only).  Implements the same methods as
+    PcapLiveDevice, so the two can be used interchangeably.
+
+    The receive ring is block_nr blocks of block_size bytes; a block
+    is handed to user space when it fills up, or after timeout_ms
+    even if it isn't full.  The transmit ring has tx_frame_nr frames,
+    each holding up to snaplen bytes.
+    '''
+    __slots__ = ['_devname', '_sock', '_ring', '_view', '_dlt', '_snaplen',
+                 '_block_size', '_block_nr', '_block', '_pkt_offset',
+                 '_pkts_left', '_held', '_tx_base', '_tx_frame_size', '_tx_frame_nr',
+                 '_tx_cur', '_recv', '_drop']
+
+    def __init__(self, device, snaplen=2048, promisc=1, timeout_ms=10,
+                 block_size=1<<18, block_nr=64, tx_frame_nr=256,
+                 filterstr=None):
+        if not sys.platform.startswith('linux'):
+            raise PcapException("AF_PACKET devices are only available on Linux")
+        self._devname = device
+        self._snaplen = snaplen
+        self._block_size = block_size
+        self._block_nr = block_nr
+        self._recv = self._drop = 0
+        self._dlt = Dlt.DLT_EN10MB
+        try:
+            self._sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        except OSError as e:
+            raise PcapException("Error opening AF_PACKET socket for {}: {}".format(device, e))
+        try:
+            self._setup(device, promisc, timeout_ms, tx_frame_nr, filterstr)
+        except OSError as e:
+            self._sock.close()
+            raise PcapException("Error setting up AF_PACKET rings for {}: {}".format(device, e))
+
+    def _setup(self, device, promisc, timeout_ms, tx_frame_nr, filterstr):
+        sock = self._sock
+        sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+
+        # receive ring; frame size only matters to the kernel's sanity
+        # checks for TPACKET_V3, since packets are packed into blocks
+        rx_frame_size = 1 << 11
+        sock.setsockopt(SOL_PACKET, PACKET_RX_RING, _tpacket_req3.pack(
+            self._block_size, self._block_nr, rx_frame_size,
+            self._block_size // rx_frame_size * self._block_nr,
+            timeout_ms, 0, 0))
+
+        # transmit ring: fixed-size frames, the header then the data
+        frame_size = 1 << max(11, (self._snaplen + _tx_data_offset - 1).bit_length())
+        tx_block_size = max(frame_size, mmap.PAGESIZE)
+        frames_per_block = tx_block_size // frame_size
+        tx_block_nr = -(-tx_frame_nr // frames_per_block)
+        self._tx_frame_size = frame_size
+        self._tx_frame_nr = tx_block_nr * frames_per_block
+        self._tx_cur = 0
+        sock.setsockopt(SOL_PACKET, PACKET_TX_RING, _tpacket_req3.pack(
+            tx_block_size, tx_block_nr, frame_size, self._tx_frame_nr,
+            0, 0, 0))
+
+        # both rings are mapped together, receive ring first
+        rxsize = self._block_size * self._block_nr
+        self._tx_base = rxsize
+        self._ring = mmap.mmap(sock.fileno(), rxsize + tx_block_size * tx_block_nr)
+        self._view = memoryview(self._ring)
+        self._block = 0
+        self._pkts_left = 0
+        self._pkt_offset = 0
+        self._held = False
+
+        if filterstr is not None:
+            self.set_filter(filterstr)
+        sock.bind((device, ETH_P_ALL))
+        hatype = sock.getsockname()[3]
+        if hatype not in (ARPHRD_ETHER, ARPHRD_LOOPBACK):
+            raise OSError("Don't know how to handle hardware type {}".format(hatype))
+        if promisc:
+            ifindex = socket.if_nametoindex(device)
+            sock.setsockopt(SOL_PACKET, PACKET_ADD_MEMBERSHIP,
+                _packet_mreq.pack(ifindex, PACKET_MR_PROMISC, 0, b''))
+        sock.setblocking(False)
+
+    @staticmethod
+    def create(device):
+        return AfPacketDevice(device)
+
+    @staticmethod
+    def set_bpf_filter_on_all_devices(filterstr):
+        pass
+
+    @property
+    def name(self):
+        return self._devname
+
+    @property
+    def dlt(self):
+        return self._dlt
+
+    @property
+    def fd(self):
+        return self._sock.fileno()
+
+    @property
+    def snaplen(self):
+        return self._snaplen
+
+    @property
+    def blocking(self):
+        return False
+
+    def set_filter(self, filterstr):
+        '''
+        Compile a tcpdump-style filter expression (with libpcap) and
+        attach it to the socket.
+        '''
+        insns = bpf_compile(filterstr, self._dlt, self._snaplen)
+        buf = ctypes.create_string_buffer(insns, len(insns))
+        fprog = struct.pack('HP', len(insns) // 8, ctypes.addressof(buf))
+        self._sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+    def _next_block(self):
+        '''
+        Once the packets in the current block of the receive ring are
+        used up, return it to the kernel and move on to the next one.
+        Returns True if there is a packet to read.
+        '''
+        while not self._pkts_left:
+            if self._held:
+                self._release_block()
+            if not self._take_block():
+                return False
+        return True
+
+    def _take_block(self):
+        offset = self._block * self._block_size
+        version,priv,status,npkts,first = _block_desc.unpack_from(self._ring, offset)
+        if not (status & TP_STATUS_USER):
+            return False
+        self._pkts_left = npkts
+        self._pkt_offset = offset + first
+        self._held = True
+        return True
+
+    def _release_block(self):
+        struct.pack_into('=I', self._ring, self._block * self._block_size + _block_status_offset, TP_STATUS_KERNEL)
+        self._block = (self._block + 1) % self._block_nr
+        self._held = False
+
+    def frames(self, count=-1):
+        '''
+        Generate up to count (or, if count is -1, all available) frames
+        from the receive ring without waiting, as PcapPacket objects whose
+        raw attribute is a memoryview into the ring.  A view is only valid
+        until the generator is advanced to the next frame, after which the
+        kernel may reuse its memory; copy it (e.g., with bytes()) to keep it.
+        '''
+        ring = self._ring
+        view = self._view
+        unpack_from = _tpacket3_hdr.unpack_from
+        while count != 0:
+            if not self._pkts_left and not self._next_block():
+                return
+            offset = self._pkt_offset
+            nextoff,sec,nsec,caplen,wirelen,status,mac = unpack_from(ring, offset)
+            self._pkts_left -= 1
+            self._pkt_offset = offset + nextoff
+            self._recv += 1
+            start = offset + mac
+            # the block is released when the next frame is read
+            yield PcapPacket(sec * 1000000000 + nsec, caplen, wirelen, view[start:start+caplen])
+            count -= 1
+
+    def _read_frames(self, callback, count):
+        ring = self._ring
+        unpack_from = _tpacket3_hdr.unpack_from
+        n = 0
+        while n != count:
+            if not self._pkts_left and not self._next_block():
+                break
+            offset = self._pkt_offset
+            nextoff,sec,nsec,caplen,wirelen,status,mac = unpack_from(ring, offset)
+            start = offset + mac
+            # slicing the mmap copies the frame out of the ring
+            callback(PcapPacket(sec * 1000000000 + nsec, caplen, wirelen, ring[start:start+caplen]))
+            n += 1
+            self._pkts_left -= 1
+            self._pkt_offset = offset + nextoff
+            if not self._pkts_left:
+                self._release_block()
+        self._recv += n
+        return n
+
+    def dispatch(self, callback, count=-1):
+        '''
+        Call callback with each of up to count packets available in the
+        receive ring (or all of them, if count is -1), without waiting.
+        The raw data of each packet is copied out of the ring as bytes.
+        Returns the number of packets processed.
+        '''
+        return self._read_frames(callback, count)
+
+    def recv_packets(self, count=-1, timeout=None):
+        '''
+        Receive up to count packets (or every packet available, if count
+        is -1).  If no packets are available, wait up to timeout seconds
+        (or indefinitely if timeout is None) for some to arrive.  Returns
+        a (possibly empty) list of PcapPacket objects.
+        '''
+        if timeout is None or timeout < 0:
+            timeout = None
+        batch = []
+        if not self._read_frames(batch.append, count) and timeout != 0:
+            xread,xwrite,xerr = select([self._sock], [], [], timeout)
+            if xread:
+                self._read_frames(batch.append, count)
+        return batch
+
+    def recv_packet(self, timeout):
+        pkts = self.recv_packets(1, timeout)
+        if pkts:
+            return pkts[0]
+        return None
+
+    def recv_packet_or_none(self):
+        return self.recv_packet(0)
+
+    def send_packet(self, xbuffer):
+        '''
+        Send a serialized packet (a bytes-like object) through the
+        transmit ring.
+        '''
+        self.queue_packet(xbuffer)
+        self.flush()
+        return True
+
+    def queue_packet(self, xbuffer):
+        '''
+        Copy a serialized packet into the next free frame of the transmit
+        ring, without sending it yet; flush() sends all queued frames.
+        Raises PcapException if no frame is freed within _tx_wait_timeout
+        seconds.
+        '''
+        xlen = len(xbuffer)
+        if xlen > self._tx_frame_size - _tx_data_offset:
+            raise PcapException("Packet of {} bytes is too large to send on {}".format(xlen, self._devname))
+        frame = self._tx_base + self._tx_cur * self._tx_frame_size
+        status = struct.unpack_from('=I', self._ring, frame + _tp_status_offset)[0]
+        deadline = None
+        while status & (TP_STATUS_SEND_REQUEST|TP_STATUS_SENDING):
+            # ring is full; wait for the kernel to catch up
+            now = monotonic()
+            if deadline is None:
+                deadline = now + _tx_wait_timeout
+            elif now >= deadline:
+                raise PcapException("Timed out waiting for a free transmit frame on {}".format(self._devname))
+            self.flush()
+            select([], [self._sock], [], min(0.1, deadline - now))
+            status = struct.unpack_from('=I', self._ring, frame + _tp_status_offset)[0]
+        if status & TP_STATUS_WRONG_FORMAT:
+            struct.pack_into('=I', self._ring, frame + _tp_status_offset, TP_STATUS_AVAILABLE)
+            raise PcapException("Kernel rejected a packet sent on {}".format(self._devname))
+        data = frame + _tx_data_offset
+        self._view[data:data+xlen] = xbuffer
+        struct.pack_into('=I', self._ring, frame + _tp_len_offset, xlen)
+        struct.pack_into('=I', self._ring, frame + _tp_status_offset, TP_STATUS_SEND_REQUEST)
+        self._tx_cur = (self._tx_cur + 1) % self._tx_frame_nr
+
+    def flush(self):
+        '''
+        Ask the kernel to send all frames queued in the transmit ring.
+        '''
+        try:
+            self._sock.send(b'', socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            raise PcapException("Error sending packet on {}: {}".format(self._devname, e))
+
+    def stats(self):
+        # the kernel resets its counters each time they're read
+        recv,drop = _tpacket_stats.unpack(self._sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 12)[:_tpacket_stats.size])
+        self._drop += drop
+        return PcapStats(self._recv, self._drop, 0)
+
+    def close(self):
+        self._view.release()
+        try:
+            self._ring.close()
+        except BufferError:
+            # frames returned by frames() are still referenced; the
+            # mapping goes away along with them
+            pass
+        self._sock.close()
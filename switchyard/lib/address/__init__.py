@@ -3,11 +3,38 @@ __author__ = 'jsommers@colgate.edu'
 from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network, ip_address
 from enum import Enum
 
-# make aliases for built-in ip_address class
-IPAddr = IPv4Address 
-
 import struct
 import socket
+import weakref
+
+
+class _InternTable(dict):
+    '''
+    Weak references to immutable address objects, keyed by the value
+    (bytes, string or integer) each was constructed from, so that
+    constructing an address that's already in use returns the existing
+    object.  Entries go away with the address they refer to, and no
+    entries are added beyond maxsize (addresses are then just created
+    as usual).
+    '''
+    __slots__ = ['maxsize']
+
+    def __init__(self, maxsize=65536):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def lookup(self, key):
+        ref = self.get(key)
+        return ref() if ref is not None else None
+
+    def intern(self, key, obj):
+        if len(self) < self.maxsize:
+            def _remove(ref, key=key, table=self):
+                if table.get(key) is ref:
+                    table.pop(key, None)
+            self[key] = weakref.ref(obj, _remove)
+        return obj
+
 
 # EthAddr class modified from POX code, license below.
 
@@ -28,34 +55,76 @@ import socket
 class EthAddr (object):
     """
     An Ethernet (MAC) address type.
+
+    EthAddr objects are immutable and interned: constructing one from
+    an EthAddr returns that same object, and constructing one from a
+    string or bytes value that's already in use returns the existing
+    object.
     """
-    __slots__ = ['__value']
+    __slots__ = ['__value', '__weakref__']
+    _interned = _InternTable()
 
-    def __init__ (self, addr=None):
+    def __new__ (cls, addr=None):
       """
       Understands Ethernet address is various forms.  Hex strings, raw byte
       strings, etc.
       """
-      # Always stores as a bytes object of length 6
-      self.__value = None
+      argtype = addr.__class__
+      if argtype is cls:
+          return addr
+      interned = argtype is bytes or argtype is str
+      if interned:
+          ref = cls._interned.get(addr)
+          if ref is not None:
+              obj = ref()
+              if obj is not None:
+                  return obj
 
+      # Always stores as a bytes object of length 6
+      value = None
       if isinstance(addr, bytes):
-          self.__value = bytes(addr[:6])
+          value = bytes(addr[:6])
       elif isinstance(addr, EthAddr):
-          self.__value = addr.raw
+          value = addr.raw
       elif addr is None:
-          self.__value = b'\x00' * 6
+          # not interned: unpickling calls __new__ without arguments,
+          # then fills in the value
+          value = b'\x00' * 6
       elif isinstance(addr, str):
           possible_separators = (':','-')
           for sep in possible_separators:
               if addr.count(sep) == 5:
-                  self.__value = bytes([ int(val,base=16) for val in addr.split(sep)])
+                  value = bytes([ int(val,base=16) for val in addr.split(sep)])
                   break
 
-      if not self.__value:
+      if not value:
           raise RuntimeError("Expected ethernet address string to be 6 raw " 
                                "bytes or some hex")
-  
+
+      if interned:
+          self = cls._interned.lookup(value)
+          if self is None:
+              self = cls._interned.intern(value, cls._create(value))
+          if argtype is str:
+              cls._interned.intern(addr, self)
+          return self
+      return cls._create(value)
+
+    @classmethod
+    def _create (cls, value):
+      self = super().__new__(cls)
+      self.__value = value
+      return self
+
+    def __reduce__ (self):
+        return self.__class__, (self.__value,)
+
+    def __copy__ (self):
+        return self
+
+    def __deepcopy__ (self, memo):
+        return self
+
     def isBridgeFiltered (self):
         """
         Checks if address is an IEEE 802.1D MAC Bridge Filtered MAC Group Address
@@ -137,12 +206,14 @@ class EthAddr (object):
         return self.toStr()
 
     def __eq__(self, other):
-        other = EthAddr(other)
-        return self.raw == other.raw
+        if other.__class__ is not EthAddr:
+            other = EthAddr(other)
+        return self.__value == other.__value
 
     def __lt__(self, other):
-        other = EthAddr(other)
-        return self.raw < other.raw
+        if other.__class__ is not EthAddr:
+            other = EthAddr(other)
+        return self.__value < other.__value
 
     def __hash__ (self):
         return hash(self.__value)
@@ -158,12 +229,108 @@ ethaddr = EthAddr
 macaddr = EthAddr
 
 
+class _InternedIPAddress(object):
+    '''
+    Construction for interned subclasses of the ipaddress address
+    types.  Their hash is computed once, when they're created.
+    '''
+    __slots__ = ()
+
+    def __new__(cls, address):
+        argtype = address.__class__
+        if argtype is cls:
+            return address
+        if argtype is cls._base and getattr(address, '_scope_id', None) is None:
+            address = address._ip
+            argtype = int
+        if not (argtype is int or argtype is bytes or argtype is str):
+            return cls._create(address)
+
+        ref = cls._interned.get(address)
+        if ref is not None:
+            obj = ref()
+            if obj is not None:
+                return obj
+        obj = cls._create(address)
+        key = obj._ip if getattr(obj, '_scope_id', None) is None else str(obj)
+        self = cls._interned.lookup(key)
+        if self is None:
+            self = cls._interned.intern(key, obj)
+        return cls._interned.intern(address, self)
+
+    def __init__(self, address):
+        pass
+
+    @classmethod
+    def _create(cls, address):
+        self = object.__new__(cls)
+        cls._base.__init__(self, address)
+        self._hash = cls._base.__hash__(self)
+        return self
+
+    def __hash__(self):
+        return self._hash
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return "{}('{}')".format(self._base.__name__, self)
+
+
+class IPAddr(_InternedIPAddress, IPv4Address):
+    '''
+    An IPv4 address.  This is an ipaddress.IPv4Address that's interned
+    like EthAddr, so that comparing, hashing and looking up addresses
+    in a dictionary don't allocate any objects.
+    '''
+    __slots__ = ['_hash']
+    _base = IPv4Address
+    _interned = _InternTable()
+
+    def __eq__(self, other):
+        if other.__class__ is IPAddr:
+            return self._ip == other._ip
+        return IPv4Address.__eq__(self, other)
+
+    def __lt__(self, other):
+        if other.__class__ is IPAddr:
+            return self._ip < other._ip
+        return IPv4Address.__lt__(self, other)
+
+    __hash__ = _InternedIPAddress.__hash__
+
+
+class IPv6Addr(_InternedIPAddress, IPv6Address):
+    '''
+    An IPv6 address, interned in the same way as IPAddr.
+    '''
+    __slots__ = ['_hash']
+    _base = IPv6Address
+    _interned = _InternTable()
+
+    def __eq__(self, other):
+        if other.__class__ is IPv6Addr:
+            return self._ip == other._ip and self._scope_id == other._scope_id
+        return IPv6Address.__eq__(self, other)
+
+    def __lt__(self, other):
+        if other.__class__ is IPv6Addr:
+            return self._ip < other._ip
+        return IPv6Address.__lt__(self, other)
+
+    __hash__ = _InternedIPAddress.__hash__
+
+
 class SpecialIPv6Addr(Enum):
-    UNDEFINED = ip_address('::')
-    ALL_NODES_LINK_LOCAL = ip_address('ff02::1')
-    ALL_ROUTERS_LINK_LOCAL = ip_address('ff02::2')
-    ALL_NODES_INTERFACE_LOCAL = ip_address('ff01::1')
-    ALL_ROUTERS_INTERFACE_LOCAL = ip_address('ff01::2')
+    UNDEFINED = IPv6Addr('::')
+    ALL_NODES_LINK_LOCAL = IPv6Addr('ff02::1')
+    ALL_ROUTERS_LINK_LOCAL = IPv6Addr('ff02::2')
+    ALL_NODES_INTERFACE_LOCAL = IPv6Addr('ff01::1')
+    ALL_ROUTERS_INTERFACE_LOCAL = IPv6Addr('ff01::2')
 
 #ff02::1:3 link local multicast name resolution
 #ff02::1:ff00:0/104 solicited-node
@@ -171,8 +338,8 @@ class SpecialIPv6Addr(Enum):
 
 
 class SpecialIPv4Addr(Enum):
-    IP_ANY = ip_address("0.0.0.0")
-    IP_BROADCAST = ip_address("255.255.255.255")
+    IP_ANY = IPAddr("0.0.0.0")
+    IP_BROADCAST = IPAddr("255.255.255.255")
 
 
 class SpecialEthAddr(Enum):
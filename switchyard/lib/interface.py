@@ -67,7 +67,7 @@ class Interface(object):
 
     @ipaddr.setter
     def ipaddr(self, value):
-        if isinstance(value, (str,IPAddr)):
+        if isinstance(value, (str,IPv4Address)):
             self.__ipaddr = ip_interface(value)
         elif value is None:
             self.__ipaddr = ip_interface('0.0.0.0')
@@ -81,7 +81,7 @@ class Interface(object):
 
     @netmask.setter
     def netmask(self, value):
-        if isinstance(value, (IPAddr,str,int)):
+        if isinstance(value, (IPv4Address,str,int)):
             self.__ipaddr = ip_interface("{}/{}".format(self.__ipaddr.ip, str(value)))
         elif value is None:
             self.__ipaddr = ip_interface("{}/32".format(self.__ipaddr.ip))
@@ -1,8 +1,10 @@
 import socket
 import ssl
-from threading import Thread
+import struct
+from threading import Thread, Lock, RLock
+from collections import deque
 import time
-from heapq import heappush, heappop, heapreplace
+from heapq import heappush, heappop, heapreplace, heapify
 from copy import deepcopy
 
 from switchyard.lib.packet import *
@@ -14,12 +16,32 @@ from switchyard.lib.exceptions import *
 
 
 class ControllerConnection(object):
-    def __init__(self, host, port, usetls=True):
+    '''
+    A connection to an Openflow controller.  Received bytes collect in
+    one buffer, from which every complete message is decoded (with the
+    header class for the version in its first byte) and queued.
+    Outgoing messages are queued and written with a single sendall by
+    flush(), which happens before blocking on a receive and whenever
+    the queue grows past flush_size bytes.  If a write fails, the
+    connection is closed (see disconnect) and made again on the next
+    send or receive.
+    '''
+    _oflibs = { 0x01: of10, 0x04: of13 }
+    _headerfmt = struct.Struct('!BBH')
+
+    def __init__(self, host, port, usetls=True, bufsize=65536, flush_size=65536):
         self._host = host
         self._port = port
         self._usetls = usetls
         self._connected = False
         self._socket = None
+        self._recvbuf = bytearray(bufsize)
+        self._start = self._end = 0 # undecoded bytes are _recvbuf[_start:_end]
+        self._received = deque()
+        self._sendq = []
+        self._sendq_len = 0
+        self._flush_size = flush_size
+        self._sendlock = Lock()
 
     def connect(self):
         self._socket = None
@@ -28,8 +50,14 @@ class ControllerConnection(object):
         else:
             self._socket = socket.socket()
         self._socket.settimeout(1.0)
+        # nothing left over from an earlier connection carries over
+        self._start = self._end = 0
+        self._received.clear()
+        with self._sendlock:
+            self._sendq = []
+            self._sendq_len = 0
         try:
-            self._socket.connect((host, port))
+            self._socket.connect((self._host, self._port))
             self._connected = True
         except:
             pass
@@ -37,6 +65,19 @@ class ControllerConnection(object):
     def isconnected(self):
         return self._connected
 
+    def disconnect(self):
+        '''
+        Close the connection, dropping any queued messages.
+        '''
+        self._connected = False
+        with self._sendlock:
+            self._sendq = []
+            self._sendq_len = 0
+        try:
+            self._socket.close()
+        except OSError:
+            pass
+
     @property
     def sock(self):
         return self._socket
@@ -50,44 +91,107 @@ class ControllerConnection(object):
             log_warn("Not connected to controller; could not send OFP message {}".format(pkt))
             return
 
-        log_debug("Sending Openflow message {} ({} bytes)".format(pkt, len(pkt)))
+        log_debug("Queueing Openflow message {} ({} bytes)".format(pkt, len(pkt)))
         raw = pkt.to_bytes()
-        remain = len(raw)
+        try:
+            with self._sendlock:
+                self._sendq.append(raw)
+                self._sendq_len += len(raw)
+                if self._sendq_len >= self._flush_size:
+                    self._flush()
+        except OSError as e:
+            log_warn("Error sending to controller ({}); disconnecting".format(e))
+            self.disconnect()
+
+    def flush(self):
+        '''
+        Send all queued messages.
+        '''
+        with self._sendlock:
+            self._flush()
 
-        while remain > 0:
-            rv = self._socket.send(raw[-remain:])
-            if rv == -1:
-                raise OSError("send error")
-            remain -= rv
+    def _flush(self):
+        if not self._sendq:
+            return
+        data = b''.join(self._sendq)
+        self._sendq = []
+        self._sendq_len = 0
+        self._socket.sendall(data)
 
     def receive_openflow_message(self):
         # FIXME: should have some null object stand in for the socket if there's no
         # connection...
+        if self._received:
+            return self._received.popleft()
         if not self._connected:
             self.connect()
         if not self._connected:
             return None
 
-        ofheader = of10.OpenflowHeader()
+        # about to block: get anything we owe the controller out first
+        try:
+            self.flush()
+        except OSError as e:
+            log_warn("Error sending to controller ({}); disconnecting".format(e))
+            self.disconnect()
+            return None
+        self._make_room()
         try:
-            data = self._socket.recv(ofheader.size())
+            n = self._socket.recv_into(memoryview(self._recvbuf)[self._end:])
         except socket.timeout:
             log_debug("Timeout waiting on receipt of OF message")
             return None
-        if len(data) == 0:
+        except OSError as e:
+            log_warn("Error receiving from controller ({}); disconnecting".format(e))
+            self.disconnect()
             return None
-        ofheader.from_bytes(data)
-
-        log_debug("Attempting to receive Openflow message (header: {}) ({} bytes)".format(
-            ofheader, ofheader.length))
-        remain = ofheader.length - ofheader.size()
-        while remain > 0:
-            more = self._socket.recv(remain)
-            data += more
-            remain -= len(more)
+        if n == 0:
+            return None
+        self._end += n
+        try:
+            self._decode_messages()
+        except OSError as e:
+            # messages before the bad one are still handed out
+            log_warn("Error receiving from controller ({}); disconnecting".format(e))
+            self.disconnect()
+        if self._received:
+            return self._received.popleft()
+        return None
 
-        p = Packet.from_bytes(data, of10.OpenflowHeader)
-        return p
+    def _make_room(self):
+        '''
+        Ensure there's free space at the end of the receive buffer,
+        moving undecoded bytes to the front, or growing the buffer if
+        they fill it (a message longer than the buffer).
+        '''
+        buf = self._recvbuf
+        if self._end < len(buf):
+            return
+        pending = self._end - self._start
+        if pending == len(buf):
+            buf.extend(bytes(len(buf)))
+        else:
+            buf[:pending] = buf[self._start:self._end]
+            self._start,self._end = 0,pending
+
+    def _decode_messages(self):
+        buf = self._recvbuf
+        start,end = self._start,self._end
+        unpack = self._headerfmt.unpack_from
+        while end - start >= 8:
+            version,_,length = unpack(buf, start)
+            if length < 8:
+                raise OSError("Bad Openflow message length {} from controller".format(length))
+            if end - start < length:
+                break
+            oflib = self._oflibs.get(version, of10)
+            p = Packet.from_bytes(bytes(buf[start:start+length]), oflib.OpenflowHeader)
+            log_debug("Received Openflow message {} ({} bytes)".format(p, length))
+            self._received.append(p)
+            start += length
+        if start == end:
+            start = end = 0
+        self._start,self._end = start,end
 
 
 class FullBuffer(Exception):
@@ -136,6 +240,15 @@ class TableEntry(object):
         self._bytes_matched = 0
         self._last_match = None
         self._creation_time = time.time()
+        # set by the FlowTable holding this entry
+        self._rank = self._priority
+        self._seq = 0
+        self._key = None
+        self._group = None
+        self._cache_keys = set()
+        self._live = False
+        self._queued = False
+        self._removed_reason = None
 
     @property
     def priority(self):
@@ -145,16 +258,13 @@ class TableEntry(object):
     def match(self):
         return self._match
 
-    @property 
+    @property
     def actions(self):
         return self._actions
 
     def __lt__(self, other):
         return self.priority < other.priority
 
-    def __eq__(self, other):
-        return self.priority == other.priority
-
     def __hash__(self):
         return self._cookie
 
@@ -163,29 +273,426 @@ class TableEntry(object):
         self._packets_matched += 1
         self._bytes_matched += len(pkt)
 
+    def expiry_time(self):
+        '''
+        Return the time (as from time.time()) after which this entry
+        times out, and the FlowRemovedReason, or (None, None) if it
+        has no timeouts.
+        '''
+        deadline = reason = None
+        if self._hard_timeout > 0:
+            deadline = self._creation_time + self._hard_timeout
+            reason = of10.FlowRemovedReason.HardTimeout
+        if self._idle_timeout > 0:
+            idle = (self._last_match or self._creation_time) + self._idle_timeout
+            if deadline is None or idle < deadline:
+                deadline = idle
+                reason = of10.FlowRemovedReason.IdleTimeout
+        return deadline, reason
+
     def has_expired(self, timestamp):
-        idletime = timestamp - self._last_match if self._last_match else timestamp
-        createtime = timestamp - self._creation_time
-        if self._idle_timeout > 0 and \
-           idletime > self._idle_timeout:
-            return True
-        if self._hard_timeout > 0 and \
-           createtime > self._hard_timeout:
-            return True
-        return False
+        deadline,_ = self.expiry_time()
+        return deadline is not None and timestamp > deadline
 
     def send_expire_notice(self):
-        return self._flags & FlowModFlags.SendFlowRemove.value
+        return self._flags & of10.FlowModFlags.SendFlowRemove.value
+
+
+# Match fields that are either exact or wildcarded, in the order their
+# values appear in a flow table key, with the OF1.0 wildcard for each.
+# nw_src and nw_dst are prefix-matched and always come last.
+_EXACT_FIELDS = (
+    ('in_port', 'InPort'), ('dl_src', 'DlSrc'), ('dl_dst', 'DlDst'),
+    ('dl_vlan', 'DlVlan'), ('dl_vlan_pcp', 'DlVlanPcp'), ('dl_type', 'DlType'),
+    ('nw_tos', 'NwTos'), ('nw_proto', 'NwProto'), ('tp_src', 'TpSrc'),
+    ('tp_dst', 'TpDst'),
+)
+_NW_SRC = len(_EXACT_FIELDS)
+_NW_DST = _NW_SRC + 1
+
+# stands in for a packet address no hashed entry can match, e.g., an
+# IPv6 address against an (IPv4) nw_src
+_NOMATCH = object()
+
+def _packet_fields(in_port, key):
+    '''
+    Build the values a flow table key can hold from in_port and a
+    packet's OpenflowMatch.packet_key: in _EXACT_FIELDS order followed
+    by nw_src and nw_dst as integers.  (A field whose headers disagree
+    is a value no entry holds, so it simply misses.)
+    '''
+    values = [in_port]
+    values.extend(key)
+    for i in (_NW_SRC, _NW_DST):
+        if values[i] is not None and values[i].__class__ is not int:
+            values[i] = _NOMATCH
+    return values
+
+def _entry_key(match):
+    '''
+    Return (mask, key, exact) for a match: the fields it doesn't
+    wildcard plus the nw_src/nw_dst prefix lengths, the values it
+    requires for them, and whether it wildcards nothing at all.
+    Returns None for a match that can't be hashed this way.
+    '''
+    if not isinstance(match, of10.OpenflowMatch):
+        return None
+    wildcards = set(match.wildcards)
+    wildall = 'All' in wildcards
+    fields = []
+    key = []
+    for i,(name,wcname) in enumerate(_EXACT_FIELDS):
+        if wildall or wcname in wildcards:
+            continue
+        value = getattr(match, name)
+        if name == 'in_port' and value == of10.OpenflowPort.NoPort:
+            continue
+        fields.append(i)
+        key.append(value)
+    prefixes = []
+    for name,wildbits in (('nw_src', match.nwsrc_wildcard), ('nw_dst', match.nwdst_wildcard)):
+        addr = getattr(match, name)
+        if not isinstance(addr, IPv4Address):
+            return None
+        prefixes.append(32 - wildbits)
+        key.append(int(addr) >> wildbits)
+    key = tuple(key)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    exact = len(fields) == len(_EXACT_FIELDS) and prefixes == [32, 32]
+    return (tuple(fields), tuple(prefixes)), key, exact
+
+def _entry_order(entry):
+    return (-entry._rank, entry._seq)
+
+def _bucket_add(buckets, key, entry):
+    bucket = buckets.get(key)
+    if bucket is None:
+        buckets[key] = [entry]
+    else:
+        bucket.append(entry)
+        bucket.sort(key=_entry_order)
+
+def _bucket_remove(buckets, key, entry):
+    bucket = buckets[key]
+    bucket.remove(entry)
+    if not bucket:
+        del buckets[key]
+
+def _linear_match(entry, in_port, pkt, key):
+    match = entry.match
+    if isinstance(match, of10.OpenflowMatch):
+        matched = match.matches_key(key)
+    else:
+        matched = match.matches_packet(pkt)
+    if not matched:
+        return False
+    if in_port is None or match.in_port == of10.OpenflowPort.NoPort or \
+       match.in_port == in_port:
+        return True
+    wildcards = getattr(match, 'wildcards', ())
+    return 'InPort' in wildcards or 'All' in wildcards
+
+
+class _WildcardGroup(object):
+    '''
+    The flow table entries that share one wildcard mask, hashed on
+    the values of the fields the mask doesn't wildcard.
+    '''
+    def __init__(self, mask):
+        fields,prefixes = mask
+        self.mask = mask
+        self._positions = [ (i, None) for i in fields ] + \
+            [ (_NW_SRC, 32 - prefixes[0]), (_NW_DST, 32 - prefixes[1]) ]
+        self._buckets = {}
+        # a packet missing the headers for some key fields is looked
+        # up in a projection that ignores those fields; there's one
+        # per distinct set of missing fields, built on first use
+        self._projections = {}
+        self._ranks = {}
+        self.maxrank = -1
+
+    def __len__(self):
+        return sum(self._ranks.values())
+
+    def _reduce(self, key, absent):
+        return tuple(v for v,(i,_) in zip(key, self._positions) if not absent & (1 << i))
+
+    def add(self, entry):
+        _bucket_add(self._buckets, entry._key, entry)
+        for absent,projection in self._projections.items():
+            _bucket_add(projection, self._reduce(entry._key, absent), entry)
+        self._ranks[entry._rank] = self._ranks.get(entry._rank, 0) + 1
+        self.maxrank = max(self.maxrank, entry._rank)
+
+    def remove(self, entry):
+        _bucket_remove(self._buckets, entry._key, entry)
+        for absent,projection in self._projections.items():
+            _bucket_remove(projection, self._reduce(entry._key, absent), entry)
+        self._ranks[entry._rank] -= 1
+        if not self._ranks[entry._rank]:
+            del self._ranks[entry._rank]
+            self.maxrank = max(self._ranks) if self._ranks else -1
+
+    def identical(self, key):
+        return self._buckets.get(key, ())
+
+    def packet_key(self, values):
+        '''
+        Return (absent, key) for the packet fields in values (from
+        _packet_fields): the fields the packet has no headers for, and
+        the key a matching entry has once those are left out of it.
+        Returns None if no entry in this group can match.
+        '''
+        key = []
+        absent = 0
+        for i,shift in self._positions:
+            v = values[i]
+            if v is None:
+                absent |= 1 << i
+            elif v is _NOMATCH:
+                return None
+            else:
+                key.append(v if shift is None else v >> shift)
+        return absent, tuple(key)
+
+    def lookup(self, values):
+        '''
+        Return the best entry in this group matching the packet
+        fields in values (from _packet_fields), or None.
+        '''
+        pkey = self.packet_key(values)
+        if pkey is None:
+            return None
+        absent,key = pkey
+        if absent:
+            buckets = self._projections.get(absent)
+            if buckets is None:
+                buckets = self._projections[absent] = {}
+                for entries in self._buckets.values():
+                    for entry in entries:
+                        _bucket_add(buckets, self._reduce(entry._key, absent), entry)
+        else:
+            buckets = self._buckets
+        bucket = buckets.get(key)
+        return bucket[0] if bucket else None
+
 
 class FlowTable(object):
-    def __init__(self, callbacks):
-        self._table = []
+    '''
+    An OF1.0 flow table, arranged for tuple space search: entries are
+    grouped by wildcard mask into hash tables, and a lookup probes the
+    groups in order of the best priority each holds, stopping once no
+    remaining group can beat the best match found so far.  As OF1.0
+    requires, an entry that wildcards nothing outranks every entry
+    that does.  Entries whose match can't be hashed are kept in
+    priority order and checked one by one.
+
+    In front of all that is an exact-match cache (of up to cache_size
+    entries; 0 turns it off) from a packet's header fields and input
+    port to the entry it matched, or to None for a table miss.  Adding
+    an entry evicts the cached packets it would now win; removing one
+    evicts the packets that resolved to it.  To find the former without
+    going through the whole cache, cached packets are also indexed, for
+    each wildcard group, by the key a matching entry in it would have.
+
+    Lookups and changes to the table are serialized by a lock, since
+    the datapath and the controller connections run in their own
+    threads; cache hits don't need it.
+
+    Entries with timeouts are kept in a heap by the time they'll next
+    time out.  Removed entries are left in it until they reach the top,
+    and an entry matched since it was queued is just queued again at
+    its new time, so neither matching nor removal touches the heap.
+    '''
+    def __init__(self, callbacks, cache_size=65536):
+        # entries in the order they were added; _table is a live view
+        self._entries = {}
+        self._table = self._entries.values()
         self._action_callbacks = callbacks
+        self._groups = {}
+        self._group_order = []
+        self._unindexed = []
+        self._seq = 0
+        self._cache = {}
+        # group mask -> absent fields -> entry key -> cached packet keys
+        self._cache_index = {}
+        self._cache_size = cache_size
+        self._lock = RLock()
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._expiry = []
+        self._expiry_stale = 0
 
     def __len__(self):
         return len(self._table)
 
+    @property
+    def cache_hits(self):
+        return self._cache_hits
+
+    @property
+    def cache_misses(self):
+        return self._cache_misses
+
+    def flush_cache(self):
+        with self._lock:
+            for entry in self._cache.values():
+                if entry is not None:
+                    entry._cache_keys.clear()
+            self._cache.clear()
+            self._cache_index.clear()
+
+    def _index_cached(self, ckey, groups):
+        values = _packet_fields(ckey[0], ckey[1:])
+        for group in groups:
+            pkey = group.packet_key(values)
+            if pkey is not None:
+                absent,key = pkey
+                index = self._cache_index.setdefault(group.mask, {}).setdefault(absent, {})
+                index.setdefault(key, set()).add(ckey)
+
+    def _cache_store(self, ckey, entry):
+        if ckey in self._cache:
+            self._uncache(ckey)
+        elif len(self._cache) >= self._cache_size:
+            self._uncache(next(iter(self._cache)))
+        self._cache[ckey] = entry
+        if entry is not None:
+            entry._cache_keys.add(ckey)
+        self._index_cached(ckey, self._groups.values())
+
+    def _uncache(self, ckey):
+        entry = self._cache.pop(ckey)
+        if entry is not None:
+            entry._cache_keys.discard(ckey)
+        values = _packet_fields(ckey[0], ckey[1:])
+        for group in self._groups.values():
+            pkey = group.packet_key(values)
+            if pkey is not None:
+                absent,key = pkey
+                index = self._cache_index[group.mask][absent]
+                ckeys = index[key]
+                ckeys.discard(ckey)
+                if not ckeys:
+                    del index[key]
+
+    def _insert(self, entry, indexinfo):
+        self._seq += 1
+        entry._seq = self._seq
+        entry._live = True
+        self._entries[entry._seq] = entry
+        deadline,_ = entry.expiry_time()
+        if deadline is not None:
+            heappush(self._expiry, (deadline, entry._seq, entry))
+            entry._queued = True
+        if indexinfo is None:
+            self._unindexed.append(entry)
+            self._unindexed.sort(key=_entry_order)
+        else:
+            mask,entry._key,exact = indexinfo
+            if exact:
+                entry._rank = entry.priority + 0x10000
+            group = self._groups.get(mask)
+            if group is None:
+                group = self._groups[mask] = _WildcardGroup(mask)
+                # index what's cached so far for the new group
+                for ckey in self._cache:
+                    self._index_cached(ckey, (group,))
+            entry._group = group
+            oldrank = group.maxrank
+            group.add(entry)
+            if group.maxrank != oldrank:
+                self._sort_groups()
+
+        if not isinstance(entry.match, of10.OpenflowMatch):
+            self.flush_cache()
+            return
+        order = _entry_order(entry)
+        if indexinfo is None:
+            candidates = list(self._cache)
+        else:
+            candidates = []
+            for absent,index in self._cache_index.get(mask, {}).items():
+                key = group._reduce(entry._key, absent) if absent else entry._key
+                candidates.extend(index.get(key, ()))
+        for ckey in candidates:
+            cached = self._cache[ckey]
+            if (cached is None or order < _entry_order(cached)) and \
+               (indexinfo is not None or _linear_match(entry, ckey[0], None, ckey[1:])):
+                self._uncache(ckey)
+
+    def _remove(self, entry):
+        del self._entries[entry._seq]
+        entry._live = False
+        if entry._queued:
+            self._expiry_stale += 1
+            if self._expiry_stale > len(self._expiry) // 2:
+                self._compact_expiry()
+        for ckey in list(entry._cache_keys):
+            self._uncache(ckey)
+        group = entry._group
+        if group is None:
+            self._unindexed.remove(entry)
+            return
+        oldrank = group.maxrank
+        group.remove(entry)
+        if not len(group):
+            del self._groups[group.mask]
+            self._cache_index.pop(group.mask, None)
+            self._sort_groups()
+        elif group.maxrank != oldrank:
+            self._sort_groups()
+
+    def _compact_expiry(self):
+        for _,_,entry in self._expiry:
+            entry._queued = entry._live
+        self._expiry = [ item for item in self._expiry if item[2]._live ]
+        heapify(self._expiry)
+        self._expiry_stale = 0
+
+    def _sort_groups(self):
+        self._group_order = sorted(self._groups.values(), key=lambda g: -g.maxrank)
+
+    def _identical(self, newentry, indexinfo):
+        '''
+        Find an entry with the same match and priority as newentry.
+        '''
+        candidates = self._unindexed
+        if indexinfo is not None:
+            group = self._groups.get(indexinfo[0])
+            candidates = group.identical(indexinfo[1]) if group else ()
+        for entry in candidates:
+            if entry.priority == newentry.priority and \
+               newentry.match.overlaps_with(entry.match, strict=True):
+                return entry
+        return None
+
+    def _lookup(self, in_port, pkt, key):
+        best = None
+        if self._group_order:
+            values = _packet_fields(in_port, key)
+            for group in self._group_order:
+                if best is not None and group.maxrank < best._rank:
+                    break
+                entry = group.lookup(values)
+                if entry is not None and \
+                   (best is None or _entry_order(entry) < _entry_order(best)):
+                    best = entry
+        for entry in self._unindexed:
+            if best is not None and _entry_order(entry) > _entry_order(best):
+                break
+            if _linear_match(entry, in_port, pkt, key):
+                return entry
+        return best
+
     def delete(self, matcher, strict=False):
+        with self._lock:
+            return self._delete(matcher, strict)
+
+    def _delete(self, matcher, strict):
         tbd = []
         for entry in self._table:
             if entry.match.overlaps_with(matcher, strict):
@@ -197,67 +704,107 @@ class FlowTable(object):
         # flow removed message
         notify = []
         for entry in tbd:
-            if FlowModFlags.SendFlowRemove in entry.get_flags:
+            if entry.send_expire_notice():
+                entry._removed_reason = of10.FlowRemovedReason.Delete
                 notify.append(entry)
             self._action_callbacks.beforeTableEntryDelete(self._table, entry)
-            self._table.remove(entry)
+            self._remove(entry)
             self._action_callbacks.afterTableEntryDelete(self._table, entry)
         return notify
 
     def add(self, fmod):
+        with self._lock:
+            return self._add(fmod)
+
+    def _add(self, fmod):
         newentry = TableEntry(fmod)
         self._action_callbacks.beforeTableEntryAdd(self._table, newentry)
         # match, cookie, idle_timeout, hard_timeout, priority, buffer_id, out_port, flags, actions
-        if FlowModFlags.CheckOverlap in fmod.get_flags():
-            for entry in self._table:
-                if newentry.match.overlaps_with(entry.match, strict=True) and \
-                   entry.priority == newentry.priority:
-                    return OpenflowFlowModFailedCode.Overlap
-        self._table.append(newentry)            
-        self._table.sort()
+        indexinfo = _entry_key(newentry.match)
+        existing = self._identical(newentry, indexinfo)
+        if existing is not None:
+            if of10.FlowModFlags.CheckOverlap in fmod.get_flags():
+                return of10.OpenflowFlowModFailedCode.Overlap
+            # OF1.0: an identical entry is replaced by the new one
+            self._remove(existing)
+        self._insert(newentry, indexinfo)
         self._action_callbacks.afterTableEntryAdd(self._table, newentry)
         return None
 
     def modify(self, fmod, strict=False):
+        with self._lock:
+            self._modify(fmod, strict)
+
+    def _modify(self, fmod, strict):
         newentry = TableEntry(fmod)
         self._action_callbacks.beforeTableEntryMod(self._table, newentry)
         matches = []
         for entry in self._table:
-            if newentry.match.overlaps_with(entry, strict=strict):
+            if newentry.match.overlaps_with(entry.match, strict=strict):
                 matches.append(entry)
         if len(matches):
             for entry in matches:
-                entry.match.actions = newentry.match.actions
+                entry._actions = newentry.actions
         else:
-            self._table.append(newentry)
-            self._table.sort()
+            self._insert(newentry, _entry_key(newentry.match))
 
         self._action_callbacks.afterTableEntryMod(self._table, newentry)
 
     def match_packet(self, in_port, pkt):
         self._action_callbacks.beforeTableLookup(pkt, self._table)
-        for entry in self._table:
-            if entry.match.matches_packet(pkt):
-                if in_port is None or entry.match.in_port == OpenflowPort.NoPort or \
-                   entry.match.in_port == in_port:
-                    self._action_callbacks.afterTableLookup(pkt, self._table)
-                    entry.update_counters(pkt)
-                    return entry.actions
+        key = of10.OpenflowMatch.packet_key(pkt)
+        if self._cache_size:
+            ckey = (in_port,) + tuple(key)
+            try:
+                entry = self._cache[ckey]
+                self._cache_hits += 1
+            except KeyError:
+                self._cache_misses += 1
+                # look up and cache together, so that an entry added
+                # in between can't be missed by what gets cached
+                with self._lock:
+                    entry = self._lookup(in_port, pkt, key)
+                    self._cache_store(ckey, entry)
+        else:
+            with self._lock:
+                entry = self._lookup(in_port, pkt, key)
         self._action_callbacks.afterTableLookup(pkt, self._table)
-        return None
+        if entry is None:
+            return None
+        entry.update_counters(pkt)
+        return entry.actions
 
-    def expire_entries(self):
-        now = time.time()
-        expired = []
-        i = 0
-        while i < len(self._table):
-            entry = self._table[i]
-            if entry.has_expired(now) and entry.send_expire_notice():
-                expired.append(entry)
-                del self._table[i]
-            else:
-                i += 1
-        return expired
+    def expire_entries(self, now=None):
+        '''
+        Remove every entry whose idle or hard timeout has passed, and
+        return the ones that asked for a flow removed message.
+        '''
+        if now is None:
+            now = time.time()
+        with self._lock:
+            return self._expire(now)
+
+    def _expire(self, now):
+        heap = self._expiry
+        notify = []
+        while heap and heap[0][0] < now:
+            _,seq,entry = heap[0]
+            if not entry._live:
+                heappop(heap)
+                entry._queued = False
+                self._expiry_stale -= 1
+                continue
+            deadline,reason = entry.expiry_time()
+            if deadline >= now:
+                heapreplace(heap, (deadline, seq, entry))
+                continue
+            heappop(heap)
+            entry._queued = False
+            self._remove(entry)
+            if entry.send_expire_notice():
+                entry._removed_reason = reason
+                notify.append(entry)
+        return notify
 
 class OpenflowSwitch(object):
     '''
@@ -339,9 +886,19 @@ class OpenflowSwitch(object):
             self._send_openflow_message_internal(cconn, pkt) 
 
         def _send_removal_notification(entries, why=self._oflib.FlowRemovedReason.Unknown):
+            now = time.time()
             for e in entries:
                 header = self._oflib.OpenflowHeader(self._oflib.OpenflowType.FlowRemoved, xid=self.xid)
-                removed = self._oflib.OpenflowFlowRemoved(why, e.match)
+                reason = why
+                if e._removed_reason is not None:
+                    reason = self._oflib.FlowRemovedReason(e._removed_reason)
+                removed = self._oflib.OpenflowFlowRemoved(reason, e.match)
+                removed.cookie = e._cookie
+                removed.priority = e.priority
+                removed.duration = now - e._creation_time
+                removed.idle_timeout = e._idle_timeout
+                removed.packet_count = e._packets_matched
+                removed.byte_count = e._bytes_matched
                 log_debug("Sending flow removal notification: {}".format(removed))
                 self._send_openflow_message_internal(cconn, header + removed)
 
@@ -382,27 +939,27 @@ class OpenflowSwitch(object):
             fmod = pkt[1]
             if fmod.command == self._oflib.FlowModCommand.Add:
                 log_debug("Flow mod add")
-                rv = self._table.add(fmod)
+                rv = self._tables[0].add(fmod)
                 if rv:
-                    _send_error(OpenflowErrorType.FlowModFailed, rv)
+                    _send_error(self._oflib.OpenflowErrorType.FlowModFailed, rv)
                 elif pkt[1].buffer_id != 2**32-1:
                     pp = self._buffer_manager.pop(pkt[1].buffer_id)
                     self._datapath_action(*pp)
 
             elif fmod.command == self._oflib.FlowModCommand.Modify:
                 log_debug("Flow mod modify")
-                self._table.modify(fmod, strict=False)
+                self._tables[0].modify(fmod, strict=False)
             elif fmod.command == self._oflib.FlowModCommand.ModifyStrict:
                 log_debug("Flow mod modify strict")
-                self._table.modify(fmod, strict=True)
+                self._tables[0].modify(fmod, strict=True)
             elif fmod.command == self._oflib.FlowModCommand.Delete:
                 log_debug("Flow mod delete")
-                notify = self._table.delete(fmod.match)
+                notify = self._tables[0].delete(fmod.match)
                 if notify:
                     _send_removal_notification(notify)
             elif fmod.command == self._oflib.FlowModCommand.DeleteStrict:
                 log_debug("Flow mod delete strict")
-                notify = self._table.delete(fmod.match, strict=True)
+                notify = self._tables[0].delete(fmod.match, strict=True)
                 if notify:
                     _send_removal_notification(notify)
             else:
@@ -494,7 +1051,7 @@ class OpenflowSwitch(object):
                 _send_removal_notification(entries)
 
         while True:
-            if not cconn.isconnected:
+            if not cconn.isconnected():
                 cconn.connect()
 
             pkt = self._receive_openflow_message_internal(cconn)
@@ -524,7 +1081,7 @@ class OpenflowSwitch(object):
     def _datapath_action(self, inport, packet, actions=None):
         log_debug("Datapath action for {}".format(str(packet)))
         if actions is None:
-            actions = self._table.match_packet(inport, packet)
+            actions = self._tables[0].match_packet(inport, packet)
 
         if actions is None:
             log_warn("Fail: in datapath_action but no table match.")
@@ -561,16 +1118,32 @@ class OpenflowSwitch(object):
         else:
             self._datapath_action(portnum, packet, actions=actions)
 
+    def _flush_controllers(self):
+        for _,cc in self._controller_connections:
+            if cc.isconnected():
+                try:
+                    cc.flush()
+                except OSError as e:
+                    # the controller thread will reconnect
+                    log_warn("Error sending to controller ({}); disconnecting".format(e))
+                    cc.disconnect()
+
     def datapath_loop(self):
         log_debug("datapath loop: READY to receive")
+        timeout = 1.0
         while True:
             try:
-                timestamp, inport, packet = self._switchyard_net.recv_packet(timeout=1.0)
+                timestamp, inport, packet = self._switchyard_net.recv_packet(timeout=timeout)
             except Shutdown:
                 break
             except NoPackets:
+                if not timeout:
+                    # caught up; send the packet-ins queued for this burst
+                    self._flush_controllers()
+                    timeout = 1.0
                 continue
             self._handle_datapath(inport, packet)
+            timeout = 0.0
 
     def shutdown(self):
         self._running = False
@@ -584,6 +1157,11 @@ class SwitchActionCallbacks(object):
     packets are processed, how rules are processed, and to inject artificial 
     delays at any of these points.  Inherit from this class and override any
     methods that will be useful for the particular application.
+
+    NB: before/afterControllerSend bracket handing a message to the
+    ControllerConnection, which only queues it; it's written to the
+    controller when the connection is flushed, so a delay injected
+    there delays queueing, not the write.
     '''
     def __init__(self):
         pass
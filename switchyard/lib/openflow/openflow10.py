@@ -5,7 +5,7 @@ from ipaddress import ip_network, ip_address
 
 from ..packet import PacketHeaderBase, Packet, IPProtocol, \
     EtherType, Ethernet, Vlan, IPv6, IPv4, ICMP, ICMPv6, TCP, UDP, Arp
-from ..address import EthAddr, IPv4Address
+from ..address import EthAddr, IPv4Address, IPv6Address
 from ..logging import log_debug
 
 def _make_bitmap(xset):
@@ -390,30 +390,54 @@ class OpenflowPacketQueue(OpenflowStruct):
             raw = raw[proplen:]
 
 
+# stands in for a packet field whose headers disagree (e.g., the
+# Ethernet and VLAN ethertypes), which no match field value equals
+_NOMATCH = object()
+
+def _make_key_sources(fieldmap, keyfields):
+    '''
+    Regroup a map of match field -> packet header attributes by
+    header class, so a key can be built with one header lookup
+    per class.
+    '''
+    sources = {}
+    for i,name in enumerate(keyfields):
+        for pktcls,attr in fieldmap[name]:
+            sources.setdefault(pktcls, []).append((i, attr))
+    return tuple((pktcls, tuple(attrs)) for pktcls,attrs in sources.items())
+
+
 class OpenflowMatch(OpenflowStruct):
     __slots__ = ['_wildcards', '_nw_src_wildcard', '_nw_dst_wildcard',
                  '_in_port', '_dl_src', '_dl_dst',
                  '_dl_vlan', '_dl_vlan_pcp', '_dl_type',
                  '_nw_tos', '_nw_proto', '_nw_src', '_nw_dst',
-                 '_tp_src', '_tp_dst']
+                 '_tp_src', '_tp_dst', '_predicate']
     _PACKFMT = '!IH6s6sHBxHBB2x4s4sHH'
     _MINLEN = struct.calcsize(_PACKFMT)
 
     _match_field_to_packet = {
         'dl_src': ((Ethernet, 'src'),),
         'dl_dst': ((Ethernet, 'dst'),),
-        'dl_vlan': ((Vlan, 'vlan'),),
+        'dl_vlan': ((Vlan, 'vlanid'),),
         'dl_vlan_pcp': ((Vlan, 'pcp'),),
         'dl_type': ((Vlan, 'ethertype'), (Ethernet, 'ethertype')),
-        'nw_proto': ((IPv4, 'protocol'),(IPv6, 'protocol'), (Arp, 'protocoltype')),
+        'nw_proto': ((IPv4, 'protocol'),(IPv6, 'nextheader'), (Arp, 'protocoltype')),
         'nw_tos': ((IPv4, 'tos'), (IPv6, 'trafficclass')),
         'nw_src': ((IPv4, 'src'), (IPv6, 'src'), (Arp, 'senderprotoaddr')),
         'nw_dst': ((IPv4, 'dst'), (IPv6, 'dst'), (Arp, 'targetprotoaddr')),
         'tp_src': ((TCP, 'src'), (UDP, 'src'), (ICMP, 'icmptype'), (ICMPv6, 'icmptype')),
-        'tp_dst': ((TCP, 'dst'), (TCP, 'dst'), (ICMP, 'icmpcode'), (ICMPv6, 'icmpcode')),
+        'tp_dst': ((TCP, 'dst'), (UDP, 'dst'), (ICMP, 'icmpcode'), (ICMPv6, 'icmpcode')),
     }
 
+    # the order of field values in a key from packet_key; nw_src and
+    # nw_dst come last
+    _key_fields = ('dl_src', 'dl_dst', 'dl_vlan', 'dl_vlan_pcp', 'dl_type',
+                   'nw_tos', 'nw_proto', 'tp_src', 'tp_dst', 'nw_src', 'nw_dst')
+    _key_sources = _make_key_sources(_match_field_to_packet, _key_fields)
+
     def __init__(self, **kwargs):
+        self._predicate = None
         self._wildcards = set()
         self._in_port = 0
         self._dl_src = EthAddr()
@@ -431,6 +455,12 @@ class OpenflowMatch(OpenflowStruct):
         self._tp_dst = 0
         OpenflowStruct.__init__(self, **kwargs)
 
+    def __setattr__(self, name, value):
+        # any change means the match has to be compiled again
+        if name != '_predicate':
+            OpenflowStruct.__setattr__(self, '_predicate', None)
+        OpenflowStruct.__setattr__(self, name, value)
+
     @staticmethod
     def size(*args):
         return OpenflowMatch._MINLEN
@@ -516,6 +546,7 @@ class OpenflowMatch(OpenflowStruct):
         attrs.discard('_wildcards')
         attrs.discard('_nw_src_wildcard')
         attrs.discard('_nw_dst_wildcard')
+        attrs.discard('_predicate')
         matchtest = []
         for a in attrs:
             curr = getattr(self, a)
@@ -534,36 +565,83 @@ class OpenflowMatch(OpenflowStruct):
             matchtest.append(iswildcarded or curr == other)
         return all(matchtest)
 
-    def matches_packet(self, pkt):
+    @staticmethod
+    def packet_key(pkt):
         '''
-        Return True if the given packet matches this match object.
+        Extract the values of all match fields from a packet, in the
+        order of OpenflowMatch._key_fields, for use with matches_key.
+        A field is None if the packet has none of the headers it comes
+        from; IPv4 addresses are converted to integers.
+        '''
+        key = [None] * len(OpenflowMatch._key_fields)
+        for pktcls,attrs in OpenflowMatch._key_sources:
+            hdr = pkt.get_header(pktcls)
+            if hdr is None:
+                continue
+            for i,attr in attrs:
+                value = getattr(hdr, attr)
+                if value is None:
+                    value = _NOMATCH
+                current = key[i]
+                if current is None:
+                    key[i] = value
+                elif current is not _NOMATCH and not current == value:
+                    key[i] = _NOMATCH
+        for i in (-2, -1):
+            if isinstance(key[i], IPv4Address):
+                key[i] = int(key[i])
+        return key
+
+    def _compile(self):
+        '''
+        Build a function that tests a key from packet_key against this
+        match, skipping wildcarded fields and comparing IPv4 prefixes
+        as masked integers.
         '''
-        match = []
+        namespace = {'_int': int, '_isinstance': isinstance, '_IPv6Address': IPv6Address}
+        lines = ['def predicate(k):']
         wildbits = _make_bitmap(self._wildcards)
-        for mf,pkttuple in OpenflowMatch._match_field_to_packet.items():
-            mf = "_{}".format(mf)
-
-            # if the attribute is a network address, respect the bits
-            if mf == '_nw_src' or mf == '_nw_dst':
-                # FIXME: clean me up.  lots of dup w/above and below :(
-                wattr = "{}_wildcard".format(mf)
-                bits = 32 - getattr(self, wattr)
+        for i,mf in enumerate(OpenflowMatch._key_fields):
+            value = getattr(self, mf)
+            const = '_c{}'.format(i)
+            test = 'v == {}'.format(const)
+            if mf == 'nw_src' or mf == 'nw_dst':
+                bits = 32 - getattr(self, '_{}_wildcard'.format(mf))
                 if bits < 32:
-                    netaddr = ip_network("{}/{}".format(getattr(self, mf), bits), strict=False)
-                    for pktcls,field in pkttuple: 
-                        if pkt.has_header(pktcls):
-                            match.append(getattr(pkt[pktcls], field) in netaddr)
-                    continue
-
-            # if attribute is simple wildcard, just ignore the attr
-            elif _wildcard_attr_map[mf].value & wildbits:
+                    value = ip_network("{}/{}".format(value, bits), strict=False)
+                    if value.version == 4:
+                        test = 'v.__class__ is _int and v & {} == {}'.format(
+                            int(value.netmask), int(value.network_address))
+                    else:
+                        test = '_isinstance(v, _IPv6Address) and v in {}'.format(const)
+                elif isinstance(value, IPv4Address):
+                    value = int(value)
+            elif _wildcard_attr_map['_' + mf].value & wildbits:
                 continue
+            namespace[const] = value
+            lines.append('    v = k[{}]'.format(i))
+            lines.append('    if v is not None and not ({}):'.format(test))
+            lines.append('        return False')
+        lines.append('    return True')
+        exec(compile('\n'.join(lines), '<OpenflowMatch>', 'exec'), namespace)
+        return namespace['predicate']
+
+    def matches_key(self, key):
+        '''
+        Return True if the packet that key was extracted from (with
+        packet_key) matches this match object.  The in_port field
+        isn't checked.
+        '''
+        predicate = self._predicate
+        if predicate is None:
+            predicate = self._predicate = self._compile()
+        return predicate(key)
 
-            # compare concrete values in packet with match object value
-            for pktcls,field in pkttuple:
-                if pkt.has_header(pktcls):
-                    match.append(getattr(pkt[pktcls], field) == getattr(self, mf))
-        return all(match)
+    def matches_packet(self, pkt):
+        '''
+        Return True if the given packet matches this match object.
+        '''
+        return self.matches_key(OpenflowMatch.packet_key(pkt))
 
     @staticmethod
     def build_from_packet(pkt):
@@ -590,6 +668,7 @@ class OpenflowMatch(OpenflowStruct):
     def add_wildcard(self, value):
         value = OpenflowWildcard(value)
         self._wildcards.add(value)
+        self._predicate = None
 
     def reset_wildcards(self):
         self._wildcards = set()
@@ -598,6 +677,7 @@ class OpenflowMatch(OpenflowStruct):
 
     def remove_wildcard(self, value):
         self._wildcards.discard(value)
+        self._predicate = None
 
     def wildcard_all(self):
         self._wildcards = set([OpenflowWildcard.All])
@@ -616,7 +696,7 @@ class OpenflowMatch(OpenflowStruct):
 
     @property
     def nwdst_wildcard(self):
-        return self._nw_src_wildcard
+        return self._nw_dst_wildcard
 
     @nwdst_wildcard.setter
     def nwdst_wildcard(self, value):
@@ -889,9 +969,11 @@ class ActionOutput(OpenflowAction):
         if self._port == OpenflowPort.Normal:
             raise Exception("I'm not normal")
         elif self._port == OpenflowPort.Flood:
-            for intf in net.interfaces():
-                if intf.ifnum != inport:
-                    net.send_packet(intf, packet)
+            # one batch, so the packet is only serialized once
+            results = net.send_packets([(intf, packet) for intf in net.interfaces() if intf.ifnum != inport])
+            for err in results:
+                if err is not None:
+                    raise err
         elif self._port == OpenflowPort.All:
             raise Exception("Not implemented")
         elif self._port == OpenflowPort.Controller:
@@ -1250,7 +1332,7 @@ class OpenflowEchoRequest(OpenflowStruct):
         return self._data
 
     def from_bytes(self, raw):
-        self.data = raw
+        self.data = bytes(raw)
 
 
 class OpenflowEchoReply(OpenflowEchoRequest):
@@ -867,9 +867,11 @@ class ActionOutput(OpenflowAction):
         if self._port == OpenflowPort.Normal:
             raise Exception("I'm not normal")
         elif self._port == OpenflowPort.Flood:
-            for intf in net.interfaces():
-                if intf.ifnum != inport:
-                    net.send_packet(intf, packet)
+            # one batch, so the packet is only serialized once
+            results = net.send_packets([(intf, packet) for intf in net.interfaces() if intf.ifnum != inport])
+            for err in results:
+                if err is not None:
+                    raise err
         elif self._port == OpenflowPort.All:
             raise Exception("Not implemented")
         elif self._port == OpenflowPort.Controller:
@@ -1228,7 +1230,7 @@ class OpenflowEchoRequest(OpenflowStruct):
         return self._data
 
     def from_bytes(self, raw):
-        self.data = raw
+        self.data = bytes(raw)
 
 
 
@@ -3331,7 +3333,7 @@ class OpenflowHeader(PacketHeaderBase):
         self.length = fields[2]
         self.xid = fields[3]
         raw = raw[OpenflowHeader._MINLEN:]
-        if self.type == OpenflowType.StatsRequest or self.type == OpenflowType.StatsReply:
+        if self.type == OpenflowType.MultipartRequest or self.type == OpenflowType.MultipartReply:
             if len(raw) >= 2: # JS??     
                 (statstype,) = struct.unpack('!H', raw[:2])
                 self._subtype = OpenflowStatsType(statstype)
@@ -3346,13 +3348,13 @@ class OpenflowHeader(PacketHeaderBase):
 
     def next_header_class(self):
         hdrcls = OpenflowHeader._OpenflowTypeClasses.get(self.type, None)
-        if self.type == OpenflowType.StatsRequest or \
-           self.type == OpenflowType.StatsReply and \
+        if (self.type == OpenflowType.MultipartRequest or \
+           self.type == OpenflowType.MultipartReply) and \
            self._subtype is not None:
 
-            clsname = "{}{}".format(self._subtype.name, self.type.name)
-            cls = globals()[clsname]
-            return cls
+            clsname = "{}Stats{}".format(self._subtype.name,
+                self.type.name[len("Multipart"):])
+            return globals().get(clsname, hdrcls)
 
         return hdrcls
 
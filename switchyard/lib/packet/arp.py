@@ -2,6 +2,7 @@ from .packet import PacketHeaderBase,Packet
 from ..address import EthAddr,IPAddr,SpecialIPv4Addr,SpecialEthAddr
 import struct
 from .common import EtherType, ArpHwType, ArpOperation
+from .codec import HeaderCodec, Field
 from ..exceptions import *
 
 '''
@@ -17,8 +18,17 @@ class Arp(PacketHeaderBase):
     __slots__ = ['_hwtype','_prototype','_hwaddrlen','_protoaddrlen',
                  '_operation','_senderhwaddr','_senderprotoaddr',
                  '_targethwaddr','_targetprotoaddr']
-    _PACKFMT = '!HHBBH6s4s6s4s'
-    _MINLEN = struct.calcsize(_PACKFMT)
+    _codec = HeaderCodec(
+        Field('_hwtype', 'H', ArpHwType),
+        Field('_prototype', 'H', EtherType),
+        Field('_hwaddrlen', 'B'),
+        Field('_protoaddrlen', 'B'),
+        Field('_operation', 'H', ArpOperation),
+        Field('_senderhwaddr', '6s', EthAddr),
+        Field('_senderprotoaddr', '4s', IPAddr),
+        Field('_targethwaddr', '6s', EthAddr),
+        Field('_targetprotoaddr', '4s', IPAddr))
+    _MINLEN = _codec.size
 
     def __init__(self, **kwargs):
         self._hwtype = ArpHwType.Ethernet
@@ -33,33 +43,24 @@ class Arp(PacketHeaderBase):
         super().__init__(**kwargs)
 
     def size(self):
-        return struct.calcsize(Arp._PACKFMT)
-
-    def pre_serialize(self, raw, pkt, i):
-        pass
+        return Arp._MINLEN
 
     def to_bytes(self):
         '''
         Return packed byte representation of the ARP header.
         '''
-        return struct.pack(Arp._PACKFMT, self._hwtype.value, self._prototype.value, self._hwaddrlen, self._protoaddrlen, self._operation.value, self._senderhwaddr.packed, self._senderprotoaddr.packed, self._targethwaddr.packed, self._targetprotoaddr.packed)
+        return Arp._codec.encode(self)
+
+    def write_into(self, buf, offset):
+        return Arp._codec.encode_into(self, buf, offset)
 
     def from_bytes(self, raw):
         '''Return an Ethernet object reconstructed from raw bytes, or an
            Exception if we can't resurrect the packet.'''
         if len(raw) < Arp._MINLEN:
             raise NotEnoughDataError("Not enough bytes ({}) to reconstruct an Arp object".format(len(raw)))
-        fields = struct.unpack(Arp._PACKFMT, raw[:Arp._MINLEN])
         try:
-            self._hwtype = ArpHwType(fields[0])
-            self._prototype = EtherType(fields[1])
-            self._hwaddrlen = fields[2]
-            self._protoaddrlen = fields[3]
-            self.operation = ArpOperation(fields[4])
-            self.senderhwaddr = EthAddr(fields[5])
-            self.senderprotoaddr = IPAddr(fields[6])
-            self.targethwaddr = EthAddr(fields[7])
-            self.targetprotoaddr = IPAddr(fields[8])
+            Arp._codec.decode(self, raw)
         except Exception as e:
             raise Exception("Error constructing Arp packet object from raw bytes: {}".format(str(e)))
         return raw[Arp._MINLEN:]
@@ -0,0 +1,170 @@
+import struct
+from enum import IntEnum
+
+from .common import enum_table
+from ..exceptions import NotEnoughDataError
+
+'''
+Declarative field specifications for fixed-layout packet headers.
+
+A header class lists its fields in wire order in a HeaderCodec, which
+compiles a struct.Struct for the whole layout and generates decode and
+encode functions specialized for it: one unpack (including bit fields,
+which are extracted with shifts and masks), and values assigned
+directly to the header's slots rather than through property setters.
+For example, the fields of the UDP header and a bit field holding the
+IPv4 fragment flags and offset:
+
+    _codec = HeaderCodec(
+        Field('_src', 'H'), Field('_dst', 'H'),
+        Field('_len', 'H'), Field('_checksum', 'H'))
+
+    BitFields('H', Field('_flags', 3, IPFragmentFlag),
+                   Field('_fragoffset', 13))
+'''
+
+class Field(object):
+    '''
+    A header field: the name of the attribute holding its value, its
+    struct format code (or, within BitFields, its width in bits), and
+    optionally the type that a decoded value is passed to (e.g., an
+    address class or any other callable).  Values of types that have a
+    packed attribute (addresses) are encoded with it.  The type may
+    also be an IntEnum, which is decoded through its EnumTable (so
+    unknown values don't raise), or a dict that maps decoded values
+    to the values to assign.
+
+    A field named None is padding: it's skipped when decoding, and
+    encoded as zero.  A readonly field is encoded from its attribute
+    (which may be a property that computes the value, e.g., a header
+    length) but is not assigned when decoding.
+    '''
+    __slots__ = ['name', 'fmt', 'type', 'readonly']
+
+    def __init__(self, name, fmt, type=None, readonly=False):
+        self.name = name
+        self.fmt = fmt
+        self.type = type
+        self.readonly = readonly
+
+
+class BitFields(object):
+    '''
+    Fields packed into a single integer with struct format code fmt,
+    given from the most to the least significant bits.  The widths of
+    the fields must add up to the size of the integer.
+    '''
+    __slots__ = ['fmt', 'fields']
+
+    def __init__(self, fmt, *fields):
+        self.fmt = fmt
+        self.fields = fields
+        bits = struct.calcsize('!' + fmt) * 8
+        if sum(f.fmt for f in fields) != bits:
+            raise ValueError("Bit field widths must add up to {}".format(bits))
+
+
+class HeaderCodec(object):
+    '''
+    Compiled codec for a header made of a sequence of Field and
+    BitFields objects (in network byte order, unless byteorder is
+    given).
+
+    size
+        The number of bytes in the encoded header.
+    decode(obj, raw)
+        Unpack the header from the start of raw and assign the field
+        values to obj.  Raises NotEnoughDataError if raw is too short.
+        Returns the tuple of unpacked (integer or bytes) values, e.g.,
+        for checking a version or length that isn't stored.
+    encode(obj)
+        Return the header packed from obj's attributes as bytes.
+    encode_into(obj, buf, offset)
+        Pack the header into the writable buffer buf at offset, and
+        return the number of bytes written.
+    '''
+    def __init__(self, *fields, byteorder='!'):
+        self.fields = fields
+        self.struct = struct.Struct(byteorder + ''.join(f.fmt for f in fields))
+        self.size = self.struct.size
+        self._compile()
+
+    def _compile(self):
+        namespace = {
+            '_unpack_from': self.struct.unpack_from,
+            '_pack': self.struct.pack,
+            '_pack_into': self.struct.pack_into,
+            'NotEnoughDataError': NotEnoughDataError,
+        }
+        assign = []
+        values = []
+
+        def decode_expr(field, expr):
+            if field.type is None:
+                return expr
+            tname = '_t{}'.format(len(namespace))
+            if isinstance(field.type, type) and issubclass(field.type, IntEnum):
+                namespace[tname] = enum_table(field.type)
+            else:
+                namespace[tname] = field.type
+            if isinstance(namespace[tname], dict):
+                return '{}[{}]'.format(tname, expr)
+            return '{}({})'.format(tname, expr)
+
+        def encode_expr(field):
+            if field.name is None:
+                return '0'
+            expr = 'obj.{}'.format(field.name)
+            if field.type is not None and hasattr(field.type, 'packed'):
+                expr += '.packed'
+            return expr
+
+        for i, spec in enumerate(self.fields):
+            var = 'v{}'.format(i)
+            if isinstance(spec, BitFields):
+                shift = sum(f.fmt for f in spec.fields)
+                parts = []
+                for field in spec.fields:
+                    shift -= field.fmt
+                    mask = (1 << field.fmt) - 1
+                    if field.name is not None and not field.readonly:
+                        expr = '{} >> {}'.format(var, shift) if shift else var
+                        expr = '{} & {}'.format(expr, mask)
+                        assign.append('obj.{} = {}'.format(field.name,
+                            decode_expr(field, expr)))
+                    if field.name is not None:
+                        expr = '({} & {})'.format(encode_expr(field), mask)
+                        if shift:
+                            expr += ' << {}'.format(shift)
+                        parts.append(expr)
+                values.append(' | '.join(parts) or '0')
+            else:
+                if spec.name is not None and not spec.readonly:
+                    assign.append('obj.{} = {}'.format(spec.name,
+                        decode_expr(spec, var)))
+                values.append(encode_expr(spec))
+
+        varlist = ', '.join('v{}'.format(i) for i in range(len(self.fields)))
+        source = '\n'.join([
+            'def decode(obj, raw):',
+            '    if len(raw) < {}:'.format(self.size),
+            '        raise NotEnoughDataError("Not enough bytes ({}) to '
+                'reconstruct {} header".format(len(raw), '
+                'obj.__class__.__name__))',
+            '    v = _unpack_from(raw)',
+            '    {}, = v'.format(varlist),
+        ] + ['    ' + line for line in assign] + [
+            '    return v',
+            '',
+            'def encode(obj):',
+            '    return _pack({})'.format(', '.join(values)),
+            '',
+            'def encode_into(obj, buf, offset):',
+            '    _pack_into(buf, offset, {})'.format(', '.join(values)),
+            '    return {}'.format(self.size),
+        ])
+        exec(compile(source, '<HeaderCodec>', 'exec'), namespace)
+        self.source = source
+        self.decode = namespace['decode']
+        self.encode = namespace['encode']
+        self.encode_into = namespace['encode_into']
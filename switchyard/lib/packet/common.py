@@ -1,8 +1,14 @@
+import copyreg
 import struct
-import array
+import sys
 from enum import IntEnum
 from socket import ntohs
 
+try:
+    import numpy as _numpy
+except ImportError:
+    _numpy = None
+
 
 class EtherType(IntEnum):
     NoType = 0xFFFF
@@ -293,6 +299,51 @@ class ICMPv6OptionNumber(IntEnum):
     MTU = 5
 
 
+class EnumTable(dict):
+    '''
+    A map from integer values to the members of an IntEnum, built once,
+    for decoding header fields without going through the enum
+    constructor.  A value that isn't a member of the enum maps to a
+    stand-in pseudo-member (named Unknown<value>, with that value)
+    instead of raising ValueError.  Stand-ins are created once per
+    value.  Members of the enum (stand-ins included) pickle as a
+    lookup in the table, since the enum constructor rejects stand-ins.
+    '''
+    __slots__ = ['enumcls']
+    _MAXUNKNOWN = 65536
+
+    def __init__(self, enumcls):
+        super().__init__((m.value, m) for m in enumcls.__members__.values())
+        self.enumcls = enumcls
+        copyreg.pickle(enumcls, _reduce_enum_member)
+
+    def __missing__(self, value):
+        member = int.__new__(self.enumcls, value)
+        member._name_ = 'Unknown{}'.format(value)
+        member._value_ = value
+        if len(self) < self._MAXUNKNOWN:
+            self[value] = member
+        return member
+
+
+_enum_tables = {}
+
+def _enum_member(enumcls, value):
+    return enum_table(enumcls)[value]
+
+def _reduce_enum_member(member):
+    return _enum_member, (member.__class__, member._value_)
+
+def enum_table(enumcls):
+    '''
+    Return the EnumTable for enumcls.
+    '''
+    table = _enum_tables.get(enumcls)
+    if table is None:
+        table = _enum_tables[enumcls] = EnumTable(enumcls)
+    return table
+
+
 # the following checksum function was taken from the POX openflow controller
 
 # Copyright 2011,2012 James McCauley
@@ -323,23 +374,42 @@ def checksum (data, start = 0, skip_word = None):
              data which contains a computed checksum that you are trying to
              verify -- you want to skip that word since it was zero when
              the checksum was initially calculated.
-  """
-  if len(data) % 2 != 0:
-    arr = array.array('H', data[:-1])
-  else:
-    arr = array.array('H', data)
 
+  data may be any bytes-like object (bytes, bytearray, memoryview).
+  """
+  if not isinstance(data, (bytes, bytearray)):
+    data = memoryview(data).cast('B')
+  xlen = len(data)
+  nwords = xlen >> 1
+  if skip_word is not None and not 0 <= skip_word < nwords:
+    skip_word = None
+
+  if (_numpy is None or xlen < _NUMPY_MINLEN) and \
+      0 <= start <= 0xffff and xlen <= 0x20000:
+    # 2**16 == 1 (mod 0xffff), so the sum of the 16 bit words is
+    # congruent to the whole buffer taken as one integer; as long as
+    # the sum stays below 2**32, folding it down gives the same value
+    # as the two folds below.
+    value = int.from_bytes(data, _BYTEORDER)
+    if _BYTEORDER == 'big':
+      if xlen & 1:
+        value <<= 8
+      shift = 16 * ((xlen + 1) // 2 - 1 - skip_word) if skip_word is not None else 0
+    else:
+      shift = 16 * skip_word if skip_word is not None else 0
+    if skip_word is not None:
+      value -= _word(data, skip_word) << shift
+    start += value
+    folded = start % 0xffff
+    if folded == 0 and start:
+      folded = 0xffff
+    return ntohs(~folded & 0xffff)
+
+  start += _sum_words(data, nwords)
   if skip_word is not None:
-    for i in range(0, len(arr)):
-      if i == skip_word:
-        continue
-      start +=  arr[i]
-  else:
-    for i in range(0, len(arr)):
-      start +=  arr[i]
-
-  if len(data) % 2 != 0:
-    start += struct.unpack('H', data[-1:]+b'\x00')[0] # Specify order?
+    start -= _word(data, skip_word)
+  if xlen & 1:
+    start += struct.unpack('H', bytes(data[-1:])+b'\x00')[0] # Specify order?
 
   start  = (start >> 16) + (start & 0xffff)
   start += (start >> 16)
@@ -347,3 +417,79 @@ def checksum (data, start = 0, skip_word = None):
   #  start = (start >> 16) + (start & 0xffff)
 
   return ntohs(~start & 0xffff)
+
+
+def checksum_many (buffers, start = 0):
+  """
+  Calculate the internet checksum of each buffer in a sequence of
+  bytes-like objects; returns a list with the same result as calling
+  checksum(buf, start) on each buffer.  With numpy available, the
+  buffers are summed together in one pass.
+  """
+  buffers = list(buffers)
+  if _numpy is None or not 0 <= start <= 0xffff or \
+      sum(len(buf) for buf in buffers) < _NUMPY_MINLEN:
+    return [checksum(buf, start) for buf in buffers]
+
+  # pad odd-length buffers so that each starts on a word boundary,
+  # then sum the words belonging to each buffer
+  parts = []
+  offsets = []
+  nwords = 0
+  for buf in buffers:
+    offsets.append(nwords)
+    parts.append(buf)
+    xlen = len(buf)
+    if xlen & 1:
+      parts.append(b'\x00')
+      xlen += 1
+    nwords += xlen >> 1
+  words = _numpy.frombuffer(b''.join(parts), dtype=_numpy.uint16)
+  sums = _numpy.zeros(len(buffers), dtype=_numpy.uint64)
+  nonempty = [i for i in range(len(buffers)) if len(buffers[i])]
+  if nonempty:
+    sums[nonempty] = _numpy.add.reduceat(words.astype(_numpy.uint64),
+        [offsets[i] for i in nonempty])
+  sums += start
+  sums = (sums >> 16) + (sums & 0xffff)
+  sums += (sums >> 16)
+  return [ntohs(~int(x) & 0xffff) for x in sums]
+
+
+def checksum_update (csum, old, new):
+  """
+  Incrementally update an internet checksum (a value returned by
+  checksum()) when part of the checksummed data changes from old to
+  new, without touching the rest of the data (RFC 1624, eqn. 3:
+  HC' = ~(~HC + ~m + m')).
+
+  old and new are the (unsigned, big endian) integer values of the
+  changed field.  The field must start on a 16 bit boundary but may
+  be wider than 16 bits (e.g., a 32 bit address, or a whole header
+  taken with int.from_bytes(hdr, 'big')); a byte-wide field in the
+  upper half of a word must be shifted left by 8 bits.
+  """
+  # 2**16 == 1 (mod 0xffff), so a wide value is congruent to the
+  # one's complement sum of its 16 bit words
+  value = ((~csum & 0xffff) + new - old) % 0xffff
+  if value == 0:
+    return 0
+  return ~value & 0xffff
+
+
+# buffers at least this long are summed with numpy, if it's available
+_NUMPY_MINLEN = 1024
+
+_BYTEORDER = sys.byteorder
+
+def _word (data, i):
+  return struct.unpack_from('H', data, 2 * i)[0]
+
+def _sum_words (data, nwords):
+  """
+  Exact sum of the first nwords 16 bit (host byte order) words in data.
+  """
+  if _numpy is not None:
+    return int(_numpy.frombuffer(data, dtype=_numpy.uint16,
+        count=nwords).sum(dtype=_numpy.uint64))
+  return sum(memoryview(data)[:2 * nwords].cast('H'))
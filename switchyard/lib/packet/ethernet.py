@@ -4,10 +4,19 @@ from ..address import EthAddr,SpecialEthAddr
 from .arp import Arp
 from .ipv4 import IPv4
 from .ipv6 import IPv6
-from .common import EtherType
+from .common import EtherType, enum_table
+from .codec import HeaderCodec, Field, BitFields
 from ..exceptions import *
 
 
+def _vlan_pcp(value):
+    return max(min(value, 3), 0)
+
+# 802.3 frames have a length rather than an ethertype
+_ethertypes = enum_table(EtherType)
+_ethertypes.update(dict.fromkeys(range(1501), EtherType.NoType))
+
+
 class Vlan(PacketHeaderBase):
     '''
     Strictly speaking this header doesn't fully represent the 802.1Q header, 
@@ -25,8 +34,10 @@ class Vlan(PacketHeaderBase):
     '''
 
     __slots__ = ['_vlanid', '_pcp', '_ethertype']
-    _PACKFMT = '!HH'
-    _MINLEN = struct.calcsize(_PACKFMT)
+    _codec = HeaderCodec(
+        BitFields('H', Field('_pcp', 4, _vlan_pcp), Field('_vlanid', 12)),
+        Field('_ethertype', 'H', EtherType))
+    _MINLEN = _codec.size
     _next_header_map = {
         EtherType.IP: IPv4,
         EtherType.ARP: Arp,
@@ -70,18 +81,14 @@ class Vlan(PacketHeaderBase):
         self._ethertype = EtherType(value)
 
     def from_bytes(self, raw):
-        if len(raw) < Vlan._MINLEN:
-            raise NotEnoughDataError("Not enough bytes to unpack Vlan header; need {}, "
-                "only have {}".format(Vlan._MINLEN, len(raw)))
-        fields = struct.unpack(Vlan._PACKFMT, raw[:Vlan._MINLEN])
-        self.vlanid = fields[0]
-        self.pcp = ((fields[0] & 0xf000) >> 12)
-        self.ethertype = fields[1]
+        Vlan._codec.decode(self, raw)
         return raw[Vlan._MINLEN:]
 
     def to_bytes(self):
-        return struct.pack(Vlan._PACKFMT, ((self._pcp << 12) | self._vlanid), 
-            self._ethertype.value)
+        return Vlan._codec.encode(self)
+
+    def write_into(self, buf, offset):
+        return Vlan._codec.encode_into(self, buf, offset)
 
     def __eq__(self, other):
         return isinstance(other, Vlan) and \
@@ -96,8 +103,11 @@ class Vlan(PacketHeaderBase):
 
 class Ethernet(PacketHeaderBase):
     __slots__ = ['_src','_dst','_ethertype']
-    _PACKFMT = '!6s6sH'
-    _MINLEN = struct.calcsize(_PACKFMT)
+    _codec = HeaderCodec(
+        Field('_dst', '6s', EthAddr),
+        Field('_src', '6s', EthAddr),
+        Field('_ethertype', 'H', _ethertypes))
+    _MINLEN = _codec.size
     _next_header_map = {
         EtherType.IP: IPv4,
         EtherType.ARP: Arp,
@@ -113,7 +123,7 @@ class Ethernet(PacketHeaderBase):
         super().__init__(**kwargs)
 
     def size(self):
-        return struct.calcsize(Ethernet._PACKFMT)
+        return Ethernet._MINLEN
 
     @property
     def src(self):
@@ -143,23 +153,15 @@ class Ethernet(PacketHeaderBase):
         '''
         Return packed byte representation of the Ethernet header.
         '''
-        return struct.pack(Ethernet._PACKFMT, self._dst.packed, 
-            self._src.packed, self._ethertype.value)
+        return Ethernet._codec.encode(self)
+
+    def write_into(self, buf, offset):
+        return Ethernet._codec.encode_into(self, buf, offset)
 
     def from_bytes(self, raw):
         '''Return an Ethernet object reconstructed from raw bytes, or an
         Exception if we can't resurrect the packet.'''
-        if len(raw) < Ethernet._MINLEN:
-            raise NotEnoughDataError("Not enough bytes ({}) to reconstruct an "
-                "Ethernet object".format(len(raw)))
-        dst,src,ethertype = struct.unpack(Ethernet._PACKFMT, 
-            raw[:Ethernet._MINLEN])
-        self.src = src
-        self.dst = dst
-        if ethertype <= 1500:
-            self.ethertype = EtherType.NoType
-        else:
-            self.ethertype = ethertype
+        Ethernet._codec.decode(self, raw)
         return raw[Ethernet._MINLEN:]
 
     def __eq__(self, other):
@@ -3,7 +3,7 @@ from enum import IntEnum
 from ipaddress import IPv4Address
 
 from .packet import PacketHeaderBase,Packet
-from .common import checksum, ICMPType, ICMPTypeCodeMap
+from .common import checksum, ICMPType, ICMPTypeCodeMap, enum_table
 from ..exceptions import *
 
 '''
@@ -13,6 +13,12 @@ TCP/IP Illustrated, Vol 1.
 '''
 
 
+class _ICMPCodeUnknown(IntEnum):
+    '''
+    Codes of ICMP types that have no code enumeration of their own.
+    '''
+
+
 class ICMP(PacketHeaderBase):
     '''
     A mother class for all ICMP message types.  It holds a reference
@@ -54,27 +60,32 @@ class ICMP(PacketHeaderBase):
     def size(self):
         return struct.calcsize(ICMP._PACKFMT) + len(self._icmpdata.to_bytes())
 
-    def checksum(self):
-        self._checksum = checksum(b''.join( (struct.pack(ICMP._PACKFMT, self._type.value, self._code.value, 0), self._icmpdata.to_bytes())))
+    def checksum(self, databytes=None):
+        if databytes is None:
+            databytes = self._icmpdata.to_bytes()
+        self._checksum = checksum(b''.join( (struct.pack(ICMP._PACKFMT, self._type.value, self._code.value, 0), databytes)))
         return self._checksum
 
     def to_bytes(self, dochecksum=True):
         '''
         Return packed byte representation of the UDP header.
         '''
+        databytes = self._icmpdata.to_bytes()
         csum = 0
         if dochecksum:
-            csum = self.checksum()
-        return b''.join((struct.pack(ICMP._PACKFMT, self._type.value, self._code.value, csum), self._icmpdata.to_bytes()))
+            csum = self.checksum(databytes)
+        return b''.join((struct.pack(ICMP._PACKFMT, self._type.value, self._code.value, csum), databytes))
 
     def from_bytes(self, raw):
         if len(raw) < ICMP._MINLEN:
             raise NotEnoughDataError("Not enough bytes ({}) to reconstruct an ICMP object".format(len(raw)))
-        fields = struct.unpack(ICMP._PACKFMT, raw[:ICMP._MINLEN])
-        self._type = self._valid_types(fields[0])
-        self._code = self._valid_codes_map[self.icmptype](fields[1])
+        fields = struct.unpack_from(ICMP._PACKFMT, raw)
+        self._type = enum_table(self._valid_types)[fields[0]]
+        codes = self._valid_codes_map.get(self._type, _ICMPCodeUnknown)
+        self._code = enum_table(codes)[fields[1]]
         self._checksum = fields[2]
-        self._icmpdata = self._classtype_from_icmptype(self._type)()
+        # types without a class of their own just keep the raw data
+        self._icmpdata = (self._classtype_from_icmptype(self._type) or ICMPData)()
         self._icmpdata.from_bytes(raw[ICMP._MINLEN:])
         return raw[self.size():]
 
@@ -131,9 +142,6 @@ class ICMP(PacketHeaderBase):
     def next_header_class(self):
         return None
 
-    def pre_serialize(self, raw, pkt, i):
-        return
-
     @property
     def icmpdata(self):
         return self._icmpdata
@@ -215,7 +223,7 @@ class ICMPRedirect(ICMPData):
     def from_bytes(self, raw):
         if len(raw) < 4:
             raise NotEnoughDataError("Not enough bytes ({}) to reconstruct ICMPRedirect data object".format(len(raw)))
-        fields = struct.unpack('!I', raw[:4])
+        fields = struct.unpack_from('!I', raw)
         self._redirectto = IPv4Address(fields[0])
         super().from_bytes(raw[4:])
 
@@ -244,7 +252,7 @@ class ICMPDestinationUnreachable(ICMPData):
     def from_bytes(self, raw):
         if len(raw) < 4:
             raise NotEnoughDataError("Not enough bytes ({}) to reconstruct ICMPDestinationUnreachable data object".format(len(raw)))
-        fields = struct.unpack('!xBH', raw[:4])
+        fields = struct.unpack_from('!xBH', raw)
         self._origdgramlen = fields[0]
         self._nexthopmtu = fields[1]
         super().from_bytes(raw[4:])
@@ -291,8 +299,7 @@ class ICMPEchoRequest(ICMPData):
     def from_bytes(self, raw):
         if len(raw) < 4:
             raise NotEnoughDataError("Not enough bytes ({}) to reconstruct {} data object".format(len(raw)))
-        fields = struct.unpack(ICMPEchoRequest._PACKFMT, 
-            raw[:ICMPEchoRequest._MINLEN])
+        fields = struct.unpack_from(ICMPEchoRequest._PACKFMT, raw)
         self._identifier = fields[0]
         self._sequence = fields[1]
         super().from_bytes(raw[4:])
@@ -342,7 +349,7 @@ class ICMPTimeExceeded(ICMPData):
     def from_bytes(self, raw):
         if len(raw) < 4:
             raise NotEnoughDataError("Not enough bytes ({}) to reconstruct ICMPTimeExceeded data object".format(len(raw)))
-        fields = struct.unpack('!xBH', raw[:4])
+        fields = struct.unpack_from('!xBH', raw)
         self._origdgramlen = fields[0]
         self._nexthopmtu = fields[1]
         super().from_bytes(raw[4:])
@@ -385,10 +392,10 @@ class ICMPAddressMaskRequest(ICMPData):
     def from_bytes(self, raw):
         if len(raw) < ICMPAddressMaskRequest._MINLEN:
             raise NotEnoughDataError("Not enough bytes to unpack ICMPAddressMaskRequest object")
-        fields = struct.unpack(ICMPAddressMaskRequest._PACKFMT, raw[:4])
+        fields = struct.unpack_from(ICMPAddressMaskRequest._PACKFMT, raw)
         self._identifier = fields[0]
         self._sequence = fields[1]
-        self._addrmask = IPv4Address(raw[4:8])
+        self._addrmask = IPv4Address(bytes(raw[4:8]))
         return b''
 
     @property
@@ -451,7 +458,6 @@ def construct_icmp_class_map():
         cls = eval(clsname)
         clsmap[xtype] = cls
     def inner(icmptype):
-        icmptype = ICMPType(icmptype)
         return clsmap.get(icmptype, None)
     return inner
 
@@ -3,7 +3,7 @@ from ipaddress import IPv6Address
 from abc import ABCMeta
 
 from .icmp import ICMP, ICMPData, ICMPEchoRequest, ICMPEchoReply
-from .common import ICMPv6Type, ICMPv6TypeCodeMap, ICMPv6OptionNumber
+from .common import ICMPv6Type, ICMPv6TypeCodeMap, ICMPv6OptionNumber, enum_table
 from .common import checksum as csum
 from ..address import EthAddr
 from ..exceptions import *
@@ -42,7 +42,7 @@ class ICMPv6(ICMP):
             self.icmptype = kwargs['icmptype']
             # del kwargs['icmptype']
 
-    def checksum(self):
+    def checksum(self, databytes=None):
         return self._checksum
 
     def _compute_checksum(self, src, dst, raw):
@@ -62,6 +62,12 @@ class ICMPv6(ICMP):
         assert(ip6hdr is not None)
         self._compute_checksum(ip6hdr.src, ip6hdr.dst, raw)
 
+    def _serialize_context(self, pkt, i):
+        ip6hdr = pkt.get_header('IPv6')
+        if ip6hdr is None:
+            return ()
+        return (ip6hdr.src, ip6hdr.dst)
+
 
 class ICMPv6Option(object, metaclass=ABCMeta):
     _PACKFMT = 'B'
@@ -110,7 +116,7 @@ class ICMPv6OptionLinkLayerAddress(ICMPv6Option):
         # length of option header (t + l + v = 2 + length_)
         # current implementation supports only Ethernet addresses
         assert (length_ - 2) == len(EthAddr())
-        self._linklayeraddress = EthAddr(raw[2:length_])
+        self._linklayeraddress = EthAddr(bytes(raw[2:length_]))
         return length_
 
     def __str__(self):
@@ -166,7 +172,7 @@ class ICMPv6OptionRedirectedHeader(ICMPv6Option):
         length_ = raw[1] * 8
         # length of option header (t + l + v = 2 + length_)
 
-        self._packetdata = raw[2:length_]
+        self._packetdata = bytes(raw[2:length_])
         return length_
 
     def __str__(self):
@@ -178,6 +184,44 @@ class ICMPv6OptionMTU(ICMPv6Option):
     pass
 
 
+class ICMPv6OptionUnknown(ICMPv6Option):
+    '''
+    An option of a type without its own class.  Its data is kept as
+    received, so the option serializes back unchanged.
+    '''
+    __slots__ = ['_data']
+
+    def __init__(self, optnum=0, data=b''):
+        self._optnum = enum_table(ICMPv6OptionNumber)[optnum]
+        self._data = data
+
+    @property
+    def data(self):
+        return self._data
+
+    def length(self):
+        return 2 + len(self._data)
+
+    def from_bytes(self, raw):
+        length_ = raw[1] * 8 if len(raw) > 1 else 0
+        if not length_ or length_ > len(raw):
+            raise ValueError("Malformed ICMPv6 option (type {}, length {})".format(raw[0], length_))
+        self._optnum = enum_table(ICMPv6OptionNumber)[raw[0]]
+        self._data = bytes(raw[2:length_])
+        return length_
+
+    def to_bytes(self):
+        return struct.pack('!BB', self._optnum.value, self.length() // 8) + self._data
+
+    def __eq__(self, other):
+        return isinstance(other, ICMPv6OptionUnknown) and \
+            self._optnum == other._optnum and self._data == other._data
+
+    def __str__(self):
+        return "{} {} ({} bytes)".format(super().__str__(), self._optnum.name,
+            len(self._data))
+
+
 ICMPv6OptionClasses = {
     ICMPv6OptionNumber.SourceLinkLayerAddress:
         ICMPv6OptionSourceLinkLayerAddress,
@@ -204,8 +248,8 @@ class ICMPv6OptionList(object):
         i = 0
         while i < len(rawbytes):
             opttype = rawbytes[i]
-            optnum = ICMPv6OptionNumber(opttype)
-            obj = ICMPv6OptionClasses[optnum]()
+            optnum = enum_table(ICMPv6OptionNumber)[opttype]
+            obj = ICMPv6OptionClasses.get(optnum, ICMPv6OptionUnknown)()
             eaten = obj.from_bytes(rawbytes[i:])
             i += eaten
             icmpv6popts.append(obj)
@@ -554,7 +598,6 @@ def construct_icmpv6_class_map():
         clsmap[xtype] = cls
 
     def inner(icmptype):
-        icmptype = ICMPv6Type(icmptype)
         return clsmap.get(icmptype, None)
     return inner
 
@@ -6,12 +6,15 @@ from collections import namedtuple
 from .packet import PacketHeaderBase,Packet
 from ..address import EthAddr,IPAddr,SpecialIPv4Addr,SpecialEthAddr
 from ..logging import log_warn
-from .common import IPProtocol,IPFragmentFlag,IPOptionNumber, checksum
+from .common import IPProtocol,IPFragmentFlag,IPOptionNumber, checksum, checksum_update, enum_table
+from .codec import HeaderCodec, Field, BitFields
 from .icmp import ICMP
 from .udp import UDP
 from .tcp import TCP
 from ..exceptions import *
 
+_ipoptnums = enum_table(IPOptionNumber)
+
 '''
 References:
     RFC791, INTERNET PROTOCOL.  DARPA INTERNET PROGRAM PROTOCOL SPECIFICATION.
@@ -87,7 +90,7 @@ class IPOptionXRouting(IPOption):
         numaddrs = ((length - 3) // 4)
         self._routedata = []
         for i in range(numaddrs):
-            self._routedata.append(IPv4Address(raw[(3+(i*4)):(7+(i*4))]))
+            self._routedata.append(IPv4Address(bytes(raw[(3+(i*4)):(7+(i*4))])))
         self.pointer = pointer
         return length
 
@@ -189,7 +192,7 @@ class IPOptionTimestamp(IPOption):
         return raw
 
     def from_bytes(self, raw):
-        fields = struct.unpack('!BBBB', raw[:4])
+        fields = struct.unpack_from('!BBBB', raw)
         self._ptr = fields[2]
         self._flag = fields[3]&0x0f
         self._entries = []
@@ -240,7 +243,7 @@ class IPOption4Bytes(IPOption):
         return struct.calcsize(IPOption4Bytes._PACKFMT)
 
     def from_bytes(self, raw):
-        fields = struct.unpack(IPOption4Bytes._PACKFMT, raw[:4])
+        fields = struct.unpack_from(IPOption4Bytes._PACKFMT, raw)
         self._value = fields[2]
         return self.length()
 
@@ -269,6 +272,49 @@ class IPOptionMTUReply(IPOption4Bytes):
         super().__init__(IPOptionNumber.MTUReply, value=1500, copyflag=False)
 
 
+class IPOptionUnknown(IPOption):
+    '''
+    An option of a type without its own class.  The type byte (with
+    its copy flag and class bits) and data are kept as received, so
+    the option serializes back unchanged.
+    '''
+    __slots__ = ['_opttype', '_data']
+    _PACKFMT = '!BB'
+
+    def __init__(self, opttype=0x1f, data=b''):
+        self._optnum = _ipoptnums[opttype & 0x1f]
+        self._opttype = opttype
+        self._data = data
+
+    @property
+    def data(self):
+        return self._data
+
+    def length(self):
+        return struct.calcsize(IPOptionUnknown._PACKFMT) + len(self._data)
+
+    def from_bytes(self, raw):
+        optlen = raw[1] if len(raw) > 1 else 0
+        if optlen < 2 or optlen > len(raw):
+            raise ValueError("Malformed IP option (type {}, length {})".format(raw[0], optlen))
+        self._opttype = raw[0]
+        self._optnum = _ipoptnums[raw[0] & 0x1f]
+        self._data = bytes(raw[2:optlen])
+        return optlen
+
+    def to_bytes(self):
+        return struct.pack(IPOptionUnknown._PACKFMT, self._opttype,
+            self.length()) + self._data
+
+    def __eq__(self, other):
+        return isinstance(other, IPOptionUnknown) and \
+            self._opttype == other._opttype and self._data == other._data
+
+    def __str__(self):
+        return "{} {} ({} bytes)".format(self.__class__.__name__,
+            self._optnum.name, len(self._data))
+
+
 IPOptionClasses = {
     IPOptionNumber.EndOfOptionList: IPOptionEndOfOptionList,
     IPOptionNumber.NoOperation: IPOptionNoOperation,
@@ -299,8 +345,8 @@ class IPOptionList(object):
             optcopied = opttype >> 7         # high order 1 bit
             optclass = (opttype >> 5) & 0x03 # next 2 bits
             optnum = opttype & 0x1f          # low-order 5 bits are optnum
-            optnum = IPOptionNumber(optnum)
-            obj = IPOptionClasses[optnum]()
+            optnum = _ipoptnums[optnum]
+            obj = IPOptionClasses.get(optnum, IPOptionUnknown)()
             eaten = obj.from_bytes(rawbytes[i:])
             i += eaten
             ipopts.append(obj)
@@ -383,62 +429,84 @@ class IPv4(PacketHeaderBase):
                  '_ipid','_flags','_fragoffset',
                  '_protocol','_csum',
                  '_src','_dst','_options']
-    _PACKFMT = '!BBHHHBBH4s4s'
-    _MINLEN = struct.calcsize(_PACKFMT)
+    _codec = HeaderCodec(
+        BitFields('B', Field('version', 4, readonly=True),
+                       Field('hl', 4, readonly=True)),
+        Field('_tos', 'B'),
+        Field('_totallen', 'H'),
+        Field('_ipid', 'H'),
+        BitFields('H', Field('_flags', 3, IPFragmentFlag),
+                       Field('_fragoffset', 13)),
+        Field('_ttl', 'B'),
+        Field('_protocol', 'B', IPProtocol),
+        Field('checksum', 'H', readonly=True),
+        Field('_src', '4s', IPAddr),
+        Field('_dst', '4s', IPAddr))
+    _MINLEN = _codec.size
     _next_header_map = IPTypeClasses
     _next_header_class_key = '_protocol'
 
     def __init__(self, **kwargs):
         # fill in fields with (essentially) zero values
-        self.tos = 0x00
+        self._tos = 0x00
         self._totallen = IPv4._MINLEN
-        self.ipid = 0x0000
-        self.ttl = 0
+        self._ipid = 0x0000
+        self._ttl = 0
         self._flags = IPFragmentFlag.NoFragments
         self._fragoffset = 0
-        self.protocol = IPProtocol.ICMP
-        self._csum = 0x0000
-        self.src = SpecialIPv4Addr.IP_ANY.value
-        self.dst = SpecialIPv4Addr.IP_ANY.value
+        self._protocol = IPProtocol.ICMP
+        # the checksum isn't known until the header is parsed or
+        # serialized; after that, it is updated as fields change
+        self._csum = None
+        self._src = IPAddr(SpecialIPv4Addr.IP_ANY.value)
+        self._dst = IPAddr(SpecialIPv4Addr.IP_ANY.value)
         self._options = IPOptionList()
         super().__init__(**kwargs)
         
     def size(self):
-        return struct.calcsize(IPv4._PACKFMT) + self._options.raw_length()
+        return IPv4._MINLEN + self._options.raw_length()
+
+    def _csum_update(self, old, new):
+        # incremental (RFC 1624) update of a known checksum when a field
+        # changes; old and new are the field values shifted to their
+        # position within a 16 bit word
+        if self._csum is not None:
+            self._csum = checksum_update(self._csum, old, new)
 
     def pre_serialize(self, raw, pkt, i):
-        self._totallen = self.size() + len(raw)
+        totallen = self.size() + len(raw)
+        self._csum_update(self._totallen, totallen)
+        self._totallen = totallen
+
+    def _pre_serialize_unchanged(self, raw, pkt, i, oldhdr, context):
+        # only the length of the tail matters; no need to copy it
+        self.pre_serialize(raw, pkt, i)
+
+    def _serialize_context(self, pkt, i):
+        # total length only depends on the headers that follow
+        return ()
 
     def to_bytes(self):
-        iphdr = struct.pack(IPv4._PACKFMT,
-            4 << 4 | self.hl, self.tos, self._totallen,
-            self.ipid, self._flags.value << 13 | self.fragment_offset,
-            self.ttl, self.protocol.value, self.checksum,
-            self.src.packed, self.dst.packed)
-        return iphdr + self._options.to_bytes()
+        return IPv4._codec.encode(self) + self._options.to_bytes()
+
+    def write_into(self, buf, offset):
+        IPv4._codec.encode_into(self, buf, offset)
+        optbytes = self._options.to_bytes()
+        if optbytes:
+            buf[offset+IPv4._MINLEN:offset+IPv4._MINLEN+len(optbytes)] = optbytes
+        return IPv4._MINLEN + len(optbytes)
 
     def from_bytes(self, raw):
-        if len(raw) < 20:
-            raise NotEnoughDataError("Not enough data to unpack IPv4 header (only {} bytes)".format(len(raw)))
-        headerfields = struct.unpack(IPv4._PACKFMT, raw[:20])
+        headerfields = IPv4._codec.decode(self, raw)
         v = headerfields[0] >> 4
         if v != 4:
             raise ValueError("Version in raw bytes for IPv4 isn't 4!")
         hl = (headerfields[0] & 0x0f) * 4
         if len(raw) < hl:
             raise NotEnoughDataError("Not enough data to unpack IPv4 header (only {} bytes, but header length field claims {})".format(len(raw), hl))
-        optionbytes = raw[20:hl]
-        self.tos = headerfields[1]        
-        self._totallen = headerfields[2]
-        self.ipid = headerfields[3]
-        self.flags = IPFragmentFlag(headerfields[4] >> 13)
-        self.fragment_offset = headerfields[4] & 0x1fff
-        self.ttl = headerfields[5]
-        self.protocol = IPProtocol(headerfields[6])
-        self._csum = headerfields[7]
-        self.src = headerfields[8]
-        self.dst = headerfields[9]
-        self._options = IPOptionList.from_bytes(optionbytes)
+        self._options = IPOptionList.from_bytes(raw[20:hl])
+        # remember the checksum the header was received with
+        self._csum = headerfields[7] if hl == IPv4._MINLEN else None
         return raw[hl:]
 
     def __eq__(self, other):
@@ -452,6 +520,10 @@ class IPv4(PacketHeaderBase):
                 self.dst == other.dst
 
     # accessors and mutators
+    @property
+    def version(self):
+        return 4
+
     @property
     def options(self):
         return self._options
@@ -469,6 +541,7 @@ class IPv4(PacketHeaderBase):
         value = int(value) 
         if not (0 <= value <= 255):
             raise ValueError("Invalid TTL value {}".format(value))
+        self._csum_update(self._ttl << 8, value << 8)
         self._ttl = value
 
     @property
@@ -479,6 +552,7 @@ class IPv4(PacketHeaderBase):
     def tos(self, value):
         if not (0 <= value < 256):
             raise ValueError("Invalid type of service value; must be 0-255")
+        self._csum_update(self._tos, value)
         self._tos = value
 
     @property
@@ -493,13 +567,13 @@ class IPv4(PacketHeaderBase):
     def dscp(self, value):
         if not (0 <= value < 64):
             raise ValueError("Invalid DSCP value; must be 0-63")
-        self._tos = (self._tos & 0x03) | value << 2
+        self.tos = (self._tos & 0x03) | value << 2
 
     @ecn.setter
     def ecn(self, value):
         if not (0 <= value < 4):
             raise ValueError("Invalid ECN value; must be 0-3")
-        self._tos = (self._tos & 0xfa) | value
+        self.tos = (self._tos & 0xfa) | value
 
     @property
     def ipid(self):
@@ -509,6 +583,7 @@ class IPv4(PacketHeaderBase):
     def ipid(self, value):
         if not (0 <= value < 65536):
             raise ValueError("Invalid IP ID value; must be 0-65535")
+        self._csum_update(self._ipid, value)
         self._ipid = value
 
     @property
@@ -517,7 +592,9 @@ class IPv4(PacketHeaderBase):
 
     @protocol.setter
     def protocol(self, value):
-        self._protocol = IPProtocol(value)
+        value = IPProtocol(value)
+        self._csum_update(self._protocol.value, value.value)
+        self._protocol = value
 
     @property
     def src(self):
@@ -525,7 +602,9 @@ class IPv4(PacketHeaderBase):
 
     @src.setter
     def src(self, value):
-        self._src = IPAddr(value)
+        value = IPAddr(value)
+        self._csum_update(int(self._src), int(value))
+        self._src = value
 
     @property
     def dst(self):
@@ -533,7 +612,9 @@ class IPv4(PacketHeaderBase):
 
     @dst.setter
     def dst(self, value):
-        self._dst = IPAddr(value)
+        value = IPAddr(value)
+        self._csum_update(int(self._dst), int(value))
+        self._dst = value
 
     @property
     def flags(self):
@@ -541,7 +622,9 @@ class IPv4(PacketHeaderBase):
 
     @flags.setter
     def flags(self, value):
-        self._flags = IPFragmentFlag(value)
+        value = IPFragmentFlag(value)
+        self._csum_update(self._flags.value << 13, value.value << 13)
+        self._flags = value
 
     @property
     def fragment_offset(self):
@@ -551,23 +634,35 @@ class IPv4(PacketHeaderBase):
     def fragment_offset(self, value):
         if not (0 <= value < 2**13):
             raise ValueError("Invalid fragment offset value")
+        self._csum_update(self._fragoffset, value)
         self._fragoffset = value
     
     @property
     def hl(self):
         return self.size() // 4
 
+    def _known_checksum(self):
+        # the tracked checksum is only kept for headers without options,
+        # since options can be modified behind the header's back
+        if self._options.size():
+            return None
+        return self._csum
+
     @property
     def checksum(self):
-        data = struct.pack(IPv4._PACKFMT,
+        csum = self._known_checksum()
+        if csum is not None:
+            return csum
+        data = IPv4._codec.struct.pack(
                     (4 << 4) + self.hl, self.tos,
                     self._totallen, self.ipid,
                     (self.flags.value << 13) | self.fragment_offset, 
                     self.ttl,
                     self.protocol.value, 0, self.src.packed, self.dst.packed)
         data += self._options.to_bytes()
-        self._csum = checksum(data, 0)
-        return self._csum
+        csum = checksum(data, 0)
+        self._csum = None if self._options.size() else csum
+        return csum
 
     def __str__(self):
         return '{} {}->{} {}'.format(self.__class__.__name__, self.src, self.dst, self.protocol.name)
@@ -5,14 +5,17 @@ from enum import IntEnum
 
 from ..logging import log_warn
 from .packet import PacketHeaderBase,Packet
-from ..address import EthAddr,IPAddr,SpecialIPv6Addr,SpecialEthAddr
-from .common import IPProtocol, checksum
+from ..address import EthAddr,IPAddr,IPv6Addr,SpecialIPv6Addr,SpecialEthAddr
+from .common import IPProtocol, checksum, enum_table
+from .codec import HeaderCodec, Field, BitFields
 from ..exceptions import *
 
 from .icmpv6 import ICMPv6
 from .tcp import TCP
 from .udp import UDP
 
+_ipprotocols = enum_table(IPProtocol)
+
 '''
 References:
     IETF RFC 2460 http://tools.ietf.org/html/rfc2460 (ipv6)
@@ -35,9 +38,6 @@ class IPv6ExtensionHeader(PacketHeaderBase):
         self._optlenmultiplier = optlenmultiplier
         super().__init__(**kwargs)
 
-    def pre_serialize(self, raw, pkt, i):
-        pass
-
     def size(self):
         return self._optdatalen
 
@@ -71,7 +71,7 @@ class IPv6ExtensionHeader(PacketHeaderBase):
         if len(raw) < IPv6ExtensionHeader._MINLEN:
             raise NotEnoughDataError("Not enough data to unpack IPv6ExtensionHeader")
 
-        self.nextheader = IPProtocol(raw[0])
+        self._nextheader = _ipprotocols[raw[0]]
         self._optdatalen = int(raw[1])
 
         if len(raw) < self._optdatalen * self._optlenmultiplier:
@@ -117,7 +117,7 @@ class IPv6RouteOption(IPv6ExtensionHeader):
         if self._routingtype == 2:
             rawaddr = remain[6:22]
             remain = remain[22:]
-            self._address = IPv6Address(rawaddr)
+            self._address = IPv6Address(bytes(rawaddr))
         else:
             raise ValueError("IPv6 routing option only supports type 2 (but I got type {})".format(self._routingtype))
         return remain
@@ -170,7 +170,7 @@ class IPv6Fragment(IPv6ExtensionHeader):
         remain = super().from_bytes(raw)
         if len(remain) < IPv6Fragment._MINLEN:
             raise NotEnoughDataError("Not enough data to unpack IPv6Fragment extension header")
-        offsetfield, xid = struct.unpack(IPv6Fragment._PACKFMT, remain[:IPv6Fragment._MINLEN])
+        offsetfield, xid = struct.unpack_from(IPv6Fragment._PACKFMT, remain)
         self._id = xid
         self._offset = offsetfield >> 3
         self._morefragments = bool(offsetfield & 0x1)
@@ -299,7 +299,7 @@ class HomeAddress(IPv6Option):
     @staticmethod
     def from_bytes(raw):
         assert(len(raw) == 16)
-        return HomeAddress(raw)
+        return HomeAddress(bytes(raw))
 
     def __str__(self):
         return "{} ({})".format(self.__class__.__name__, self._value)
@@ -492,8 +492,16 @@ class IPv6(PacketHeaderBase):
     __slots__ = ['_trafficclass','_flowlabel','_ttl',
                  '_nextheader','_payloadlen',
                  '_src','_dst','_extheaders']
-    _PACKFMT = '!BBHHBB16s16s'
-    _MINLEN = struct.calcsize(_PACKFMT)
+    _codec = HeaderCodec(
+        BitFields('I', Field('version', 4, readonly=True),
+                       Field('_trafficclass', 8),
+                       Field('_flowlabel', 20)),
+        Field('_payloadlen', 'H'),
+        Field('_nextheader', 'B', IPProtocol),
+        Field('_ttl', 'B'),
+        Field('_src', '16s', IPv6Addr),
+        Field('_dst', '16s', IPv6Addr))
+    _MINLEN = _codec.size
     _next_header_map = IPTypeClasses
     _next_header_class_key = '_nextheader'
 
@@ -514,28 +522,21 @@ class IPv6(PacketHeaderBase):
     def pre_serialize(self, raw, pkt, i):
         self._payloadlen = len(raw)
 
+    def _serialize_context(self, pkt, i):
+        # payload length only depends on the headers that follow
+        return ()
+
     def to_bytes(self):
-        return struct.pack(IPv6._PACKFMT,
-            6 << 4 | self.trafficclass >> 4,
-            (self.trafficclass & 0x0f) << 4 | (self.flowlabel & 0xf0000) >> 16,
-            self.flowlabel & 0x0ffff,
-            self._payloadlen, self.nextheader.value,
-            self.ttl, self.src.packed, self.dst.packed)
+        return IPv6._codec.encode(self)
+
+    def write_into(self, buf, offset):
+        return IPv6._codec.encode_into(self, buf, offset)
 
     def from_bytes(self, raw):
-        if len(raw) < IPv6._MINLEN:
-            raise NotEnoughDataError("Not enough data to unpack IPv6 header (only {} bytes)".format(len(raw)))
-        fields = struct.unpack(IPv6._PACKFMT, raw[:IPv6._MINLEN])
-        ipversion = fields[0] >> 4
+        fields = IPv6._codec.decode(self, raw)
+        ipversion = fields[0] >> 28
         if ipversion != 6:
             raise ValueError("Trying to parse IPv6 header, but IP version is not 6! ({})".format(ipversion))
-        self.trafficclass = (fields[0] & 0x0f) << 4 | (fields[1] >> 4)
-        self.flowlabel = (fields[1] & 0x0f) << 16 | fields[2]
-        self._payloadlen = fields[3]
-        self.nextheader = IPProtocol(fields[4])
-        self.ttl = fields[5]
-        self.src = IPv6Address(fields[6])
-        self.dst = IPv6Address(fields[7])
         # FIXME: extension headers
         return raw[IPv6._MINLEN:]
 
@@ -549,6 +550,10 @@ class IPv6(PacketHeaderBase):
             self._extheaders == other._extheaders
 
     # accessors and mutators
+    @property
+    def version(self):
+        return 6
+
     @property
     def trafficclass(self):
         return self._trafficclass
@@ -595,7 +600,7 @@ class IPv6(PacketHeaderBase):
 
     @src.setter
     def src(self, value):
-        self._src = value
+        self._src = IPv6Addr(value)
 
     @property
     def dst(self):
@@ -603,7 +608,7 @@ class IPv6(PacketHeaderBase):
 
     @dst.setter
     def dst(self, value):
-        self._dst = value
+        self._dst = IPv6Addr(value)
 
     def __str__(self):
         return '{} {}->{} {}'.format(self.__class__.__name__, self.src, self.dst, self.nextheader.name) 
@@ -45,7 +45,7 @@ class Null(PacketHeaderBase):
         Exception if we can't resurrect the packet.'''
         if len(raw) < 4:
             raise NotEnoughDataError("Not enough bytes ({}) to reconstruct a Null object".format(len(raw)))
-        fields = struct.unpack('=I', raw[:4])
+        fields = struct.unpack_from('=I', raw)
         self._af = fields[0]
         return raw[4:]
 
@@ -55,9 +55,6 @@ class Null(PacketHeaderBase):
             raise Exception("No mapping from address family {} to a packet header class".format(self.af))
         return cls
 
-    def pre_serialize(self, raw, pkt, i):
-        pass
-
     def __eq__(self, other):
         return self.af == other.af
 
@@ -4,18 +4,42 @@ from copy import deepcopy
 from ..logging import log_warn
 from ..exceptions import *
 
+# header class -> keys under which Packet indexes headers of that class
+_header_keys_cache = {}
+
+# (header class, next header value) pairs that have no class to decode them
+_unhandled_next_headers = set()
+
+def _header_keys(cls):
+    '''
+    Return the keys under which a header of class cls is found by
+    Packet header lookups: every class in its MRO (so that looking up
+    a base class finds derived headers, as isinstance does) and the
+    class name.
+    '''
+    keys = _header_keys_cache.get(cls)
+    if keys is None:
+        keys = _header_keys_cache[cls] = cls.__mro__ + (cls.__name__,)
+    return keys
+
 class Packet(object):
     '''
     Base class for packet headers.
     '''
-    __slots__ = ['_headers','_raw']
+    __slots__ = ['_headers','_raw','_next_cls','_offset','_spans','_index']
 
-    def __init__(self, raw=None, first_header=None):
+    def __init__(self, raw=None, first_header=None, lazy=False):
         self._headers = []
+        self._spans = []
+        self._index = None
         self._raw = None
+        self._next_cls = None
+        self._offset = 0
         if raw:
+            if not isinstance(raw, bytes):
+                raw = bytes(raw)
             self._raw = raw
-            self._parse(raw, first_header)            
+            self._parse(raw, first_header, lazy)
 
     def __len__(self):
         '''Return the packed length of this packet, and all
@@ -24,40 +48,256 @@ class Packet(object):
 
     def size(self):
         '''Return the packed length of this header'''
+        self._decode_all()
         return sum([len(ph) for ph in self._headers])
 
     def to_bytes(self):
         '''
         Returns serialized bytes object representing all headers/
         payloads in this packet'''
+        self._decode_all()
+        raw = self._raw
+        if raw is None:
+            raw = b''
         rawlist = []
+        sizes = []
+        # rawlist (built back to front) equals raw[clean:] as long as
+        # every header so far was emitted from its original wire bytes
+        clean = len(raw)
+        i = len(self._headers)-1
+        while i >= 0:
+            hdr = self._headers[i]
+            span = self._spans[i]
+            hdrbytes = None
+            if span is not None:
+                start, end, context = span
+                if context is None or \
+                    (clean == end and context == hdr._serialize_context(self, i)):
+                    hdrbytes = hdr.to_bytes()
+                    if len(hdrbytes) == end - start and \
+                        raw.startswith(hdrbytes, start):
+                        clean = start if clean == end else None
+                        rawlist.append(hdrbytes)
+                        sizes.append(end - start)
+                        i -= 1
+                        continue
+                    if context is not None:
+                        hdrbytes = None
+            if hdrbytes is None:
+                if span is not None and clean == end:
+                    # everything after this header is unchanged
+                    tail = memoryview(raw)[clean:]
+                    hdr._pre_serialize_unchanged(tail, self, i,
+                        memoryview(raw)[start:end], context)
+                else:
+                    if clean is not None:
+                        tail = raw[clean:]
+                    else:
+                        tail = b''.join(reversed(rawlist))
+                    hdr.pre_serialize(tail, self, i)
+                rawlist = [tail]
+                hdrbytes = hdr.to_bytes()
+            clean = None
+            rawlist.append(hdrbytes)
+            sizes.append(len(hdrbytes))
+            i -= 1
+
+        if clean is not None:
+            if clean == 0:
+                return raw
+            result = raw[clean:]
+        else:
+            result = b''.join(reversed(rawlist))
+        self._raw = result
+        offset = 0
+        for i,hdr in enumerate(self._headers):
+            end = offset + sizes[-1-i]
+            self._spans[i] = (offset, end, hdr._serialize_context(self, i))
+            offset = end
+        return result
+
+    def serialize_into(self, buf, offset=0):
+        '''
+        Serialize all headers/payloads in this packet into buf, a
+        writable object supporting the buffer protocol (e.g., a
+        preallocated bytearray), starting at offset.  Returns the number
+        of bytes written.  Raises ValueError if buf is too small.
+        '''
+        self._decode_all()
+        view = memoryview(buf).cast('B')
+        sizes = [ph.size() for ph in self._headers]
+        end = offset + sum(sizes)
+        if offset < 0 or end > len(view):
+            raise ValueError("Buffer too small to serialize packet ({} bytes needed at offset {}, buffer is {} bytes)".format(end-offset, offset, len(view)))
+        raw = self._raw
+        if raw is None:
+            raw = b''
+        # same reuse rules as to_bytes: view[pos:end] equals raw[clean:]
+        # as long as every header so far matched its original wire bytes
+        clean = len(raw)
+        pos = end
         i = len(self._headers)-1
         while i >= 0:
-            self._headers[i].pre_serialize(b''.join(rawlist), self, i)
-            rawlist.insert(0, self._headers[i].to_bytes())
+            hdr = self._headers[i]
+            span = self._spans[i]
+            start = pos - sizes[i]
+            needs_pre = True
+            if span is not None:
+                hstart, hend, context = span
+                if context is None or \
+                    (clean == hend and context == hdr._serialize_context(self, i)):
+                    self._write_header(hdr, view, start, sizes[i])
+                    if hend - hstart == sizes[i] and \
+                        raw.startswith(view[start:pos], hstart):
+                        clean = hstart if clean == hend else None
+                        pos = start
+                        i -= 1
+                        continue
+                    needs_pre = context is not None
+            if needs_pre:
+                if span is not None and clean == hend:
+                    hdr._pre_serialize_unchanged(memoryview(raw)[clean:],
+                        self, i, memoryview(raw)[hstart:hend], context)
+                else:
+                    hdr.pre_serialize(bytes(view[pos:end]), self, i)
+                self._write_header(hdr, view, start, sizes[i])
+            clean = None
+            pos = start
             i -= 1
-        self._raw = b''.join(rawlist)
-        return self._raw
+        return end - offset
 
-    def _parse(self, raw, next_cls):
+    @staticmethod
+    def _write_header(hdr, view, offset, size):
+        xlen = hdr.write_into(view, offset)
+        if xlen != size:
+            raise ValueError("{} header wrote {} bytes but its size is {}".format(hdr.__class__.__name__, xlen, size))
+
+    def _parse(self, raw, next_cls, lazy=False):
         '''
         Parse a raw bytes object and construct the list of packet header
         objects (and possible remaining bytes) that are part of this packet.
+        If lazy is True, only set up the decode cursor; headers are then
+        decoded one at a time, as they are accessed.
         '''
         if next_cls is None:
             from switchyard.lib.packet import Ethernet
             next_cls = Ethernet
 
         self._headers = []
-        while issubclass(next_cls, PacketHeaderBase):
+        self._spans = []
+        self._index = None
+        self._next_cls = next_cls
+        self._offset = 0
+        if not lazy:
+            while self._next_cls is not None:
+                self._decode_next(fresh=True)
+
+    def _decode_next(self, fresh=False):
+        '''
+        Decode the next header at the decode cursor, append it to
+        the header list and advance the cursor.  Returns the new
+        header object, or None if there is nothing left to decode.
+        fresh is True when none of the earlier headers can have been
+        handed out (and modified) yet.
+        '''
+        next_cls = self._next_cls
+        if next_cls is None:
+            return None
+        raw = memoryview(self._raw)[self._offset:]
+        if next_cls is RawPacketContents:
+            packet_header_obj = RawPacketContents(raw)
+            remain = b''
+            next_cls = None
+        else:
             packet_header_obj = next_cls()
-            raw = packet_header_obj.from_bytes(raw)
-            self.add_header(packet_header_obj)
+            remain = packet_header_obj.from_bytes(raw) or b''
             next_cls = packet_header_obj.next_header_class()
-            if next_cls is None:
-                break
-        if raw:
-            self.add_header(RawPacketContents(raw))
+            if next_cls is None or not issubclass(next_cls, PacketHeaderBase):
+                next_cls = RawPacketContents if remain else None
+        idx = len(self._headers)
+        start = self._offset
+        self._headers.append(packet_header_obj)
+        self._spans.append(None)
+        self._offset += len(raw) - len(remain)
+        self._next_cls = next_cls
+        self._index_header(idx, packet_header_obj)
+        # remember where the header came from so that to_bytes can
+        # reuse the wire bytes as long as the header isn't modified
+        context = packet_header_obj._serialize_context(self, idx)
+        if context and not fresh:
+            # decoded on demand: earlier headers may have been modified
+            # since the packet arrived, so take the context from a
+            # pristine decode of the wire bytes up to this header
+            wire = Packet(self._raw[:self._offset], type(self._headers[0]))
+            context = packet_header_obj._serialize_context(wire, idx)
+        self._spans[idx] = (start, self._offset, context)
+        return packet_header_obj
+
+    def _decode_all(self):
+        '''
+        Decode any headers that remain at the decode cursor.
+        '''
+        while self._next_cls is not None:
+            self._decode_next()
+
+    def _decode_to(self, index):
+        '''
+        Decode headers until the header at index is available (or
+        there is nothing left to decode).  Negative indexes require
+        the full packet to be decoded.
+        '''
+        if index < 0:
+            self._decode_all()
+            return
+        while len(self._headers) <= index and self._next_cls is not None:
+            self._decode_next()
+
+    def _index_header(self, idx, ph):
+        '''
+        Add the header ph at index idx to the header index, unless
+        an earlier header is already indexed under the same keys.
+        '''
+        index = self._index
+        if index is not None:
+            for key in _header_keys(ph.__class__):
+                if key not in index:
+                    index[key] = idx
+
+    def _find_header(self, key):
+        '''
+        Return the index of the first header that is an instance of
+        key (a class, or a tuple of classes) or whose class is named
+        key (a string), decoding headers as necessary, or -1 if there
+        is no such header.
+        '''
+        if isinstance(key, tuple):
+            return self._scan_header(key, 0)
+        index = self._index
+        if index is None:
+            # (re)build the index after headers were inserted or removed
+            index = self._index = {}
+            for idx, ph in enumerate(self._headers):
+                self._index_header(idx, ph)
+        idx = index.get(key)
+        while idx is None and self._next_cls is not None:
+            self._decode_next()
+            idx = index.get(key)
+        return -1 if idx is None else idx
+
+    def _scan_header(self, hdrclass, startidx):
+        '''
+        Return the index of the first header from startidx on that is
+        an instance of hdrclass, going through the headers one by one,
+        or -1 if there is no such header.
+        '''
+        hdridx = startidx
+        while True:
+            self._decode_to(hdridx)
+            if hdridx >= len(self._headers):
+                return -1
+            if isinstance(self._headers[hdridx], hdrclass):
+                return hdridx
+            hdridx += 1
 
     @staticmethod
     def from_bytes(raw, first_header):
@@ -91,12 +331,14 @@ class Packet(object):
         '''
         Return a list of packet header names in this packet.
         '''
+        self._decode_all()
         return [ ph.__class__.__name__ for ph in self._headers ]
 
     def num_headers(self):
         '''
         Return the number of headers in the packet.
         '''
+        self._decode_all()
         return len(self._headers)
 
     def prepend_header(self, ph):
@@ -105,6 +347,8 @@ class Packet(object):
         (i.e., as the first header of the packet).
         '''
         self._headers.insert(0, ph)
+        self._spans.insert(0, None)
+        self._index = None
 
     def add_header(self, ph):
         '''
@@ -116,7 +360,10 @@ class Packet(object):
         if isinstance(ph, bytes):
             ph = RawPacketContents(ph)
         if isinstance(ph, PacketHeaderBase):
+            self._decode_all()
             self._headers.append(ph)
+            self._spans.append(None)
+            self._index_header(len(self._headers)-1, ph)
             return self
         raise Exception("Payload for a packet header must be an object that is a subclass of PacketHeaderBase, or a bytes object.")
 
@@ -126,7 +373,10 @@ class Packet(object):
         Any headers previously in the Packet from index idx:len(ph) are shifted to
         make room for the new packet.
         '''
+        self._decode_to(idx)
         self._headers.insert(idx, ph)
+        self._spans.insert(idx, None)
+        self._index = None
 
     def add_payload(self, ph):
         '''Alias for add_header'''
@@ -137,19 +387,17 @@ class Packet(object):
         Return True if the packet has a header of the given hdrclass, 
         False otherwise.
         '''
-        if isinstance(hdrclass, str):
-            return self.get_header_by_name(hdrclass) is not None
-        return self.get_header(hdrclass) is not None
+        return self._find_header(hdrclass) != -1
 
     def get_header_by_name(self, hdrname):
         '''
         Return the header object that has the given (string) header
         class name.  Returns None if no such header exists.
         '''
-        for hdr in self._headers:
-            if hdr.__class__.__name__ == hdrname:
-                return hdr
-        return None
+        idx = self._find_header(hdrname)
+        if idx == -1:
+            return None
+        return self._headers[idx]
 
     def get_header(self, hdrclass, returnval=None):
         '''
@@ -160,10 +408,10 @@ class Packet(object):
         if isinstance(hdrclass, str):
             return self.get_header_by_name(hdrclass)
 
-        for hdr in self._headers:
-            if isinstance(hdr, hdrclass):
-                return hdr
-        return returnval
+        idx = self._find_header(hdrclass)
+        if idx == -1:
+            return returnval
+        return self._headers[idx]
 
     def get_header_index(self, hdrclass, startidx=0):
         '''
@@ -171,16 +419,25 @@ class Packet(object):
         starting at startidx (default=0), or -1 if the
         header class isn't found in the list of headers.
         '''
-        for hdridx in range(startidx, len(self._headers)):
-            if isinstance(self._headers[hdridx], hdrclass):
-                return hdridx
-        return -1
+        hdridx = self._find_header(hdrclass)
+        if hdridx == -1 or hdridx >= startidx:
+            return hdridx
+        return self._scan_header(hdrclass, startidx)
 
     def __iter__(self):
-        return iter(self._headers)
+        if self._next_cls is None:
+            return iter(self._headers)
+        return self._iter_lazy()
+
+    def _iter_lazy(self):
+        i = 0
+        while i < len(self._headers) or self._decode_next() is not None:
+            yield self._headers[i]
+            i += 1
 
     def _checkidx(self, index):
         if isinstance(index, int):
+            self._decode_to(index)
             if index < 0:
                 index = len(self._headers) + index
             if not (0 <= index < len(self._headers)):
@@ -191,8 +448,9 @@ class Packet(object):
         if isinstance(index, int):
             index = self._checkidx(index)
             return self._headers[index]
-        elif isinstance(index, type) and issubclass(index, PacketHeaderBase):
-            idx = self.get_header_index(index)
+        elif isinstance(index, type) and PacketHeaderBase in index.__mro__:
+            # (checking the mro is much cheaper than issubclass on an ABC)
+            idx = self._find_header(index)
             if idx == -1:
                 raise KeyError("No such header type exists.")
             return self._headers[idx]
@@ -206,9 +464,11 @@ class Packet(object):
         if not isinstance(value, (PacketHeaderBase, bytes)):
             raise TypeError("Can't assign a non-packet header in a packet")
         self._headers[index] = value
+        self._spans[index] = None
+        self._index = None
 
     def __contains__(self, obj):
-        for ph in self._headers:
+        for ph in self:
             if ph is obj or \
                 (isinstance(obj, ph.__class__) and ph == obj):
                 return True
@@ -218,11 +478,15 @@ class Packet(object):
         if isinstance(index, int):
             index = self._checkidx(index)
             del self._headers[index]
+            del self._spans[index]
+            self._index = None
         elif isinstance(index, type) and issubclass(index, PacketHeaderBase):
             idx = self.get_header_index(index)
             if idx == -1:
                 raise KeyError("No such header type exists.")
             del self._headers[idx]
+            del self._spans[idx]
+            self._index = None
         else:
             raise IndexError("Indexes must be integers or header class names")
 
@@ -238,7 +502,7 @@ class Packet(object):
         return True
 
     def __str__(self):
-        return ' | '.join([str(ph) for ph in self._headers if isinstance(ph, PacketHeaderBase)])
+        return ' | '.join([str(ph) for ph in self if isinstance(ph, PacketHeaderBase)])
 
 
 class PacketHeaderBase(metaclass=ABCMeta):
@@ -288,10 +552,27 @@ class PacketHeaderBase(metaclass=ABCMeta):
             return None
         key = getattr(self, self._next_header_class_key)
         rv = self._next_header_map.get(key, None)
-        if rv is None:
+        if rv is None and (self.__class__, key) not in _unhandled_next_headers:
+            # warn once per value rather than for every packet
+            _unhandled_next_headers.add((self.__class__, key))
             log_warn("No class exists to handle next header value {}".format(key))
         return rv
 
+    def _serialize_context(self, packet, i):
+        '''
+        Return a value that captures any state outside of this header
+        and the headers that follow it that pre_serialize depends on
+        (e.g., the IPv4 addresses that go into a UDP checksum).
+        Packet.to_bytes only reuses a header's original wire bytes
+        if this value is unchanged and the following headers were
+        reused as well.  None means the header's bytes don't depend on
+        anything other than the header itself.  By default, a header
+        that overrides pre_serialize is never reused.
+        '''
+        if self.__class__.pre_serialize is PacketHeaderBase.pre_serialize:
+            return None
+        return object()
+
     def pre_serialize(self, raw, packet, i):
         '''
         This method is called by the Switchyard framework just before any
@@ -308,11 +589,33 @@ class PacketHeaderBase(metaclass=ABCMeta):
         '''
         pass
 
+    def _pre_serialize_unchanged(self, raw, packet, i, oldhdr, context):
+        '''
+        Called by Packet instead of pre_serialize when the tail of the
+        packet (raw, a memoryview) is unchanged since this header was
+        parsed from (or last serialized to) oldhdr, with context as its
+        _serialize_context at that time.  Headers that carry a checksum
+        override this to update it incrementally rather than recompute
+        it over raw.  The default just calls pre_serialize.
+        '''
+        self.pre_serialize(bytes(raw), packet, i)
+
     @abstractmethod
     def to_bytes(self):
         '''Return a 'packed' byte-level representation of this packet header.'''
         return b''
 
+    def write_into(self, buf, offset):
+        '''
+        Write the serialized header into the writable buffer buf,
+        starting at offset, and return the number of bytes written.
+        The default implementation copies the result of to_bytes;
+        headers override this to pack themselves in place.
+        '''
+        data = self.to_bytes()
+        buf[offset:offset+len(data)] = data
+        return len(data)
+
     @abstractmethod
     def from_bytes(self, raw):
         '''
@@ -367,28 +670,45 @@ class RawPacketContents(PacketHeaderBase):
     __slots__ = ['_raw'] 
 
     def __init__(self, raw=None):
+        self._raw = self._coerce(raw)
+
+    @staticmethod
+    def _coerce(raw):
+        '''
+        Accept str (encoded as utf8), bytes, or a bytes-like buffer.  A
+        memoryview is kept as-is (zero-copy) and only turned into bytes
+        when the contents are actually needed.
+        '''
         if isinstance(raw, str):
-            raw = bytes(raw, 'utf8')
-        elif isinstance(raw, bytes):
-            pass
-        else:
-            raise TypeError("RawPacketContents must be initialized with either str or bytes.  You gave me {}".format(raw.__class__.__name__))
-        self._raw = raw
+            return bytes(raw, 'utf8')
+        elif isinstance(raw, (bytes, memoryview)):
+            return raw
+        elif isinstance(raw, bytearray):
+            return bytes(raw)
+        raise TypeError("RawPacketContents must be initialized with either str or bytes.  You gave me {}".format(raw.__class__.__name__))
 
     def to_bytes(self):
+        if not isinstance(self._raw, bytes):
+            self._raw = bytes(self._raw)
         return self._raw    
 
+    def write_into(self, buf, offset):
+        xlen = len(self._raw)
+        buf[offset:offset+xlen] = self._raw
+        return xlen
+
     @property
     def data(self):
-        return self._raw
+        return self.to_bytes()
 
     def from_bytes(self, raw):
-        if isinstance(raw, bytes):
-            self._raw = bytes(raw)
-        elif isinstance(raw, str):
-            self._raw = bytes(raw, 'utf8')
-        else:
-            raise TypeError("RawPacketContents must be initialized with either str or bytes.  You gave me {}".format(raw.__class__.__name__))
+        self._raw = self._coerce(raw)
+
+    def __getstate__(self):
+        return self.to_bytes()
+
+    def __setstate__(self, state):
+        self._raw = state
 
     def size(self):
         return len(self._raw)
@@ -402,4 +722,4 @@ class RawPacketContents(PacketHeaderBase):
         if len(self._raw) < 10:
             ellipse = ''
         return '{} ({} bytes) {}{}'.format(self.__class__.__name__,
-            len(self._raw), self._raw[:10], ellipse)
+            len(self._raw), bytes(self._raw[:10]), ellipse)
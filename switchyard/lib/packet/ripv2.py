@@ -184,6 +184,3 @@ class RIPv2(PacketHeaderBase):
 
     def next_header_class(self):
         return None
-
-    def pre_serialize(self, raw, pkt, i):
-        pass
@@ -3,7 +3,8 @@ from enum import IntEnum
 from abc import ABCMeta, abstractmethod
 
 from .packet import PacketHeaderBase,Packet
-from .common import checksum
+from .common import checksum, checksum_update
+from .codec import HeaderCodec, Field, BitFields
 from ..exceptions import *
 
 '''
@@ -67,8 +68,17 @@ class TCPFlags(IntEnum):
 class TCP(PacketHeaderBase):
     __slots__ = ['_src','_dst','_seq','_ack',
         '_flags','_window','_urg','_options','_len', '_checksum']
-    _PACKFMT = '!HHIIHHHH'
-    _MINLEN = struct.calcsize(_PACKFMT)
+    _codec = HeaderCodec(
+        Field('_src', 'H'),
+        Field('_dst', 'H'),
+        Field('_seq', 'I'),
+        Field('_ack', 'I'),
+        BitFields('H', Field('offset', 4, readonly=True), Field(None, 3),
+                       Field('_flags', 9)),
+        Field('_window', 'H'),
+        Field('_checksum', 'H'),
+        Field('_urg', 'H'))
+    _MINLEN = _codec.size
     _next_header_map = {}
     _next_header_class_key = ''
 
@@ -84,7 +94,7 @@ class TCP(PacketHeaderBase):
         super().__init__(**kwargs)
 
     def size(self):
-        return struct.calcsize(TCP._PACKFMT)
+        return TCP._MINLEN + self._options.size()
 
     def _compute_checksum_ipv4(self, ip4, xdata):
         if ip4 is None:
@@ -100,9 +110,37 @@ class TCP(PacketHeaderBase):
         # will need to be modified for ipv6 support...
         self._checksum = self._compute_checksum_ipv4(pkt.get_header_by_name('IPv4'), raw)
 
+    def _pre_serialize_unchanged(self, raw, pkt, i, oldhdr, context):
+        # the payload is the same as when oldhdr was received, so the
+        # checksum only needs to account for the pseudo header and
+        # TCP header fields that changed (RFC 1624)
+        ip4 = pkt.get_header_by_name('IPv4')
+        if ip4 is None or not context or \
+            context[3] != len(oldhdr) + len(raw):
+            self.pre_serialize(bytes(raw), pkt, i)
+            return
+        oldsrc, olddst, oldproto, oldlen = context
+        oldcsum = struct.unpack_from('!H', oldhdr, 16)[0]
+        self._len = self.size() + len(raw)
+        old = int(oldsrc) + int(olddst) + int(oldproto) + oldlen + \
+            int.from_bytes(oldhdr, 'big')
+        new = int(ip4.src) + int(ip4.dst) + ip4.protocol.value + self._len + \
+            int.from_bytes(self._make_header(oldcsum) +
+                self._options.to_bytes(), 'big')
+        self._checksum = checksum_update(oldcsum, old, new)
+
+    def _serialize_context(self, pkt, i):
+        ip4 = pkt.get_header_by_name('IPv4')
+        if ip4 is None:
+            return ()
+        # the segment length in the pseudo header (which may differ
+        # from the bytes that follow if the frame was padded)
+        return (ip4.src, ip4.dst, ip4.protocol,
+            ip4.total_length - ip4.size())
+
     def _make_header(self, csum):
         offset_flags = self.offset << 12 | self._flags
-        header = struct.pack(TCP._PACKFMT, self.src, self.dst,
+        header = TCP._codec.struct.pack(self.src, self.dst,
             self.seq, self.ack, offset_flags, self.window,
             csum, self.urgent_pointer)
         return header
@@ -111,26 +149,21 @@ class TCP(PacketHeaderBase):
         '''
         Return packed byte representation of the TCP header.
         '''
-        header = self._make_header(self._checksum)
-        return header + self._options.to_bytes()
+        return TCP._codec.encode(self) + self._options.to_bytes()
+
+    def write_into(self, buf, offset):
+        xlen = TCP._codec.encode_into(self, buf, offset)
+        optbytes = self._options.to_bytes()
+        if optbytes:
+            buf[offset+xlen:offset+xlen+len(optbytes)] = optbytes
+            xlen += len(optbytes)
+        return xlen
 
     def from_bytes(self, raw):
         '''Return an Ethernet object reconstructed from raw bytes, or an
            Exception if we can't resurrect the packet.'''
-        if len(raw) < TCP._MINLEN:
-            raise NotEnoughDataError("Not enough bytes ({}) to reconstruct an TCP object".format(len(raw)))
-        fields = struct.unpack(TCP._PACKFMT, raw[:TCP._MINLEN])
-        self._src = fields[0]
-        self._dst = fields[1]
-        self._seq = fields[2]        
-        self._ack = fields[3]
-        offset = fields[4] >> 12
-        self._flags = fields[4] & 0x01ff
-        self._window = fields[5]
-        csum = fields[6]
-        self._urg = fields[7]
-        headerlen = offset * 4
-        optlen = headerlen - TCP._MINLEN
+        fields = TCP._codec.decode(self, raw)
+        headerlen = (fields[4] >> 12) * 4
         self._options.from_bytes(raw[TCP._MINLEN:headerlen])
         return raw[headerlen:]
 
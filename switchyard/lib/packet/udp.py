@@ -1,7 +1,8 @@
 import struct
 
 from .packet import PacketHeaderBase
-from .common import checksum
+from .common import checksum, checksum_update
+from .codec import HeaderCodec, Field
 from ..exceptions import *
 
 '''
@@ -13,8 +14,12 @@ References:
 
 class UDP(PacketHeaderBase):
     __slots__ = ['_src','_dst','_len','_checksum']
-    _PACKFMT = '!HHHH'
-    _MINLEN = struct.calcsize(_PACKFMT)
+    _codec = HeaderCodec(
+        Field('_src', 'H'),
+        Field('_dst', 'H'),
+        Field('_len', 'H'),
+        Field('_checksum', 'H'))
+    _MINLEN = _codec.size
     _next_header_map = {}
     _next_header_class_key = ''
 
@@ -25,25 +30,21 @@ class UDP(PacketHeaderBase):
         super().__init__(**kwargs)
 
     def size(self):
-        return struct.calcsize(UDP._PACKFMT)
+        return UDP._MINLEN
 
     def to_bytes(self):
         '''
         Return packed byte representation of the UDP header.
         '''
-        return struct.pack(UDP._PACKFMT, self._src, self._dst,
-            self._len, self._checksum)
+        return UDP._codec.encode(self)
+
+    def write_into(self, buf, offset):
+        return UDP._codec.encode_into(self, buf, offset)
 
     def from_bytes(self, raw):
         '''Return an Ethernet object reconstructed from raw bytes, or an
            Exception if we can't resurrect the packet.'''
-        if len(raw) < UDP._MINLEN:
-            raise NotEnoughDataError("Not enough bytes ({}) to reconstruct an UDP object".format(len(raw)))
-        fields = struct.unpack(UDP._PACKFMT, raw[:UDP._MINLEN])
-        self._src = fields[0]
-        self._dst = fields[1]
-        self._len = fields[2]
-        self._checksum = fields[3]
+        UDP._codec.decode(self, raw)
         return raw[UDP._MINLEN:]
 
     def __eq__(self, other):
@@ -90,3 +91,28 @@ class UDP(PacketHeaderBase):
         # checksum calc currently assumes we're only dealing with ipv4.
         # will need to be modified for ipv6 support...
         self._checksum = self._compute_checksum_ipv4(pkt.get_header_by_name('IPv4'), raw)
+
+    def _pre_serialize_unchanged(self, raw, pkt, i, oldhdr, context):
+        # the payload is the same as when oldhdr was received, so the
+        # checksum only needs to account for the pseudo header and
+        # UDP header fields that changed (RFC 1624)
+        ip4 = pkt.get_header_by_name('IPv4')
+        oldlen, oldcsum = struct.unpack_from('!4xHH', oldhdr)
+        if ip4 is None or not context or not oldcsum or \
+            oldlen != len(oldhdr) + len(raw):
+            self.pre_serialize(bytes(raw), pkt, i)
+            return
+        oldsrc, olddst, oldproto = context
+        self._len = self.size() + len(raw)
+        old = int(oldsrc) + int(olddst) + int(oldproto) + oldlen + \
+            int.from_bytes(oldhdr, 'big')
+        new = int(ip4.src) + int(ip4.dst) + ip4.protocol.value + self._len + \
+            int.from_bytes(UDP._codec.struct.pack(self._src, self._dst,
+                self._len, oldcsum), 'big')
+        self._checksum = checksum_update(oldcsum, old, new)
+
+    def _serialize_context(self, pkt, i):
+        ip4 = pkt.get_header_by_name('IPv4')
+        if ip4 is None:
+            return ()
+        return (ip4.src, ip4.dst, ip4.protocol)
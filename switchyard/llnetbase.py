@@ -6,8 +6,29 @@ from .lib.logging import log_debug, log_warn
 from .lib.exceptions import *
 from .lib.address import *
 
-ReceivedPacket = namedtuple('ReceivedPacket', 
-    ['timestamp', 'input_port', 'packet'])
+class ReceivedPacket(namedtuple('ReceivedPacket', ['timestamp', 'input_port', 'packet'])):
+    '''
+    A received packet: (timestamp, input_port, packet), with the
+    timestamp as a float number of seconds.  timestamp_ns is the same
+    time as an integer number of nanoseconds, exactly as the capture
+    device reported it when it was given on creation.
+    '''
+    _timestamp_ns = None
+
+    def __new__(cls, timestamp, input_port, packet, timestamp_ns=None):
+        self = super().__new__(cls, timestamp, input_port, packet)
+        if timestamp_ns is not None:
+            self._timestamp_ns = timestamp_ns
+        return self
+
+    @property
+    def timestamp_ns(self):
+        if self._timestamp_ns is None:
+            return round(self.timestamp * 1000000000)
+        return self._timestamp_ns
+
+DeviceStats = namedtuple('DeviceStats',
+    ['received', 'enqueued', 'queue_drops', 'pcap_drops', 'pcap_ifdrops'])
 
 def _start_usercode(entryfunction, netobj, codeargdict):
     '''
@@ -169,6 +190,22 @@ class LLNetBase(metaclass=ABCMeta):
         '''
         raise NoPackets()
 
+    def recv_packets(self, max_count=64, timeout=None):
+        '''
+        Receive a burst of up to max_count packets on any ports/interfaces.
+        Blocks (and raises NoPackets or Shutdown) in the same way as
+        recv_packet until one packet is available, then also returns any
+        others that are available without waiting.  Returns a list of
+        ReceivedPacket named tuples.
+        '''
+        rv = [self.recv_packet(timeout=timeout)]
+        while len(rv) < max_count:
+            try:
+                rv.append(self.recv_packet(timeout=0))
+            except (NoPackets, Shutdown):
+                break
+        return rv
+
     @abstractmethod
     def send_packet(self, output_port, packet):
         '''
@@ -177,6 +214,36 @@ class LLNetBase(metaclass=ABCMeta):
         '''
         pass
 
+    def send_packets(self, packets):
+        '''
+        Send a batch of packets, given as an iterable of (output_port,
+        packet) pairs, e.g., to send the same packet out of several ports.
+        A failure to send one packet doesn't stop the others from being
+        sent.  Returns a list with one entry per packet: None if it was
+        sent, or the exception that prevented it from being sent (e.g.,
+        a ValueError for an unknown output port).
+        '''
+        results = []
+        for output_port,packet in packets:
+            try:
+                self.send_packet(output_port, packet)
+                results.append(None)
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def stats(self):
+        '''
+        Return a dict that maps each device name to a DeviceStats named
+        tuple (received, enqueued, queue_drops, pcap_drops, pcap_ifdrops)
+        of receive counters for the device: the numbers of packets
+        received, queued for the user program, and dropped because that
+        queue was full, and the numbers of packets dropped by the capture
+        mechanism and by the interface.  Only available in real mode;
+        returns an empty dict otherwise.
+        '''
+        return {}
+
     @abstractmethod
     def shutdown(self):
         pass
@@ -7,8 +7,10 @@ import subprocess
 from time import time as now
 import threading
 import textwrap
-from queue import Queue,Empty
+from queue import Empty
+from collections import deque
 import socket
+import selectors
 
 from psutil import net_if_addrs
 
@@ -21,19 +23,106 @@ from .importcode import import_or_die
 from .textcolor import *
 
 from .pcapffi import *
-from .llnetbase import LLNetBase, ReceivedPacket, _start_usercode
+from .afpacket import AfPacketDevice
+from .llnetbase import LLNetBase, ReceivedPacket, DeviceStats, _start_usercode
 
 _dlt_to_decoder = {}
-_dlt_to_decoder[Dlt.DLT_EN10MB] = lambda raw: Packet(raw, first_header=Ethernet)
-_dlt_to_decoder[Dlt.DLT_NULL] = lambda raw: Packet(raw, first_header=Null)
+_dlt_to_decoder[Dlt.DLT_EN10MB] = lambda raw: Packet(raw, first_header=Ethernet, lazy=True)
+_dlt_to_decoder[Dlt.DLT_NULL] = lambda raw: Packet(raw, first_header=Null, lazy=True)
+
+# per-thread buffer that outgoing packets are serialized into
+_sendbuf = threading.local()
+
+_sysfs_net = '/sys/class/net'
+# from linux/if_arp.h
+_ARPHRD_LOOPBACK = 772
+
+def _read_sysfs(path):
+    with open(path) as f:
+        return f.read().strip()
+
+def _sysfs_devinfo(devname):
+    '''
+    Read the link type, MAC address and interface index of a device
+    from /sys/class/net/<devname> in one pass.  Returns (InterfaceType,
+    EthAddr or None, ifindex), or None if the device isn't in sysfs.
+    '''
+    path = os.path.join(_sysfs_net, devname)
+    try:
+        arptype = int(_read_sysfs(os.path.join(path, 'type')))
+        ifindex = int(_read_sysfs(os.path.join(path, 'ifindex')))
+        address = _read_sysfs(os.path.join(path, 'address'))
+    except (OSError, ValueError):
+        return None
+    if arptype == _ARPHRD_LOOPBACK:
+        iftype = InterfaceType.Loopback
+    elif os.path.isdir(os.path.join(path, 'wireless')) or \
+         os.path.exists(os.path.join(path, 'phy80211')):
+        iftype = InterfaceType.Wireless
+    else:
+        iftype = InterfaceType.Wired
+    try:
+        macaddr = EthAddr(address)
+    except Exception:
+        # not an Ethernet-style address (e.g., tun devices have none)
+        macaddr = None
+    return iftype, macaddr, ifindex
+
+def _probe_devtype(devname):
+    '''
+    Figure out the type of a device that isn't in sysfs: from libpcap
+    for loopback, and otherwise by asking iwconfig on Linux.
+    '''
+    for p in pcap_devices():
+        if p.name == devname and p.isloop:
+            return InterfaceType.Loopback
+    if sys.platform != 'linux':
+        return InterfaceType.Unknown
+    try:
+        proc = subprocess.Popen(["iwconfig", devname], stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, universal_newlines=True)
+        output = proc.communicate()[0]
+    except OSError:
+        return InterfaceType.Unknown
+    if "no wireless extensions" in output:
+        return InterfaceType.Wired
+    return InterfaceType.Wireless
+
 
 class LLNetReal(LLNetBase):
     '''
     A class that represents a collection of network devices
     on which packets can be received and sent.
+
+    Packets are received by one of two engines.  With the 'threads'
+    engine (the default), a thread per device captures packets and
+    hands them to user code through a queue.  With the 'selector'
+    engine, there are no receiver threads: the devices are polled
+    with a selector (epoll on Linux) from within recv_packet, and
+    every ready device is drained of up to burst packets in turn.
+
+    The queue used by the 'threads' engine holds at most queue_limit
+    packets, and recv_packet takes up to burst of them at a time, so
+    at most queue_limit + burst packets are ever waiting.  When it's
+    full, queue_policy determines which packets
+    are dropped: 'tail' drops arriving packets, 'head' drops the oldest
+    queued packets, and 'fair' drops arriving packets from devices that
+    hold more than their share of the queue, and otherwise makes room
+    by dropping the oldest packet of the device holding the most.
+
+    Devices are opened with libpcap (the 'pcap' backend, the default)
+    or, on Linux, with AF_PACKET sockets and memory-mapped rings (the
+    'afpacket' backend).
     '''
-    def __init__(self, devlist, name=None):
+    engines = ('threads', 'selector')
+    stats_interval = 1.0
+    backends = ('pcap', 'afpacket')
+    queue_policies = ('tail', 'head', 'fair')
+
+    def __init__(self, devlist, name=None, engine='threads', burst=64, backend='pcap',
+                 queue_limit=65536, queue_policy='tail'):
         LLNetBase.__init__(self)
+        starttime = now()
         signal.signal(signal.SIGINT, self._sig_handler)
         signal.signal(signal.SIGTERM, self._sig_handler)
         signal.signal(signal.SIGHUP, self._sig_handler)
@@ -42,22 +131,42 @@ class LLNetReal(LLNetBase):
 
         self._devs = devlist 
         self._devinfo = self._assemble_devinfo()
+        devinfotime = now()
         self._pcaps = {}
         self._localsend = {}
-        self._pktqueue = Queue()
+        self._pending = deque()
         self._threads = []
+        if engine not in LLNetReal.engines:
+            raise ValueError("Unrecognized receive engine {}".format(engine))
+        self._engine = engine
+        if backend not in LLNetReal.backends:
+            raise ValueError("Unrecognized capture backend {}".format(backend))
+        self._backend = backend
+        if queue_policy not in LLNetReal.queue_policies:
+            raise ValueError("Unrecognized queue policy {}".format(queue_policy))
+        self._burst = burst
+        self._selector = None
+        self._wakeup = None
         self._make_pcaps()
+        pcaptime = now()
+        self._counters = { devname:_DeviceCounters() for devname in self._pcaps }
+        self._pktqueue = _queue_classes[queue_policy](queue_limit, self._counters)
         log_info("Using network devices: {}".format(' '.join(self._devs)))
         for devname, intf in self._devinfo.items():
             log_debug("{}: {}".format(devname, str(intf)))
 
         LLNetReal.running = True
-        self._spawn_threads()
+        if engine == 'selector':
+            self._make_selector()
+        else:
+            self._spawn_threads()
 
         if name:
             self._name = name
         else:
             self._name = socket.gethostname()
+        log_debug("Startup took {:.3f}s: {:.3f}s for device info, {:.3f}s to open devices".format(
+            now() - starttime, devinfotime - starttime, pcaptime - devinfotime))
 
     @property
     def name(self):
@@ -80,6 +189,13 @@ class LLNetReal(LLNetBase):
         log_debug("Joining threads for shutdown")
         for t in self._threads:
             t.join()
+        if self._selector is not None:
+            self._selector.close()
+            for fd in self._wakeup:
+                os.close(fd)
+            for devname,pdev in self._pcaps.items():
+                stats = pdev.stats()
+                log_debug("Final device statistics {}: {} received, {} dropped, {} dropped/if".format(devname, stats.ps_recv, stats.ps_drop, stats.ps_ifdrop))
         log_debug("Closing pcap devices")
         for devname,pdev in self._pcaps.items():
             pdev.close()
@@ -93,31 +209,39 @@ class LLNetReal(LLNetBase):
         network receive.
         '''
         for devname,pdev in self._pcaps.items():
-            t = threading.Thread(target=LLNetReal._low_level_dispatch, args=(pdev, devname, self._pktqueue))
+            t = threading.Thread(target=LLNetReal._low_level_dispatch, args=(pdev, devname, self._pktqueue, self._counters[devname]))
             t.start()
             self._threads.append(t)
 
+    def _make_selector(self):
+        '''
+        Internal method.  Register the selectable fd of each pcap
+        device, plus a pipe used to wake up a blocked recv_packet on
+        shutdown, with a selector.
+        '''
+        self._selector = selectors.DefaultSelector()
+        self._wakeup = os.pipe()
+        os.set_blocking(self._wakeup[1], False)
+        self._selector.register(self._wakeup[0], selectors.EVENT_READ, None)
+        for devname,pdev in self._pcaps.items():
+            if pdev.fd < 0:
+                raise ValueError("Device {} has no selectable fd; can't use the selector engine".format(devname))
+            self._selector.register(pdev.fd, selectors.EVENT_READ, (devname, pdev, pdev.dlt, self._counters[devname]))
+        self._rrstart = 0
+
     def _assemble_devinfo(self):
         '''
         Internal method.  Assemble information on each interface/
-        device that we know about, i.e., its MAC address and configured
-        IP address and prefix.
+        device that we're using, i.e., its MAC address and configured
+        IP address and prefix.  On Linux, the link type, MAC address and
+        interface index come from sysfs.
         '''
-        devtype = {}
-        for p in pcap_devices():
-            if p.isloop:
-                devtype[p.name] = InterfaceType.Loopback
-            else:
-                if sys.platform == 'linux':
-                    st,output = subprocess.getstatusoutput(["iwconfig", p.name])
-                    if "no wireless extensions" in output:
-                        devtype[p.name] = InterfaceType.Wired
-                    else:
-                        devtype[p.name] = InterfaceType.Wireless
-                elif sys.platform == 'darwin':
-                    devtype[p.name] = InterfaceType.Unknown
-                else:
-                    devtype[p.name] = InterfaceType.Unknown
+        if sys.platform == 'darwin':
+            layer2addrfam = socket.AddressFamily.AF_LINK
+        elif sys.platform == 'linux':
+            layer2addrfam = socket.AddressFamily.AF_PACKET
+        else:
+            raise RuntimeException("Platform not supported")
 
         devinfo = {}
         ifinfo = net_if_addrs()
@@ -125,13 +249,7 @@ class LLNetReal(LLNetBase):
             ifaddrs = ifinfo.get(devname, None)
             if ifaddrs is None:
                 log_warn("Address info for interface {} not found! (skipping)".format(devname))
-
-            if sys.platform == 'darwin':
-                layer2addrfam = socket.AddressFamily.AF_LINK
-            elif sys.platform == 'linux':
-                layer2addrfam = socket.AddressFamily.AF_PACKET
-            else:
-                raise RuntimeException("Platform not supported")
+                ifaddrs = []
 
             macaddr = "00:00:00:00:00:00"
             ipaddr = mask = "0.0.0.0"
@@ -142,22 +260,30 @@ class LLNetReal(LLNetBase):
                 elif addrinfo.family == layer2addrfam:
                     macaddr = EthAddr(addrinfo.address)
 
-            ifnum = socket.if_nametoindex(devname)
-            devinfo[devname] = Interface(devname, macaddr, ipaddr, netmask=mask, ifnum=ifnum, iftype=devtype[devname])
+            sysinfo = _sysfs_devinfo(devname) if sys.platform == 'linux' else None
+            if sysinfo is not None:
+                iftype,sysmac,ifnum = sysinfo
+                if sysmac is not None:
+                    macaddr = sysmac
+            else:
+                iftype = _probe_devtype(devname)
+                ifnum = socket.if_nametoindex(devname)
+            devinfo[devname] = Interface(devname, macaddr, ipaddr, netmask=mask, ifnum=ifnum, iftype=iftype)
         return devinfo
 
     def _make_pcaps(self):
         '''
-        Internal method.  Create libpcap devices
+        Internal method.  Create libpcap (or AF_PACKET) devices
         for every network interface we care about and
         set them in non-blocking mode.
         '''
+        devclass = AfPacketDevice if self._backend == 'afpacket' else PcapLiveDevice
         self._pcaps = {}
         for devname,intf in self._devinfo.items():
             if intf.iftype == InterfaceType.Loopback:
                 senddev = _RawSocket(devname, protocol=IPProtocol.UDP)
                 self._localsend[devname] = senddev
-            pdev = PcapLiveDevice(devname) 
+            pdev = devclass(devname)
             self._pcaps[devname] = pdev
 
     def _sig_handler(self, signum, stack):
@@ -167,27 +293,39 @@ class LLNetReal(LLNetBase):
         log_debug("Got SIGINT.")
         if signum == signal.SIGINT:
             LLNetReal.running = False
-            if self._pktqueue.qsize() == 0:
-                # put dummy pkt in queue to unblock a 
+            if self._wakeup is not None:
+                try:
+                    os.write(self._wakeup[1], b'\x00')
+                except OSError:
+                    pass
+            else:
+                # put marker in queue to unblock a 
                 # possibly stuck user thread
-                self._pktqueue.put( (None,None,None) )
+                self._pktqueue.put_marker()
 
     @staticmethod
-    def _low_level_dispatch(pcapdev, devname, pktqueue):
+    def _low_level_dispatch(pcapdev, devname, pktqueue, counters):
         '''
         Thread entrypoint for doing low-level receive and dispatch
         for a single pcap device.
         '''
+        # the device's own counters are only fetched from this
+        # thread, since a pcap handle isn't safe to share
+        statstime = 0
         while LLNetReal.running:
+            if now() - statstime >= LLNetReal.stats_interval:
+                counters.update_device_stats(pcapdev.stats())
+                statstime = now()
             # a non-zero timeout value is ok here; this is an
             # independent thread that handles input for this
-            # one pcap device.  it throws any packets received
+            # one pcap device.  it drains whatever the device
+            # has buffered in one go and throws the whole batch
             # into the shared queue (which is read by the actual
             # user code)
-            pktinfo = pcapdev.recv_packet(timeout=0.2)
-            if pktinfo is None:
+            batch = pcapdev.recv_packets(timeout=0.2)
+            if not batch:
                 continue
-            pktqueue.put( (devname,pcapdev.dlt,pktinfo) )
+            pktqueue.put(devname, pcapdev.dlt, batch)
 
         log_debug("Receiver thread for {} exiting".format(devname))
         stats = pcapdev.stats()
@@ -203,26 +341,114 @@ class LLNetReal(LLNetBase):
 
         Returns a ReceivedPacket named tuple (timestamp, input_port, packet)
         '''
-        while True:
-            try:
-                dev,dlt,pktinfo = self._pktqueue.get(timeout=timeout)
-                if not LLNetReal.running:
-                    break
+        pending = self._pending
+        while LLNetReal.running:
+            # packets arrive in batches; only go back to the receiver
+            # threads' queue (or the selector) once a batch is used up
+            if not pending:
+                if self._selector is not None:
+                    got = self._fill_from_selector(timeout)
+                else:
+                    got = self._fill_from_queue(timeout)
+                if not got:
+                    if not LLNetReal.running:
+                        raise Shutdown()
+                    raise NoPackets()
+                continue
+            dev,dlt,pktinfo = pending.popleft()
 
-                decoder = _dlt_to_decoder.get(dlt, None)
-                if decoder is None:
-                    log_warn("Received packet with unparseable encapsulation {}".format(dlt))
-                    continue
+            decoder = _dlt_to_decoder.get(dlt, None)
+            if decoder is None:
+                log_warn("Received packet with unparseable encapsulation {}".format(dlt))
+                continue
+
+            pkt = decoder(pktinfo.raw) 
+            ts = pktinfo.timestamp_ns
+            return ReceivedPacket(timestamp=ts / 1000000000,
+                input_port=dev, packet=pkt, timestamp_ns=ts)
+        raise Shutdown()
 
-                pkt = decoder(pktinfo.raw) 
-                return ReceivedPacket(timestamp=pktinfo.timestamp, 
-                    input_port=dev, packet=pkt)
-            except Empty:
+    def _recv_frames(self, timeout=None):
+        '''
+        Internal method.  Like recv_packets, but without decoding:
+        return a list of all the (devname, dlt, PcapPacket) tuples
+        available, waiting up to timeout seconds for the first one.
+        '''
+        pending = self._pending
+        while LLNetReal.running:
+            if pending:
+                rv = list(pending)
+                pending.clear()
+                return rv
+            if self._selector is not None:
+                got = self._fill_from_selector(timeout)
+            else:
+                got = self._fill_from_queue(timeout)
+            if not got:
                 if not LLNetReal.running:
                     raise Shutdown()
                 raise NoPackets()
         raise Shutdown()
 
+    def _fill_from_queue(self, timeout):
+        '''
+        Internal method.  Move up to burst packets put on the queue by
+        the receiver threads to the pending deque.  Returns False if
+        nothing arrived before the timeout.
+        '''
+        try:
+            self._pending.extend(self._pktqueue.get_all(timeout, self._burst))
+        except Empty:
+            return False
+        return True
+
+    def _fill_from_selector(self, timeout):
+        '''
+        Internal method.  Wait for any device to become readable and
+        move up to burst packets from each ready device to the pending
+        deque.  The device drained first rotates on each call, so a
+        busy device can't starve the others.  Returns False if nothing
+        was received before the timeout, or on shutdown.
+        '''
+        pending = self._pending
+        burst = self._burst
+        expiry = None if timeout is None else now() + timeout
+        while LLNetReal.running:
+            ready = [key.data for key,events in self._selector.select(timeout) if key.data is not None]
+            if ready:
+                start = self._rrstart % len(ready)
+                self._rrstart += 1
+                for devname,pdev,dlt,counters in ready[start:] + ready[:start]:
+                    batch = []
+                    pdev.dispatch(batch.append, burst)
+                    counters.received += len(batch)
+                    counters.enqueued += len(batch)
+                    pending.extend((devname,dlt,pktinfo) for pktinfo in batch)
+                if pending:
+                    return True
+            if expiry is not None:
+                timeout = expiry - now()
+                if timeout <= 0:
+                    break
+        return False
+
+    def stats(self):
+        '''
+        Return a dict that maps each device name to a DeviceStats named
+        tuple of counters for it: packets received from the device,
+        enqueued for user code, and dropped because the queue was full,
+        and the numbers of packets dropped by libpcap (or the kernel) and
+        by the network interface.  With the 'threads' engine, the last
+        two are fetched by the receiver threads every stats_interval
+        seconds.
+        '''
+        rv = {}
+        for devname,counters in self._counters.items():
+            if self._selector is not None:
+                counters.update_device_stats(self._pcaps[devname].stats())
+            rv[devname] = counters.snapshot()
+        return rv
+
     def send_packet(self, dev, packet):
         '''
         Send a Switchyard Packet object on the given device 
@@ -231,31 +457,117 @@ class LLNetReal(LLNetBase):
         Raises ValueError if packet object isn't valid, or device
         name isn't recognized.
         '''
+        dev,intf = self._resolve_send(dev, packet)
+
+        if intf.iftype == InterfaceType.Loopback:
+            pdev = self._localsend.get(dev, None)
+            pdev.send_packet(packet)
+        else:
+            pdev = self._pcaps.get(dev, None)
+            size = packet.size()
+            buf = getattr(_sendbuf, 'buf', None)
+            if buf is None or len(buf) < size:
+                buf = _sendbuf.buf = bytearray(max(size, 2048))
+            xlen = packet.serialize_into(buf)
+            log_debug("Sending packet on device {}: {}".format(dev, str(packet)))
+            pdev.send_packet(memoryview(buf)[:xlen])
+
+    def send_packets(self, packets):
+        '''
+        Send a batch of (device, Packet) pairs.  Each distinct packet
+        is serialized once, however many devices it is sent on, and the
+        frames for each device are sent together (with AF_PACKET devices,
+        they are queued in the transmit ring and sent with one system
+        call).  Returns a list with one entry per packet: None if it was
+        sent, or the exception that prevented it from being sent.
+        '''
+        results = []
+        serialized = {}
+        perdev = {}
+        loopback = []
+        for i,(dev,packet) in enumerate(packets):
+            results.append(None)
+            try:
+                dev,intf = self._resolve_send(dev, packet)
+            except (ValueError, KeyError) as e:
+                results[i] = e
+                continue
+            if intf.iftype == InterfaceType.Loopback:
+                loopback.append((i,dev,packet))
+                continue
+            raw = serialized.get(id(packet), None)
+            if raw is None:
+                try:
+                    raw = packet.to_bytes()
+                except Exception as e:
+                    # headers raise all sorts of things for bad field values
+                    raw = e
+                serialized[id(packet)] = raw
+            if isinstance(raw, Exception):
+                results[i] = raw
+                continue
+            perdev.setdefault(dev, []).append((i,raw))
+        log_debug("Sending batch of {} packets".format(len(results)))
+        self._send_frames(perdev, results)
+
+        # the raw socket strips headers from the packet it sends, so do
+        # these after everything else has been serialized
+        for i,dev,packet in loopback:
+            try:
+                self._localsend[dev].send_packet(packet)
+            except (PcapException, OSError, NotImplementedError) as e:
+                results[i] = e
+        return results
+
+    def _send_frames(self, perdev, results):
+        '''
+        Internal method.  Send serialized frames, given as a dict that
+        maps each device name to a list of (index, frame) pairs, and
+        store any exception raised for a frame at its index in results.
+        '''
+        for dev,frames in perdev.items():
+            pdev = self._pcaps.get(dev, None)
+            queue_packet = getattr(pdev, 'queue_packet', None)
+            if queue_packet is None:
+                for i,raw in frames:
+                    try:
+                        pdev.send_packet(raw)
+                    except PcapException as e:
+                        results[i] = e
+                continue
+            queued = []
+            for i,raw in frames:
+                try:
+                    queue_packet(raw)
+                    queued.append(i)
+                except PcapException as e:
+                    results[i] = e
+            try:
+                pdev.flush()
+            except PcapException as e:
+                for i in queued:
+                    results[i] = e
+
+    def _resolve_send(self, dev, packet):
+        '''
+        Internal method.  Check a packet to be sent and find the device
+        name and Interface for the given device name, number, or
+        Interface.  Raises ValueError if either one isn't valid (or KeyError
+        for an unknown device number).
+        '''
         if packet is None:
             raise ValueError("No packet object given to send_packet")
         if not isinstance(packet, Packet):
             raise ValueError("Object given to send_packet is not a Packet (it is: {})".format(type(packet)))
  
-        intf = None
         if isinstance(dev, int):
-           dev = self._lookup_devname(dev)
+            dev = self._lookup_devname(dev)
 
         if isinstance(dev, Interface):
-            intf = dev
-            dev = dev.name
+            return dev.name, dev
         elif dev in self._devinfo:
-            intf = self.interface_by_name(dev)
-        else:
-            raise ValueError("Unrecognized device name for packet send: {}".format(dev))
-
-        if intf.iftype == InterfaceType.Loopback:
-            pdev = self._localsend.get(dev, None)
-            pdev.send_packet(packet)
-        else:
-            pdev = self._pcaps.get(dev, None)
-            rawpkt = packet.to_bytes()
-            log_debug("Sending packet on device {}: {}".format(dev, str(packet)))
-            pdev.send_packet(rawpkt)
+            return dev, self.interface_by_name(dev)
+        raise ValueError("Unrecognized device name for packet send: {}".format(dev))
 
 def main_real(usercode, netobj, options):
     '''
@@ -331,11 +643,29 @@ class _RawSocket(object):
             raw,addrinfo = self._sock.recvfrom(1500)
             xlen = len(raw)
             log_debug("{}: received {} bytes from {} on raw".format(self._name, xlen, addrinfo))
-            return PcapPacket(now(), xlen, xlen, raw)
+            return PcapPacket(time_ns(), xlen, xlen, raw)
         except Exception as e:
             log_warn("{}: error receiving {}".format(self._name, str(e)))
             return None
 
+    def recv_packets(self, count=-1, timeout=None):
+        pktinfo = self.recv_packet(timeout)
+        if pktinfo is None:
+            return []
+        batch = [pktinfo]
+        if count < 0:
+            # unlike libpcap, there's no buffer to stop at
+            count = 64
+        self._sock.settimeout(0)
+        while len(batch) < count:
+            try:
+                raw,addrinfo = self._sock.recvfrom(1500)
+            except OSError:
+                break
+            xlen = len(raw)
+            batch.append(PcapPacket(time_ns(), xlen, xlen, raw))
+        return batch
+
     def send_packet(self, packet):
         n = packet.num_headers()
         if n == 0:
@@ -383,3 +713,170 @@ class _RawSocket(object):
 
     def set_filter(self, filterstr):
         pass
+
+
+class _DeviceCounters(object):
+    '''
+    Receive counters for one device.  The queue counters are updated
+    with the queue's lock held (or by the one thread using the selector
+    engine); the device's own drop counters are copied from its stats.
+    '''
+    __slots__ = ['received', 'enqueued', 'dropped', 'pcap_drops', 'pcap_ifdrops']
+
+    def __init__(self):
+        self.received = self.enqueued = self.dropped = 0
+        self.pcap_drops = self.pcap_ifdrops = 0
+
+    def update_device_stats(self, stats):
+        self.pcap_drops = stats.ps_drop
+        self.pcap_ifdrops = stats.ps_ifdrop
+
+    def snapshot(self):
+        return DeviceStats(self.received, self.enqueued, self.dropped,
+            self.pcap_drops, self.pcap_ifdrops)
+
+
+class _IngressQueue(object):
+    '''
+    Queue of received packets between the receiver threads and user
+    code, holding at most limit packets.  Receiver threads put whole
+    batches, and the consumer takes a batch at a time, so the lock is
+    taken once per batch rather than once per packet.  Subclasses
+    implement _enqueue and _take, which decide what is dropped when
+    the queue is full and in what order packets are handed out.
+    '''
+    def __init__(self, limit, counters):
+        if limit < 1:
+            raise ValueError("Queue limit must be at least 1")
+        self._limit = limit
+        self._counters = counters
+        self._count = 0
+        self._marker = False
+        self._cv = threading.Condition()
+
+    def put(self, devname, dlt, batch):
+        with self._cv:
+            self._counters[devname].received += len(batch)
+            self._enqueue(devname, dlt, batch)
+            self._cv.notify()
+
+    def put_marker(self):
+        '''
+        Wake up the consumer even though there are no packets.
+        '''
+        with self._cv:
+            self._marker = True
+            self._cv.notify()
+
+    def get_all(self, timeout=None, limit=None):
+        '''
+        Wait up to timeout seconds for something to be put in the queue,
+        then return the queued (devname, dlt, packet) tuples, or the
+        first limit of them; the list is empty if only a marker was put.
+        Raises Empty on timeout.
+        '''
+        with self._cv:
+            if not self._cv.wait_for(lambda: self._count or self._marker, timeout):
+                raise Empty()
+            self._marker = False
+            count = self._count if limit is None else min(limit, self._count)
+            self._count -= count
+            return self._take(count)
+
+    def qsize(self):
+        return self._count
+
+    def empty(self):
+        return not self._count and not self._marker
+
+
+class _TailDropQueue(_IngressQueue):
+    def __init__(self, limit, counters):
+        super().__init__(limit, counters)
+        self._queue = deque()
+
+    def _enqueue(self, devname, dlt, batch):
+        counters = self._counters[devname]
+        room = self._limit - self._count
+        if len(batch) > room:
+            counters.dropped += len(batch) - room
+            batch = batch[:room]
+        self._queue.extend((devname,dlt,pktinfo) for pktinfo in batch)
+        self._count += len(batch)
+        counters.enqueued += len(batch)
+
+    def _take(self, count):
+        queue = self._queue
+        if count == len(queue):
+            self._queue = deque()
+            return queue
+        popleft = queue.popleft
+        return [popleft() for i in range(count)]
+
+
+class _HeadDropQueue(_TailDropQueue):
+    def _enqueue(self, devname, dlt, batch):
+        self._queue.extend((devname,dlt,pktinfo) for pktinfo in batch)
+        self._count += len(batch)
+        self._counters[devname].enqueued += len(batch)
+        popleft = self._queue.popleft
+        counters = self._counters
+        while self._count > self._limit:
+            counters[popleft()[0]].dropped += 1
+            self._count -= 1
+
+
+class _FairShareQueue(_IngressQueue):
+    '''
+    Keeps a queue per device.  Once the queue is full, a device can
+    only add a packet if it holds less than an equal share of the queue
+    (among devices with packets queued), in which case the oldest packet
+    of the device holding the most is dropped to make room.
+
+    Packets are handed out round-robin, one from each device with
+    packets queued in turn, each device's packets in arrival order;
+    the order of arrival across devices isn't kept.
+    '''
+    def __init__(self, limit, counters):
+        super().__init__(limit, counters)
+        self._queues = { devname:deque() for devname in counters }
+
+    def _enqueue(self, devname, dlt, batch):
+        counters = self._counters
+        mine = counters[devname]
+        queue = self._queues[devname]
+        if self._count + len(batch) <= self._limit:
+            queue.extend((devname,dlt,pktinfo) for pktinfo in batch)
+            self._count += len(batch)
+            mine.enqueued += len(batch)
+            return
+        for pktinfo in batch:
+            if self._count < self._limit:
+                self._count += 1
+            else:
+                active = sum(1 for q in self._queues.values() if q) + (not queue)
+                if len(queue) >= self._limit // active:
+                    mine.dropped += 1
+                    continue
+                longest = max(self._queues.values(), key=len)
+                counters[longest.popleft()[0]].dropped += 1
+            queue.append((devname,dlt,pktinfo))
+            mine.enqueued += 1
+
+    def _take(self, count):
+        rv = []
+        queues = [q for q in self._queues.values() if q]
+        while len(rv) < count:
+            for queue in queues:
+                rv.append(queue.popleft())
+                if len(rv) == count:
+                    break
+            queues = [q for q in queues if q]
+        return rv
+
+
+_queue_classes = {
+    'tail': _TailDropQueue,
+    'head': _HeadDropQueue,
+    'fair': _FairShareQueue,
+}
@@ -0,0 +1,439 @@
+import os
+import sys
+import mmap
+import signal
+import struct
+import threading
+import multiprocessing
+from collections import deque
+from select import select
+from zlib import crc32
+
+from .lib.packet import Packet
+from .lib.interface import Interface, InterfaceType
+from .lib.exceptions import Shutdown, NoPackets
+from .lib.logging import log_info, log_debug, log_warn, log_failure
+from .importcode import import_or_die
+from .pcapffi import Dlt
+from .llnetbase import LLNetBase, ReceivedPacket, _start_usercode
+from .llnetreal import LLNetReal, _dlt_to_decoder
+
+'''
+Flow-sharded ("RSS-style") execution of user code in real mode.
+
+The main process captures packets as usual, but instead of running
+the user program, it computes a symmetric hash of each frame's flow
+(IP addresses, protocol and ports, so both directions of a connection
+hash the same) and hands the frame to one of N worker processes.  Each
+worker runs its own copy of the user program against a net object
+that receives from and sends to rings in shared memory; frames sent
+by the workers are merged back onto the devices by a thread in the
+main process.  Since every packet of a flow goes to the same worker,
+per-flow state kept by the user program (e.g., by a firewall or NAT)
+stays consistent.
+'''
+
+# the rings carry link types as plain integers
+_value_to_decoder = { dlt.value:decoder for dlt,decoder in _dlt_to_decoder.items() }
+
+_ETHERTYPE_IPV4 = 0x0800
+_ETHERTYPE_IPV6 = 0x86dd
+_VLAN_ETHERTYPES = (0x8100, 0x88a8)
+# protocols whose first four bytes of payload are the ports
+_PORT_PROTOCOLS = (6, 17, 132)
+
+def flow_hash(raw):
+    '''
+    Return a symmetric hash of the flow that an Ethernet frame belongs
+    to: of its IPv4 or IPv6 addresses, protocol, and TCP/UDP/SCTP ports
+    (fragments are hashed without ports, so that all fragments of a
+    packet hash alike), or of its MAC addresses if it's not IP.  Frames
+    going in opposite directions of the same flow have the same hash.
+    '''
+    offset = 12
+    ethertype = (raw[12] << 8) | raw[13] if len(raw) >= 14 else 0
+    while ethertype in _VLAN_ETHERTYPES and len(raw) >= offset + 6:
+        offset += 4
+        ethertype = (raw[offset] << 8) | raw[offset+1]
+    offset += 2
+    if ethertype == _ETHERTYPE_IPV4 and len(raw) >= offset + 20:
+        proto = raw[offset+9]
+        src = raw[offset+12:offset+16]
+        dst = raw[offset+16:offset+20]
+        fragment = (raw[offset+6] & 0x3f) or raw[offset+7]
+        ports = offset + (raw[offset] & 0x0f) * 4
+    elif ethertype == _ETHERTYPE_IPV6 and len(raw) >= offset + 40:
+        proto = raw[offset+6]
+        src = raw[offset+8:offset+24]
+        dst = raw[offset+24:offset+40]
+        fragment = False
+        ports = offset + 40
+    else:
+        a = raw[6:12]
+        b = raw[0:6]
+        return crc32(min(a,b) + max(a,b))
+    if not fragment and proto in _PORT_PROTOCOLS and len(raw) >= ports + 4:
+        src += raw[ports:ports+2]
+        dst += raw[ports+2:ports+4]
+    if src > dst:
+        src,dst = dst,src
+    return crc32(src + dst, proto)
+
+
+class _ShmRing(object):
+    '''
+    Single-producer, single-consumer ring of frames in a shared memory
+    mapping, between a process that puts frames and one that gets them.
+    The producer only writes the tail index and the consumer only writes
+    the head index; each record is a header (length, device index, dlt,
+    timestamp in nanoseconds) followed by the frame, padded to 8 bytes.  A record that
+    won't fit before the end of the ring is preceded by a wrap marker.
+    The producer writes a byte to a pipe after each batch it puts, which
+    the consumer waits on when the ring is empty.
+    '''
+    _header = struct.Struct('=QQI')
+    _record = struct.Struct('=IHHq')
+    _WRAP = 0xffffffff
+    _HEADERSIZE = 64
+
+    def __init__(self, size=1<<22):
+        self._size = size
+        self._mem = mmap.mmap(-1, _ShmRing._HEADERSIZE + size)
+        self._view = memoryview(self._mem)
+        self._rfd,self._wfd = os.pipe()
+        os.set_blocking(self._wfd, False)
+        self.drops = 0
+
+    @property
+    def fd(self):
+        return self._rfd
+
+    def _indexes(self):
+        return _ShmRing._header.unpack_from(self._mem, 0)
+
+    def close(self):
+        '''
+        Mark the ring closed (by the producer); the consumer gets
+        everything already put, then Shutdown.
+        '''
+        struct.pack_into('=I', self._mem, 16, 1)
+        self._ring()
+
+    @property
+    def closed(self):
+        return self._indexes()[2] != 0
+
+    def _ring(self):
+        try:
+            os.write(self._wfd, b'\x00')
+        except BlockingIOError:
+            # the consumer has plenty of wakeups pending already
+            pass
+
+    def put(self, frames):
+        '''
+        Put a batch of (devindex, dlt, timestamp_ns, frame) tuples.  Frames
+        that don't fit are dropped (and counted in the drops attribute).
+        '''
+        mem = self._mem
+        view = self._view
+        size = self._size
+        base = _ShmRing._HEADERSIZE
+        pack_into = _ShmRing._record.pack_into
+        head,tail,closed = self._indexes()
+        for devindex,dlt,ts,frame in frames:
+            flen = len(frame)
+            reclen = (_ShmRing._record.size + flen + 7) & ~7
+            offset = tail % size
+            wrap = size - offset if offset + reclen > size else 0
+            if tail + wrap + reclen - head > size:
+                head = self._indexes()[0]
+                if tail + wrap + reclen - head > size:
+                    self.drops += 1
+                    continue
+            if wrap:
+                struct.pack_into('=I', mem, base + offset, _ShmRing._WRAP)
+                tail += wrap
+                offset = 0
+            pack_into(mem, base + offset, flen, devindex, dlt, ts)
+            start = base + offset + _ShmRing._record.size
+            view[start:start+flen] = frame
+            tail += reclen
+        struct.pack_into('=Q', mem, 8, tail)
+        self._ring()
+
+    def get_all(self, timeout=None):
+        '''
+        Return all frames in the ring as a list of (devindex, dlt,
+        timestamp_ns, bytes) tuples, waiting up to timeout seconds for some
+        to be put.  Returns an empty list on timeout, and raises Shutdown
+        once the ring has been closed and emptied.
+        '''
+        head,tail,closed = self._indexes()
+        if head == tail:
+            if closed:
+                raise Shutdown()
+            xread,xwrite,xerr = select([self._rfd], [], [], timeout)
+            if xread:
+                os.read(self._rfd, 4096)
+            head,tail,closed = self._indexes()
+        mem = self._mem
+        size = self._size
+        base = _ShmRing._HEADERSIZE
+        unpack_from = _ShmRing._record.unpack_from
+        rv = []
+        while head < tail:
+            offset = head % size
+            flen = struct.unpack_from('=I', mem, base + offset)[0]
+            if flen == _ShmRing._WRAP:
+                head += size - offset
+                continue
+            flen,devindex,dlt,ts = unpack_from(mem, base + offset)
+            start = base + offset + _ShmRing._record.size
+            rv.append((devindex, dlt, ts, mem[start:start+flen]))
+            head += (_ShmRing._record.size + flen + 7) & ~7
+        struct.pack_into('=Q', mem, 0, head)
+        return rv
+
+
+class LLNetShard(LLNetBase):
+    '''
+    The net object given to the user program in each worker process
+    of flow-sharded real mode.  Receives the frames of the flows hashed
+    to this worker, and passes frames to be sent back to the main
+    process, through shared memory rings.  dlts gives the link type
+    of each device (by index, in devinfo's order; Ethernet by default),
+    which is recorded with each frame sent so the main process can
+    decode it if it has to.
+    '''
+    def __init__(self, name, devinfo, rxring, txring, worker, workers, dlts=None):
+        LLNetBase.__init__(self)
+        self._name = name
+        self._devinfo = devinfo
+        self._devnames = list(devinfo.keys())
+        self._devindex = { devname:i for i,devname in enumerate(self._devnames) }
+        if dlts is None:
+            dlts = [ Dlt.DLT_EN10MB.value ] * len(self._devnames)
+        self._dlts = dlts
+        self._rxring = rxring
+        self._txring = txring
+        self._pending = deque()
+        self._worker = worker
+        self._workers = workers
+        self._ppid = os.getppid()
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def testmode(self):
+        return False
+
+    @property
+    def worker(self):
+        '''
+        The (index, count) of this worker process.
+        '''
+        return self._worker, self._workers
+
+    def shutdown(self):
+        pass
+
+    def recv_packet(self, timeout=None):
+        '''
+        Receive the next packet hashed to this worker; see LLNetBase.
+        '''
+        if timeout is not None and timeout < 0:
+            timeout = None
+        pending = self._pending
+        while not pending:
+            # wake up now and then to notice if the main process died
+            wait = 1.0 if timeout is None or timeout < 0 else min(timeout, 1.0)
+            pending.extend(self._rxring.get_all(wait))
+            if pending:
+                break
+            if os.getppid() != self._ppid:
+                raise Shutdown()
+            if timeout is not None:
+                timeout -= wait
+                if timeout <= 0:
+                    raise NoPackets()
+        devindex,dlt,ts,frame = pending.popleft()
+        pkt = _value_to_decoder[dlt](frame)
+        return ReceivedPacket(timestamp=ts / 1000000000, input_port=self._devnames[devindex],
+            packet=pkt, timestamp_ns=ts)
+
+    def _resolve(self, dev, packet):
+        if not isinstance(packet, Packet):
+            raise ValueError("Object given to send_packet is not a Packet (it is: {})".format(type(packet)))
+        if isinstance(dev, int):
+            dev = self._lookup_devname(dev)
+        if isinstance(dev, Interface):
+            dev = dev.name
+        if dev not in self._devindex:
+            raise ValueError("Unrecognized device name for packet send: {}".format(dev))
+        return self._devindex[dev]
+
+    def send_packet(self, dev, packet):
+        '''
+        Send a packet; see LLNetBase.  The packet is sent by the main
+        process, so errors in sending it aren't reported here.
+        '''
+        devindex = self._resolve(dev, packet)
+        self._txring.put([(devindex, self._dlts[devindex], 0, packet.to_bytes())])
+
+    def send_packets(self, packets):
+        results = []
+        frames = []
+        serialized = {}
+        for dev,packet in packets:
+            try:
+                devindex = self._resolve(dev, packet)
+            except (ValueError, KeyError) as e:
+                results.append(e)
+                continue
+            raw = serialized.get(id(packet), None)
+            if raw is None:
+                raw = serialized[id(packet)] = packet.to_bytes()
+            frames.append((devindex, self._dlts[devindex], 0, raw))
+            results.append(None)
+        self._txring.put(frames)
+        return results
+
+
+def _worker_main(entry, codearg, name, devinfo, dlts, rxring, txring, worker, workers):
+    '''
+    Entrypoint for a worker process: run the user program.
+    '''
+    # the main process shuts the workers down by closing their rings
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    net = LLNetShard(name, devinfo, rxring, txring, worker, workers, dlts)
+    try:
+        _start_usercode(entry, net, codearg)
+    except Shutdown:
+        pass
+    except Exception as e:
+        import traceback
+        log_failure("Exception while running your code in worker {}: {}".format(worker, e))
+        traceback.print_exc()
+        sys.exit(1)
+
+
+def _send_from_ring(netobj, devnames, loopback, ring):
+    perdev = {}
+    for devindex,dlt,ts,frame in ring.get_all(0):
+        devname = devnames[devindex]
+        if devname in loopback:
+            # sent through a raw socket, which takes a Packet
+            decoder = _value_to_decoder.get(dlt, None)
+            if decoder is None:
+                log_warn("Can't send packet from worker with unparseable encapsulation {}".format(dlt))
+                continue
+            netobj.send_packet(devname, decoder(bytes(frame)))
+        else:
+            perdev.setdefault(devname, []).append((0, frame))
+    results = [None]
+    netobj._send_frames(perdev, results)
+    if results[0] is not None:
+        log_warn("Error sending packet from worker: {}".format(results[0]))
+
+
+def _merge_transmits(netobj, devnames, workers, rings, stop):
+    '''
+    Thread entrypoint in the main process: send the frames put in the
+    workers' transmit rings, until stop is set.
+    '''
+    fds = { ring.fd:ring for ring in rings }
+    loopback = { devname for devname in devnames
+                 if netobj.interface_by_name(devname).iftype == InterfaceType.Loopback }
+    while not stop.is_set():
+        xread,xwrite,xerr = select(list(fds), [], [], 0.5)
+        for fd in xread:
+            _send_from_ring(netobj, devnames, loopback, fds[fd])
+        if LLNetReal.running and not all(w.is_alive() for w in workers):
+            if any(w.exitcode for w in workers if not w.is_alive()):
+                log_failure("A worker process failed; shutting down")
+            else:
+                log_info("A worker process exited; shutting down")
+            LLNetReal.running = False
+    for ring in rings:
+        _send_from_ring(netobj, devnames, loopback, ring)
+
+
+def main_sharded(usercode, devlist, options):
+    '''
+    Entrypoint function for flow-sharded real mode, with options.workers
+    worker processes each running the user code.
+    '''
+    entry = import_or_die(usercode, ('main', 'switchy_main'))
+    if options.dryrun:
+        log_info("Imported your code successfully.  Exiting dry run.")
+        return
+
+    # the workers are forked before the net object starts any threads,
+    # and get the interface information once it exists
+    nworkers = options.workers
+    ctx = multiprocessing.get_context('fork')
+    rxrings = [ _ShmRing() for i in range(nworkers) ]
+    txrings = [ _ShmRing() for i in range(nworkers) ]
+    conns = []
+    workers = []
+    for i in range(nworkers):
+        parent,child = ctx.Pipe()
+        p = ctx.Process(target=_start_worker,
+            args=(child, entry, options.codearg, rxrings[i], txrings[i], i, nworkers))
+        p.start()
+        conns.append(parent)
+        workers.append(p)
+
+    netobj = LLNetReal(devlist, engine=options.engine, backend=options.backend,
+        queue_limit=options.queue_limit, queue_policy=options.queue_policy)
+    devinfo = { intf.name:intf for intf in netobj.interfaces() }
+    devnames = list(devinfo.keys())
+    devindex = { devname:i for i,devname in enumerate(devnames) }
+    dlts = [ int(netobj._pcaps[devname].dlt) for devname in devnames ]
+    for conn in conns:
+        conn.send((netobj.name, devinfo, dlts))
+    log_info("Running your code in {} worker processes".format(nworkers))
+
+    stop = threading.Event()
+    txthread = threading.Thread(target=_merge_transmits, args=(netobj, devnames, workers, txrings, stop))
+    txthread.start()
+
+    batches = [ [] for i in range(nworkers) ]
+    try:
+        while LLNetReal.running:
+            try:
+                frames = netobj._recv_frames(timeout=0.5)
+            except NoPackets:
+                continue
+            except Shutdown:
+                break
+            for devname,dlt,pktinfo in frames:
+                raw = pktinfo.raw
+                batches[flow_hash(raw) % nworkers].append(
+                    (devindex[devname], dlt.value, pktinfo.timestamp_ns, raw))
+            for i,batch in enumerate(batches):
+                if batch:
+                    rxrings[i].put(batch)
+                    batch.clear()
+    finally:
+        for ring in rxrings:
+            ring.close()
+        for p in workers:
+            p.join(2.0)
+            if p.is_alive():
+                p.terminate()
+        stop.set()
+        txthread.join()
+        for i,ring in enumerate(rxrings):
+            if ring.drops:
+                log_info("Worker {}: {} packets dropped because its receive ring was full".format(i, ring.drops))
+        netobj.shutdown()
+
+
+def _start_worker(conn, entry, codearg, rxring, txring, worker, workers):
+    name, devinfo, dlts = conn.recv()
+    conn.close()
+    _worker_main(entry, codearg, name, devinfo, dlts, rxring, txring, worker, workers)
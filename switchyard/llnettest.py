@@ -78,6 +78,18 @@ class LLNetTest(LLNetBase):
         else:
             raise TestScenarioFailure("recv_packet was called instead of {}".format(str(ev)))
 
+    def recv_packets(self, max_count=64, timeout=None):
+        '''
+        Receive a burst of up to max_count packets: the packet for the
+        next expected input event, plus those for any input events that
+        immediately follow it in the test scenario.
+        '''
+        rv = [self.recv_packet(timeout)]
+        while len(rv) < max_count and not self.scenario.done() and \
+            isinstance(self.scenario.next(), PacketInputEvent):
+            rv.append(self.recv_packet(timeout))
+        return rv
+
     def send_packet(self, devname, pkt):
         if self.scenario.done():
             raise TestScenarioFailure(
@@ -104,6 +116,15 @@ class LLNetTest(LLNetBase):
             pass
         self.timestamp += 1.0
 
+    def send_packets(self, packets):
+        # each packet is matched against the scenario in turn; a
+        # mismatch is a test failure rather than a failed send
+        results = []
+        for devname,pkt in packets:
+            self.send_packet(devname, pkt)
+            results.append(None)
+        return results
+
 def _prepare_debugger(tb):
     '''
     Figure out which stack frame in traceback (tb) is the "right" one in which
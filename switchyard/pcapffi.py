@@ -8,16 +8,13 @@ from datetime import datetime
 from select import select
 from threading import Lock
 
+from .pcapfile import PcapPacket, PcapException, PcapWriter, time_ns
+
 PcapInterface = namedtuple('PcapInterface', ['name','internal_name', 'description', 'isloop','isup','isrunning'])
 PcapStats = namedtuple('PcapStats', ['ps_recv','ps_drop','ps_ifdrop'])
-PcapPacket = namedtuple('PcapPacket', ['timestamp', 'capture_length', 'length', 'raw'])
 PcapDev = namedtuple('PcapDev', ['dlt','nonblock','snaplen','version','pcap'])
 
 
-class PcapException(Exception):
-    pass
-
-
 class Dlt(Enum):
     '''
     Data link type enumeration.  Mirrors basic
@@ -129,14 +126,17 @@ class _PcapFfi(object):
                                      const unsigned char *);
 
         pcap_t *pcap_open_dead(int, int);
+        pcap_t *pcap_open_dead_with_tstamp_precision(int, int, unsigned int);
         pcap_dumper_t *pcap_dump_open(pcap_t *, const char *);
         void pcap_dump_close(pcap_dumper_t *);
         void pcap_dump(pcap_dumper_t *, struct pcap_pkthdr *, unsigned char *);
+        int pcap_dump_flush(pcap_dumper_t *);
 
         // live capture
         pcap_t *pcap_create(const char *, char *); 
         pcap_t *pcap_open_live(const char *, int, int, int, char *);
         pcap_t *pcap_open_offline(const char *fname, char *errbuf);
+        pcap_t *pcap_open_offline_with_tstamp_precision(const char *, unsigned int, char *);
         int pcap_set_snaplen(pcap_t *, int);
         int pcap_snapshot(pcap_t *);
         int pcap_set_promisc(pcap_t *, int);
@@ -265,17 +265,20 @@ class _PcapFfi(object):
     def ffi(self):
         return self._ffi
 
-    def _recv_packet(self, xdev):
+    def _recv_packet(self, xdev, tsscale=1):
+        '''
+        Receive one packet with pcap_next_ex.  tsscale is the number
+        of nanoseconds in a unit of the header's tv_usec field: 1 for
+        handles with nanosecond timestamp precision, 1000 otherwise.
+        '''
         phdr = self._ffi.new("struct pcap_pkthdr **")
         pdata = self._ffi.new("unsigned char **")
         rv = self._libpcap.pcap_next_ex(xdev, phdr, pdata)
         if rv == 1:
-            rawpkt = bytes(self._ffi.buffer(pdata[0], phdr[0].caplen))
-            #dt = datetime.fromtimestamp(phdr[0].tv_sec)
-            usec = int(xffi.cast("int", phdr[0].tv_usec))
-            #ts = dt.replace(microsecond=usec)
-            ts = float("{:d}.{:06d}".format(phdr[0].tv_sec, usec))
-            return PcapPacket(ts, phdr[0].caplen, phdr[0].len, rawpkt)
+            hdr = phdr[0]
+            rawpkt = self._ffi.buffer(pdata[0], hdr.caplen)[:]
+            ts = hdr.tv_sec * 1000000000 + hdr.tv_usec * tsscale
+            return PcapPacket(ts, hdr.caplen, hdr.len, rawpkt)
         elif rv == 0:
             # timeout; nothing to return
             return None
@@ -307,37 +310,105 @@ class _PcapFfi(object):
 def pcap_devices():
     return _PcapFfi.instance().devices
 
+def bpf_compile(filterstr, dltype=Dlt.DLT_EN10MB, snaplen=65535):
+    '''
+    Compile a filter expression for the given link type, and return
+    the BPF program as bytes (8 bytes per instruction, in the layout of
+    struct bpf_insn/sock_filter), e.g., for attaching to a socket.
+    '''
+    base = _PcapFfi.instance()
+    xffi = base.ffi
+    xlib = base.lib
+    pcap = xlib.pcap_open_dead(dltype.value, snaplen)
+    bpf = xffi.new("struct bpf_program *")
+    try:
+        cfilter = xffi.new("char []", bytes(filterstr, 'ascii'))
+        if xlib.pcap_compile(pcap, bpf, cfilter, 1, 0xffffffff) < 0:
+            s = xffi.string(xlib.pcap_geterr(pcap))
+            raise PcapException("Error compiling filter expression: {}".format(s))
+        insns = xffi.buffer(xffi.cast("char *", bpf.bf_insns), bpf.bf_len * 8)[:]
+        xlib.pcap_freecode(bpf)
+        return insns
+    finally:
+        xlib.pcap_close(pcap)
+
 
 class PcapDumper(object):
-    __slots__ = ['_ffi','_libpcap','_base','_dumper']
+    '''
+    Class that represents a writer of a pcap capture file.  Files are
+    written with nanosecond timestamps unless tstamp_precision is
+    PcapTstampPrecision.Micro.
+
+    If any writer options are given (buffer_size, flush_interval,
+    rotate_size, rotate_interval, keep, background, queue_size; see
+    switchyard.pcapfile.PcapWriter), packets are buffered and written
+    by a PcapWriter rather than by libpcap, e.g., background=True to
+    take file writes off the caller's thread.
+    '''
+    __slots__ = ['_ffi','_libpcap','_base','_dumper','_tsdiv','_writer']
 
-    def __init__(self, outfile, dltype=Dlt.DLT_EN10MB, snaplen=65535):
+    def __init__(self, outfile, dltype=Dlt.DLT_EN10MB, snaplen=65535,
+                 tstamp_precision=PcapTstampPrecision.Nano, **options):
         self._base = _PcapFfi.instance()
         self._ffi = self._base.ffi
         self._libpcap = self._base.lib
-        pcap = self._libpcap.pcap_open_dead(dltype.value, snaplen)
+        tstamp_precision = PcapTstampPrecision(tstamp_precision)
+        self._tsdiv = 1 if tstamp_precision == PcapTstampPrecision.Nano else 1000
+        self._writer = None
+        if options:
+            self._writer = PcapWriter(outfile, dltype.value, snaplen,
+                nanosecond=(tstamp_precision == PcapTstampPrecision.Nano), **options)
+            return
+        pcap = self._libpcap.pcap_open_dead_with_tstamp_precision(dltype.value, snaplen, int(tstamp_precision))
         xoutfile = self._ffi.new("char []", bytes(outfile, 'ascii'))
         pcapdump = self._libpcap.pcap_dump_open(pcap, xoutfile) 
         dl = self._libpcap.pcap_datalink(pcap)
         snaplen = self._libpcap.pcap_snapshot(pcap)
         self._dumper = PcapDev(Dlt(dl), 0, snaplen, _PcapFfi.instance().version, pcapdump)
 
-    def write_packet(self, pkt, ts=None):
+    def write_packet(self, pkt, ts=None, ts_ns=None):
+        '''
+        Write a serialized packet with the timestamp ts_ns (integer
+        nanoseconds) or ts (float seconds), or the current time if
+        neither is given.
+        '''
         if not isinstance(pkt, bytes):
             raise PcapException("Packet to be written needs to be a Python bytes object")
+        if ts_ns is None:
+            ts_ns = round(ts * 1000000000) if ts else time_ns()
+        if self._writer is not None:
+            self._writer.write(pkt, ts_ns)
+            return
+
         pkthdr = self._ffi.new("struct pcap_pkthdr *")
-        if not ts:
-            ts = time()
 
-        pkthdr.tv_sec = int(ts)
-        pkthdr.tv_usec = int(1000000*(ts-int(ts)))
+        sec,nsec = divmod(ts_ns, 1000000000)
+        pkthdr.tv_sec = sec
+        pkthdr.tv_usec = nsec // self._tsdiv
 
         pkthdr.caplen = len(pkt)
         pkthdr.len = len(pkt)
         xpkt = self._ffi.new("unsigned char []", pkt)
         self._libpcap.pcap_dump(self._dumper.pcap, pkthdr, xpkt)
 
+    @property
+    def dropped(self):
+        '''
+        Number of packets dropped because the background writer's queue
+        was full.
+        '''
+        return self._writer.dropped if self._writer is not None else 0
+
+    def flush(self):
+        if self._writer is not None:
+            self._writer.flush()
+        else:
+            self._libpcap.pcap_dump_flush(self._dumper.pcap)
+
     def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            return
         self._libpcap.pcap_dump_close(self._dumper.pcap)
 
 
@@ -345,16 +416,19 @@ class PcapReader(object):
     '''
     Class the represents a reader of an existing pcap capture file.
     '''
-    __slots__ = ['_ffi','_libpcap','_base','_pcapdev','_user_callback']
+    __slots__ = ['_ffi','_libpcap','_base','_pcapdev','_user_callback','_tsscale']
 
     def __init__(self, filename, filterstr=None):
         self._base = _PcapFfi.instance()
         self._ffi = self._base.ffi
         self._libpcap = self._base.lib
         self._user_callback = None
+        # libpcap scales microsecond files to nanoseconds for us
+        self._tsscale = 1
 
         errbuf = self._ffi.new("char []", 128)
-        pcap = self._libpcap.pcap_open_offline(bytes(filename, 'ascii'), errbuf)
+        pcap = self._libpcap.pcap_open_offline_with_tstamp_precision(bytes(filename, 'ascii'),
+            int(PcapTstampPrecision.Nano), errbuf)
         if pcap == self._ffi.NULL:
             raise PcapException("Failed to open pcap file for reading: {}: {}".format(filename, self._ffi.string(errbuf)))
         
@@ -372,7 +446,7 @@ class PcapReader(object):
         self._libpcap.pcap_close(self._pcapdev.pcap)
 
     def recv_packet(self):
-        return self._base._recv_packet(self._pcapdev.pcap)
+        return self._base._recv_packet(self._pcapdev.pcap, self._tsscale)
 
     def set_filter(self, filterstr):
         self._base._set_filter(self._pcapdev.pcap, filterstr)
@@ -401,7 +475,7 @@ class PcapLiveDevice(object):
     '''
     _OpenDevices = {} # objectid -> low-level pcap dev
     _lock = Lock()
-    __slots__ = ['_ffi','_libpcap','_base','_pcapdev','_devname','_fd','_user_callback']
+    __slots__ = ['_ffi','_libpcap','_base','_pcapdev','_devname','_fd','_user_callback','_handle','_tsscale']
 
     def __init__(self, device, snaplen=65535, promisc=1, to_ms=100, 
                  filterstr=None, nonblock=True, only_create=False):
@@ -410,6 +484,8 @@ class PcapLiveDevice(object):
         self._libpcap = self._base.lib
         self._fd = None
         self._user_callback = None
+        self._handle = self._ffi.new_handle(self)
+        self._tsscale = 1000
 
         errbuf = self._ffi.new("char []", 128)
         internal_name = None
@@ -431,9 +507,21 @@ class PcapLiveDevice(object):
                 raise PcapException("Failed to open live device {}: {}".format(internal_name, self._ffi.string(errbuf)))
             return
 
-        pcap = self._libpcap.pcap_open_live(bytes(internal_name, 'ascii'), snaplen, promisc, to_ms, errbuf)
+        # like pcap_open_live, but asking for nanosecond timestamps
+        # (libpcap falls back to microseconds if it can't provide them)
+        pcap = self._libpcap.pcap_create(bytes(internal_name, 'ascii'), errbuf)
         if pcap == self._ffi.NULL:
             raise PcapException("Failed to open live device {}: {}".format(internal_name, self._ffi.string(errbuf)))
+        self._libpcap.pcap_set_snaplen(pcap, snaplen)
+        self._libpcap.pcap_set_promisc(pcap, promisc)
+        self._libpcap.pcap_set_timeout(pcap, to_ms)
+        self._libpcap.pcap_set_tstamp_precision(pcap, int(PcapTstampPrecision.Nano))
+        rv = self._libpcap.pcap_activate(pcap)
+        if rv < 0:
+            s = self._ffi.string(self._libpcap.pcap_geterr(pcap))
+            self._libpcap.pcap_close(pcap)
+            raise PcapException("Failed to open live device {}: {}".format(internal_name, s))
+        self._tsscale = self._precision_scale(pcap)
 
         if nonblock:
             rv = self._libpcap.pcap_setnonblock(pcap, 1, errbuf)
@@ -474,8 +562,14 @@ class PcapLiveDevice(object):
 
         self._pcapdev = PcapDev(self.dlt, self.blocking, self.snaplen, 
                 _PcapFfi.instance().version, self._pcapdev.pcap)
+        self._tsscale = self._precision_scale(self._pcapdev.pcap)
         return warning
 
+    def _precision_scale(self, pcap):
+        if self._libpcap.pcap_get_tstamp_precision(pcap) == PcapTstampPrecision.Nano:
+            return 1
+        return 1000
+
     @property
     def blocking(self):
         errbuf = self._ffi.new("char []", 128)
@@ -600,8 +694,17 @@ class PcapLiveDevice(object):
         return self._devname
 
     def send_packet(self, xbuffer):
+        '''
+        Send a serialized packet.  xbuffer can be a bytes object or any
+        other (contiguous) object that supports the buffer protocol,
+        such as a bytearray or memoryview; its contents are passed to
+        libpcap without being copied.
+        '''
         if not isinstance(xbuffer, bytes):
-            raise PcapException("Packets to be sent via libpcap must be serialized as a bytes object")
+            try:
+                xbuffer = self._ffi.from_buffer(xbuffer)
+            except TypeError:
+                raise PcapException("Packets to be sent via libpcap must be serialized as a bytes-like object")
         xlen = len(xbuffer)
         rv = self._libpcap.pcap_sendpacket(self._pcapdev.pcap, xbuffer, xlen)
         if rv == 0:
@@ -610,18 +713,16 @@ class PcapLiveDevice(object):
         raise PcapException("Error sending packet: {}".format(s))
 
     def recv_packet_or_none(self):
-        return self._base._recv_packet(self._pcapdev.pcap)
+        return self._base._recv_packet(self._pcapdev.pcap, self._tsscale)
 
     def dispatch(self, callback, count=-1):
         self._user_callback = callback
-        handle = self._ffi.new_handle(self)
-        rv = self._libpcap.pcap_dispatch(self._pcapdev.pcap, count, _pcap_callback, handle)
+        rv = self._libpcap.pcap_dispatch(self._pcapdev.pcap, count, _pcap_callback, self._handle)
         return rv
 
     def loop(self, callback, count=-1):
         self._user_callback = callback
-        handle = self._ffi.new_handle(self)
-        rv = self._libpcap.pcap_loop(self._pcapdev.pcap, count, _pcap_callback, handle)
+        rv = self._libpcap.pcap_loop(self._pcapdev.pcap, count, _pcap_callback, self._handle)
 
     def _callback(self, pkt):
         self._user_callback(pkt)
@@ -629,6 +730,43 @@ class PcapLiveDevice(object):
     def breakloop(self):
         self._libpcap.pcap_breakloop(self._pcapdev.pcap)
 
+    def recv_packets(self, count=-1, timeout=None):
+        '''
+        Receive a burst of packets with one call to pcap_dispatch:
+        up to count packets, or everything in libpcap's buffer if
+        count is -1.  If no packets are available, wait up to timeout
+        seconds (or indefinitely if timeout is None) for some to arrive.
+        Returns a (possibly empty) list of PcapPacket objects.
+        '''
+        if timeout is None or timeout < 0:
+            timeout = None
+
+        batch = []
+        if self._fd >= 0:
+            try:
+                xread,xwrite,xerr = select([self._fd], [], [self._fd], timeout)
+            except:
+                return batch
+            if xread:
+                self._dispatch_into(batch, count)
+        elif self._pcapdev.nonblock and timeout:
+            # can't do select, so poll up to 10 times within the timeout
+            expiry = time() + timeout
+            while not batch and time() < expiry:
+                sleep(timeout/10)
+                self._dispatch_into(batch, count)
+        else:
+            self._dispatch_into(batch, count)
+        return batch
+
+    def _dispatch_into(self, batch, count):
+        self._user_callback = batch.append
+        rv = self._libpcap.pcap_dispatch(self._pcapdev.pcap, count, _pcap_callback, self._handle)
+        if rv == -1:
+            s = self._ffi.string(self._libpcap.pcap_geterr(self._pcapdev.pcap))
+            raise PcapException("Error receiving packets: {}".format(s))
+        return rv
+
     def recv_packet(self, timeout):
         # FIXME: ugly and long
         if timeout is None or timeout < 0:
@@ -640,7 +778,7 @@ class PcapLiveDevice(object):
             except:
                 return None
             if xread:  
-                return self._base._recv_packet(self._pcapdev.pcap)
+                return self._base._recv_packet(self._pcapdev.pcap, self._tsscale)
             # timeout; return nothing
             return None
         elif self._pcapdev.nonblock:
@@ -652,17 +790,17 @@ class PcapLiveDevice(object):
                 expiry = now + timeout
                 while now < expiry:
                     sleep(timeout/10)
-                    pkt = self._base._recv_packet(self._pcapdev.pcap)
+                    pkt = self._base._recv_packet(self._pcapdev.pcap, self._tsscale)
                     if pkt:
                         return pkt
                     now = time()
                 # after all that, still got nothing.
                 return None
             else:
-                return self._base._recv_packet(self._pcapdev.pcap)
+                return self._base._recv_packet(self._pcapdev.pcap, self._tsscale)
         else:
             # no select, no non-blocking mode.  block away, my friend.
-            return self._base._recv_packet(self._pcapdev.pcap)
+            return self._base._recv_packet(self._pcapdev.pcap, self._tsscale)
 
     def close(self):
         with PcapLiveDevice._lock:
@@ -696,15 +834,12 @@ _PcapFfi() # instantiate singleton
 xffi = _PcapFfi.instance().ffi
 @xffi.callback("void(*)(unsigned char *, const struct pcap_pkthdr *, const unsigned char *)")
 def _pcap_callback(handle, phdr, pdata):
-    xhandle = xffi.cast("void *", handle)
-    pcapobj = xffi.from_handle(xhandle)
-    rawpkt = bytes(xffi.buffer(pdata, phdr[0].caplen))
-    # dt = datetime.fromtimestamp(phdr[0].tv_sec)
-    usec = int(xffi.cast("int", phdr[0].tv_usec))
-    # ts = dt.replace(microsecond=usec)
-    ts = float("{}.{:06d}".format(phdr[0].tv_sec, usec))
-    pkt = PcapPacket(ts, phdr[0].caplen, phdr[0].len, rawpkt)
-    pcapobj._callback(pkt)
+    pcapobj = xffi.from_handle(xffi.cast("void *", handle))
+    hdr = phdr[0]
+    caplen = hdr.caplen
+    rawpkt = xffi.buffer(pdata, caplen)[:]
+    ts = hdr.tv_sec * 1000000000 + hdr.tv_usec * pcapobj._tsscale
+    pcapobj._callback(PcapPacket(ts, caplen, hdr.len, rawpkt))
 
 
 if __name__ == '__main__':
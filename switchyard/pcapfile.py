@@ -0,0 +1,584 @@
+import os
+import mmap
+import struct
+import threading
+import multiprocessing
+from array import array
+from bisect import bisect_left
+from collections import namedtuple, deque
+from time import time, monotonic
+try:
+    from time import time_ns
+except ImportError:
+    def time_ns():
+        return int(time() * 1000000000)
+
+'''
+A reader for pcap and pcapng capture files written in pure Python, so
+that offline processing doesn't need libpcap.
+
+The file is memory-mapped, and each packet's raw attribute is a
+memoryview of the mapping: nothing is copied unless the caller copies
+it (e.g., with bytes(pkt.raw)).  Both byte orders are handled, as are
+nanosecond pcap files and pcapng timestamp resolutions.  An index of
+packet offsets and timestamps can be built for random access by packet
+number or time, and for decoding chunks of a file in parallel.
+
+PcapWriter is the other direction: a pcap file writer with a large
+userspace buffer, optional size- or time-based rotation across a
+bounded set of files, and an optional background writer thread.
+'''
+
+class PcapException(Exception):
+    pass
+
+
+class PcapPacket(namedtuple('PcapPacket', ['timestamp_ns', 'capture_length', 'length', 'raw'])):
+    '''
+    A captured packet.  timestamp_ns is the capture time as an integer
+    number of nanoseconds since the epoch, and timestamp is the same
+    time as a float number of seconds.  NB: the first field used to be
+    the float seconds; unpacking a PcapPacket positionally now gives
+    nanoseconds, so use the timestamp attribute for seconds.
+    '''
+    __slots__ = ()
+
+    @property
+    def timestamp(self):
+        return self.timestamp_ns / 1000000000
+
+
+PcapFileInterface = namedtuple('PcapFileInterface', ['linktype', 'snaplen'])
+
+# per-interface timestamp conversion: ns = units * mul // div + offset
+_Interface = namedtuple('_Interface', ['linktype', 'snaplen', 'mul', 'div', 'offset', 'section'])
+
+_PCAP_MAGIC_USEC = 0xa1b2c3d4
+_PCAP_MAGIC_NSEC = 0xa1b23c4d
+
+_PCAPNG_SHB = 0x0a0d0d0a
+_PCAPNG_IDB = 0x00000001
+_PCAPNG_OPB = 0x00000002
+_PCAPNG_SPB = 0x00000003
+_PCAPNG_EPB = 0x00000006
+_PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+
+_IF_TSRESOL = 9
+_IF_TSOFFSET = 14
+
+
+class PcapFile(object):
+    '''
+    Read a pcap or pcapng file through a memory mapping.  Iterating
+    over the object yields PcapPacket objects in file order.
+
+    Packets' raw attributes refer to the mapping and are only valid
+    until the file is closed; copy any that need to be kept longer.
+    '''
+    def __init__(self, filename):
+        self._filename = filename
+        with open(filename, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise PcapException("{} is empty".format(filename))
+        self._view = memoryview(self._map)
+        self._interfaces = []
+        self._sections = []
+        self._shbs = {}
+        self._idbs = {}
+        self._offsets = None
+        self._ifindex = None
+        self._times = None
+
+        if len(self._map) < 24:
+            self.close()
+            raise PcapException("{} is too short to be a capture file".format(filename))
+        magic = self._map[:4]
+        for endian in '<>':
+            value = struct.unpack(endian + 'I', magic)[0]
+            if value in (_PCAP_MAGIC_USEC, _PCAP_MAGIC_NSEC):
+                self._ng = False
+                self._record = struct.Struct(endian + 'IIII')
+                snaplen,linktype = struct.unpack_from(endian + 'II', self._map, 16)
+                mul = 1000 if value == _PCAP_MAGIC_USEC else 1
+                self._interfaces.append(_Interface(linktype & 0x0fffffff, snaplen, mul, 1, 0, 0))
+                break
+        else:
+            if struct.unpack('<I', magic)[0] != _PCAPNG_SHB:
+                self.close()
+                raise PcapException("{} isn't a pcap or pcapng file".format(filename))
+            self._ng = True
+            # register the interfaces that precede the first packet
+            next(self._scan_pcapng(), None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        '''
+        Unmap the file.  If memoryviews of packets are still referenced
+        elsewhere, the mapping is released when they're gone.
+        '''
+        if self._map is None:
+            return
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+        self._map = None
+
+    @property
+    def format(self):
+        return 'pcapng' if self._ng else 'pcap'
+
+    @property
+    def interfaces(self):
+        '''
+        List of the capture interfaces (linktype, snaplen) seen so far;
+        a pcap file has exactly one.
+        '''
+        return [ PcapFileInterface(i.linktype, i.snaplen) for i in self._interfaces ]
+
+    @property
+    def linktype(self):
+        '''
+        Link-layer header type (a DLT_/LINKTYPE_ value) of the first
+        interface.
+        '''
+        if not self._interfaces:
+            raise PcapException("No interfaces described in {}".format(self._filename))
+        return self._interfaces[0].linktype
+
+    def __iter__(self):
+        view = self._view
+        for offset,ifindex,ts,caplen,origlen,start in self._scan():
+            yield PcapPacket(ts, caplen, origlen, view[start:start+caplen])
+
+    def _scan(self):
+        '''
+        Yield (offset, interface index, timestamp_ns, caplen, origlen,
+        data offset) for each packet record in the file.  A truncated
+        last record is ignored.
+        '''
+        if self._ng:
+            return self._scan_pcapng()
+        return self._scan_pcap()
+
+    def _scan_pcap(self):
+        mm = self._map
+        size = len(mm)
+        unpack_from = self._record.unpack_from
+        mul = self._interfaces[0].mul
+        offset = 24
+        while offset + 16 <= size:
+            sec,frac,caplen,origlen = unpack_from(mm, offset)
+            start = offset + 16
+            if start + caplen > size:
+                break
+            yield offset, 0, sec * 1000000000 + frac * mul, caplen, origlen, start
+            offset = start + caplen
+
+    def _scan_pcapng(self):
+        mm = self._map
+        size = len(mm)
+        offset = 0
+        endian = '<'
+        sectionindex = None
+        section = []
+        while offset + 12 <= size:
+            if struct.unpack_from('<I', mm, offset)[0] == _PCAPNG_SHB:
+                sectionindex = self._section_at(offset)
+                endian,section = self._sections[sectionindex]
+            btype,blen = struct.unpack_from(endian + 'II', mm, offset)
+            if blen < 12 or offset + blen > size:
+                break
+            if btype == _PCAPNG_IDB and sectionindex is not None:
+                if offset not in self._idbs:
+                    self._add_interface(offset, endian, blen, sectionindex)
+            elif btype in (_PCAPNG_EPB, _PCAPNG_SPB, _PCAPNG_OPB):
+                rec = self._decode_block(offset, btype, blen, endian, section)
+                if rec is not None:
+                    yield rec
+            offset += blen
+
+    def _section_endian(self, offset):
+        order = self._map[offset+8:offset+12]
+        if struct.unpack('<I', order)[0] == _PCAPNG_BYTE_ORDER_MAGIC:
+            return '<'
+        if struct.unpack('>I', order)[0] == _PCAPNG_BYTE_ORDER_MAGIC:
+            return '>'
+        raise PcapException("Bad byte-order magic in section header at offset {}".format(offset))
+
+    def _section_at(self, offset):
+        '''
+        Return the index of the section whose header is at offset,
+        registering the section the first time it's seen.  Each section
+        is an (endian, interface indexes) tuple, since interface ids in
+        packet blocks are numbered within their section.
+        '''
+        if offset not in self._shbs:
+            self._shbs[offset] = len(self._sections)
+            self._sections.append((self._section_endian(offset), []))
+        return self._shbs[offset]
+
+    def _add_interface(self, offset, endian, blen, sectionindex):
+        mm = self._map
+        linktype,reserved,snaplen = struct.unpack_from(endian + 'HHI', mm, offset + 8)
+        mul,div,tsoffset = 1000, 1, 0
+        opt = offset + 16
+        end = offset + blen - 4
+        while opt + 4 <= end:
+            code,length = struct.unpack_from(endian + 'HH', mm, opt)
+            if code == 0:
+                break
+            if code == _IF_TSRESOL and length >= 1:
+                resol = mm[opt+4]
+                if resol & 0x80:
+                    mul,div = 1000000000, 1 << (resol & 0x7f)
+                elif resol <= 9:
+                    mul,div = 10 ** (9 - resol), 1
+                else:
+                    mul,div = 1, 10 ** (resol - 9)
+            elif code == _IF_TSOFFSET and length >= 8:
+                tsoffset = struct.unpack_from(endian + 'q', mm, opt + 4)[0] * 1000000000
+            opt += 4 + ((length + 3) & ~3)
+        self._idbs[offset] = len(self._interfaces)
+        self._sections[sectionindex][1].append(len(self._interfaces))
+        self._interfaces.append(_Interface(linktype, snaplen, mul, div, tsoffset, sectionindex))
+
+    def _decode_block(self, offset, btype, blen, endian, section):
+        mm = self._map
+        if btype == _PCAPNG_EPB:
+            ifid,tshi,tslo,caplen,origlen = struct.unpack_from(endian + '5I', mm, offset + 8)
+            start = offset + 28
+        elif btype == _PCAPNG_OPB:
+            ifid,drops,tshi,tslo,caplen,origlen = struct.unpack_from(endian + 'HH4I', mm, offset + 8)
+            start = offset + 28
+        else:
+            ifid,tshi,tslo = 0,0,0
+            origlen = struct.unpack_from(endian + 'I', mm, offset + 8)[0]
+            start = offset + 12
+            caplen = min(origlen, blen - 16)
+            if section and self._interfaces[section[0]].snaplen:
+                caplen = min(caplen, self._interfaces[section[0]].snaplen)
+        if ifid >= len(section) or start + caplen > offset + blen:
+            return None
+        ifindex = section[ifid]
+        iface = self._interfaces[ifindex]
+        if btype == _PCAPNG_SPB:
+            ts = 0
+        else:
+            ts = ((tshi << 32) | tslo) * iface.mul // iface.div + iface.offset
+        return offset, ifindex, ts, caplen, origlen, start
+
+    def build_index(self):
+        '''
+        Scan the file once, recording the offset, interface and
+        timestamp of every packet, for random access.  Returns the
+        number of packets.
+        '''
+        if self._offsets is None:
+            offsets = array('Q')
+            ifindexes = array('I')
+            times = array('q')
+            for offset,ifindex,ts,caplen,origlen,start in self._scan():
+                offsets.append(offset)
+                ifindexes.append(ifindex)
+                times.append(ts)
+            self._offsets, self._ifindex, self._times = offsets, ifindexes, times
+        return len(self._offsets)
+
+    def __len__(self):
+        return self.build_index()
+
+    def __getitem__(self, n):
+        '''
+        Return packet number n (from 0), building the index first if
+        necessary.
+        '''
+        self.build_index()
+        if n < 0:
+            n += len(self._offsets)
+        offset,ifindex,ts,caplen,origlen,start = self._record_at(n)
+        return PcapPacket(ts, caplen, origlen, self._view[start:start+caplen])
+
+    def _record_at(self, n):
+        offset = self._offsets[n]
+        if not self._ng:
+            sec,frac,caplen,origlen = self._record.unpack_from(self._map, offset)
+            return offset, 0, self._times[n], caplen, origlen, offset + 16
+        iface = self._interfaces[self._ifindex[n]]
+        endian,section = self._sections[iface.section]
+        btype,blen = struct.unpack_from(endian + 'II', self._map, offset)
+        return self._decode_block(offset, btype, blen, endian, section)
+
+    def interface_of(self, n):
+        '''
+        Return the index (into interfaces) of the interface on which
+        packet number n was captured.
+        '''
+        self.build_index()
+        return self._ifindex[n]
+
+    def find(self, timestamp_ns):
+        '''
+        Return the number of the first packet captured at or after
+        timestamp_ns, assuming the packets are in time order (as
+        capture tools write them); len(self) if there's none.
+        '''
+        self.build_index()
+        return bisect_left(self._times, timestamp_ns)
+
+    def packets(self, start=0, stop=None):
+        '''
+        Generate the PcapPackets numbered start up to (not including)
+        stop, using the index.
+        '''
+        self.build_index()
+        if stop is None or stop > len(self._offsets):
+            stop = len(self._offsets)
+        view = self._view
+        for n in range(start, stop):
+            offset,ifindex,ts,caplen,origlen,begin = self._record_at(n)
+            yield PcapPacket(ts, caplen, origlen, view[begin:begin+caplen])
+
+    def map_packets(self, func, workers=None, chunksize=10000):
+        '''
+        Generate func(pkt) for every packet, in file order, with the
+        file divided into chunks of chunksize packets that are handed
+        out to a pool of worker processes (os.cpu_count() of them if
+        workers is None).  The results of func must be picklable.
+        Where processes can't be forked, or workers is 1, everything is
+        done in the calling process.
+        '''
+        if workers == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            for pkt in self:
+                yield func(pkt)
+            return
+        total = self.build_index()
+        chunks = [ (i, min(i + chunksize, total)) for i in range(0, total, chunksize) ]
+        ctx = multiprocessing.get_context('fork')
+        pool = ctx.Pool(workers, initializer=_init_worker, initargs=(self, func))
+        try:
+            for results in pool.imap(_map_chunk, chunks):
+                yield from results
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+# state of a map_packets worker process, inherited when it's forked
+_worker_file = None
+_worker_func = None
+
+def _init_worker(pcapfile, func):
+    global _worker_file, _worker_func
+    _worker_file = pcapfile
+    _worker_func = func
+
+def _map_chunk(bounds):
+    start,stop = bounds
+    func = _worker_func
+    return [ func(pkt) for pkt in _worker_file.packets(start, stop) ]
+
+
+class PcapWriter(object):
+    '''
+    Write a pcap file (nanosecond timestamps unless nanosecond is
+    False), buffering up to buffer_size bytes in userspace between
+    writes to the file.
+
+    With rotate_size (bytes) or rotate_interval (seconds), a new file is
+    started when the current one would grow past the size or has been
+    open for the interval.  The files are then named with a sequence
+    number before the extension (e.g., capture.0.pcap, capture.1.pcap),
+    and if keep is given, only the last keep files are retained.
+
+    The buffer is flushed to the file at least every flush_interval
+    seconds if that's given.  With background=True, write() only puts
+    the packet on a queue of up to queue_size packets for a writer
+    thread; packets that arrive while the queue is full are dropped and
+    counted in the dropped attribute, so that a slow disk doesn't hold
+    up the caller.
+    '''
+    def __init__(self, filename, linktype=1, snaplen=65535, nanosecond=True,
+                 buffer_size=1<<20, rotate_size=None, rotate_interval=None,
+                 keep=None, flush_interval=None, background=False, queue_size=65536):
+        self._filename = filename
+        self._snaplen = snaplen
+        self._tsdiv = 1 if nanosecond else 1000
+        self._header = struct.pack('=IHHiIII', _PCAP_MAGIC_NSEC if nanosecond else _PCAP_MAGIC_USEC,
+            2, 4, 0, 0, snaplen, linktype)
+        self._buffer_size = buffer_size
+        self._rotate_size = rotate_size
+        self._rotate_interval = rotate_interval
+        self._keep = keep
+        self._flush_interval = flush_interval
+        self._rotating = rotate_size is not None or rotate_interval is not None
+        self._sequence = 0
+        self._files = []
+        self._buf = bytearray()
+        self._file = None
+        self.dropped = 0
+        self._open_next()
+
+        # in background mode, the caller only appends to a deque, which
+        # the writer thread drains in batches; the thread sleeps on
+        # _wakeup while there's nothing to do
+        self._queue = None
+        self._queue_size = queue_size
+        self._flushes = deque()
+        self._closing = False
+        self._wakeup = threading.Event()
+        self._thread = None
+        if background:
+            self._queue = deque()
+            self._thread = threading.Thread(target=self._writer_thread, daemon=True)
+            self._thread.start()
+
+    @property
+    def files(self):
+        '''
+        Names of the files written and retained so far, oldest first.
+        '''
+        return list(self._files)
+
+    def _open_next(self):
+        if self._file is not None:
+            self._flush_buffer()
+            self._file.close()
+        if self._rotating:
+            stem,ext = os.path.splitext(self._filename)
+            name = "{}.{}{}".format(stem, self._sequence, ext)
+            self._sequence += 1
+        else:
+            name = self._filename
+        self._file = open(name, 'wb', buffering=0)
+        self._files.append(name)
+        if self._keep is not None:
+            while len(self._files) > self._keep:
+                try:
+                    os.unlink(self._files.pop(0))
+                except OSError:
+                    pass
+        self._buf += self._header
+        self._filesize = len(self._header)
+        self._opened = monotonic()
+        self._lastflush = self._opened
+
+    def _flush_buffer(self):
+        if self._buf:
+            self._file.write(self._buf)
+            del self._buf[:]
+        self._lastflush = monotonic()
+
+    def write(self, pkt, ts_ns=None):
+        '''
+        Write a serialized packet (any bytes-like object) with the
+        timestamp ts_ns, or the current time if it's None.
+        '''
+        if self._file is None:
+            raise ValueError("write to a closed PcapWriter")
+        if ts_ns is None:
+            ts_ns = time_ns()
+        q = self._queue
+        if q is None:
+            self._write(pkt, ts_ns)
+        elif len(q) < self._queue_size:
+            q.append((pkt, ts_ns))
+            # checked after the append: if the event is still set, the
+            # writer hasn't cleared it yet and will see the packet
+            if not self._wakeup.is_set():
+                self._wakeup.set()
+        else:
+            self.dropped += 1
+
+    def _write(self, pkt, ts_ns):
+        length = len(pkt)
+        caplen = min(length, self._snaplen)
+        reclen = 16 + caplen
+        if self._rotating and self._filesize > len(self._header):
+            if (self._rotate_size is not None and self._filesize + reclen > self._rotate_size) or \
+               (self._rotate_interval is not None and monotonic() - self._opened >= self._rotate_interval):
+                self._open_next()
+        sec,nsec = divmod(ts_ns, 1000000000)
+        buf = self._buf
+        buf += _pcap_record.pack(sec, nsec // self._tsdiv, caplen, length)
+        buf += pkt[:caplen] if caplen < length else pkt
+        self._filesize += reclen
+        if len(buf) >= self._buffer_size:
+            self._flush_buffer()
+        elif self._flush_interval is not None and monotonic() - self._lastflush >= self._flush_interval:
+            self._flush_buffer()
+
+    def _writer_thread(self):
+        q = self._queue
+        flushes = self._flushes
+        interval = self._flush_interval
+        wakeup = self._wakeup
+        while True:
+            wakeup.clear()
+            closing = self._closing
+            while q:
+                self._write(*q.popleft())
+            if flushes:
+                # anything written before the flush was requested is
+                # in the queue by now
+                while q:
+                    self._write(*q.popleft())
+                self._flush_buffer()
+                while flushes:
+                    flushes.popleft().set()
+            if closing:
+                break
+            # only wake up without a packet to write out the buffer
+            # when the flush interval runs out
+            timeout = None
+            if interval is not None and self._buf:
+                timeout = self._lastflush + interval - monotonic()
+                if timeout <= 0:
+                    self._flush_buffer()
+                    timeout = None
+            wakeup.wait(timeout)
+
+    def flush(self):
+        '''
+        Write out everything buffered (in background mode, everything
+        written up to now).  Does nothing once the writer is closed.
+        '''
+        if self._file is None:
+            return
+        if self._thread is not None:
+            done = threading.Event()
+            self._flushes.append(done)
+            self._wakeup.set()
+            done.wait()
+            return
+        self._flush_buffer()
+
+    def close(self):
+        if self._file is None:
+            return
+        if self._thread is not None:
+            self._closing = True
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self._flush_buffer()
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# pcap record header, in host byte order as libpcap writes it
+_pcap_record = struct.Struct('=IIII')
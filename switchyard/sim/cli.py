@@ -16,7 +16,7 @@ from ..lib.packet import *
 from ..textcolor import *
 from ..importcode import import_or_die
 from ..lib.logging import log_debug, log_info
-from ..pcapffi import PcapReader
+from ..pcapfile import PcapFile, PcapException
 
 __author__ = 'jsommers@colgate.edu'
 __doc__ = 'SwitchYard Substrate Simulator'
@@ -163,15 +163,17 @@ Note that any command can be abbreviated by typing enough characters to distingu
         if not node.hasInterface(cmdargs[2]):
             print ("Error: node {} has no such interface {}.".format(cmdargs[1], cmdargs[2]))
             return
-        reader = PcapReader(cmdargs[0])
+        try:
+            reader = PcapFile(cmdargs[0])
+        except PcapException as e:
+            print ("Error: {}".format(e))
+            return
         count = 0
-        while True:
-            pkt = reader.recv_packet()
-            if pkt is None:
-                break
-            p = Packet(raw=pkt.raw)
-            self.syss_glue.emitPacketFromNodeInterface(cmdargs[1], cmdargs[2], p)
-            count += 1
+        with reader:
+            for pkt in reader:
+                p = Packet(raw=bytes(pkt.raw))
+                self.syss_glue.emitPacketFromNodeInterface(cmdargs[1], cmdargs[2], p)
+                count += 1
         plural = 's' if count > 1 else ''
         print ("Replayed {} packet.".format(count))
 
@@ -23,6 +23,13 @@ class MonitorManager(object):
     def add_monitor(monitor):
         MonitorManager._monitors.append(monitor)
 
+    @staticmethod
+    def stop_monitor(monitor):
+        # a monitor that's been stopped already (by a reset) is left alone
+        if monitor in MonitorManager._monitors:
+            MonitorManager._monitors.remove(monitor)
+            monitor.stop()
+
     @staticmethod
     def reset():
         for mon in MonitorManager._monitors:
@@ -77,6 +84,9 @@ class DebugInspector(LLNetBase):
         except queue.Empty:
             raise NoPackets()
 
+    def recv_packets(self, max_count=64, timeout=0.0, timestamp=False):
+        return [self.recv_packet(timeout, timestamp)]
+
     def send_packet(self, dev, packet):
         print ("Packets cannot be sent with a debug monitor")
 
@@ -116,7 +126,8 @@ class PcapMonitor(AbstractMonitor):
                 outfile = "{}_{}_{}.pcap".format(node,intf,outfile)
             else:
                 outfile = "{}_{}.pcap".format(node,intf)
-        self.dumper = pcapffi.PcapDumper(outfile)
+        # written by a background thread, off the node's receive path
+        self.dumper = pcapffi.PcapDumper(outfile, background=True, flush_interval=1.0)
 
     def __call__(self, devname, now, packet):
         self.dumper.write_packet(packet.to_bytes(), ts=now)
@@ -62,10 +62,13 @@ class NodeExecutor(LLNetBase):
         pass
 
     def attach_recv_monitor(self, interface, monitorobject):
+        oldmonitor = self.__recv_monitors.get(interface)
         self.__recv_monitors[interface] = monitorobject
+        if oldmonitor is not None:
+            MonitorManager.stop_monitor(oldmonitor)
 
     def remove_recv_monitor(self, interface):
-        self.__recv_monitors[interface] = NullMonitor()
+        self.attach_recv_monitor(interface, NullMonitor())
 
     def recv_packet(self, timeout=0.0, timestamp=False):
         #
@@ -90,12 +93,37 @@ class NodeExecutor(LLNetBase):
 
         raise NoPackets()
 
+    def recv_packets(self, max_count=64, timeout=0.0, timestamp=False):
+        rv = [self.recv_packet(timeout, timestamp)]
+        while len(rv) < max_count:
+            try:
+                devname,packet = self.__ingress_queue.get_nowait()
+            except Empty:
+                break
+            now = time.time()
+            self.__recv_monitors[devname](devname,now,packet)
+            rv.append((devname,now,packet) if timestamp else (devname,packet))
+        return rv
+
     def send_packet(self, dev, packet):
         egress_pipe = self.__egress_pipes[dev]
         now = time.time()
         delay = now + len(packet) / float(egress_pipe.capacity) + egress_pipe.delay
         self.__tolinkem.put( (delay, (egress_pipe.remote_devname, packet), egress_pipe.queue) )
 
+    def send_packets(self, packets):
+        now = time.time()
+        results = []
+        for dev,packet in packets:
+            egress_pipe = self.__egress_pipes.get(dev, None)
+            if egress_pipe is None:
+                results.append(KeyError("No device named {}".format(dev)))
+                continue
+            delay = now + len(packet) / float(egress_pipe.capacity) + egress_pipe.delay
+            self.__tolinkem.put( (delay, (egress_pipe.remote_devname, packet), egress_pipe.queue) )
+            results.append(None)
+        return results
+
     def shutdown(self):
         self.__linkem.shutdown()
         self.__done = True
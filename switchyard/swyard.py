@@ -64,6 +64,26 @@ def main():
         help="Don't trap exceptions.  Use of this option is helpful if you want"
              " to use Switchyard with a different symbolic debugger than pdb.", 
              dest="nohandle", action="store_true", default=False)
+    parser.add_argument("--engine", help="Specify how packets are received in"
+        " real mode: with a thread per interface (threads), or with a single"
+        " selector loop over all interfaces (selector).  Default: threads.",
+        dest="engine", choices=('threads', 'selector'), default='threads')
+    parser.add_argument("--backend", help="Specify how interfaces are accessed"
+        " in real mode: through libpcap (pcap), or through AF_PACKET sockets"
+        " with memory-mapped rings (afpacket; Linux only).  Default: pcap.",
+        dest="backend", choices=('pcap', 'afpacket'), default='pcap')
+    parser.add_argument("--queue-limit", help="Specify the maximum number of"
+        " received packets held for your code in real mode (default: 65536).",
+        dest="queue_limit", type=int, default=65536)
+    parser.add_argument("--queue-policy", help="Specify which packets are dropped"
+        " when the receive queue is full: arriving packets (tail), the oldest"
+        " queued packets (head), or packets from interfaces holding more than"
+        " their share of the queue (fair).  Default: tail.",
+        dest="queue_policy", choices=('tail', 'head', 'fair'), default='tail')
+    parser.add_argument("-w", "--workers", help="Run your code in real mode in the"
+        " given number of processes, each handling a share of the flows"
+        " (hashed on addresses, protocol and ports).  Default: 1.",
+        dest="workers", type=int, default=1, metavar="NUM_WORKERS")
     parser.add_argument("--cli", help="Enter switchyard simulation command-line (EXPERIMENTAL!)", 
         dest="cli", action="store_true", default=False)
     parser.add_argument("--topology", help="Specify topology to use for simulation"
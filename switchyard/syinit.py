@@ -7,6 +7,7 @@ from switchyard.textcolor import *
 from switchyard.hostfirewall import Firewall
 from switchyard.llnettest import main_test
 from switchyard.llnetreal import main_real, LLNetReal
+from switchyard.llnetshard import main_sharded
 from switchyard.importcode import import_or_die
 from switchyard.lib.socket.socketemu import ApplicationLayer
 from switchyard.lib.logging import *
@@ -129,10 +130,19 @@ def start_framework(args):
             barrier.wait()
             return
 
+        if args.workers > 1 and args.app:
+            log_failure("Socket applications can't be used with multiple worker processes")
+            barrier.wait()
+            return
+
         with Firewall(devlist, args.fwconfig):
             _setup_ok = True
             barrier.wait()
-            _netobj = LLNetReal(devlist)
+            if args.workers > 1:
+                main_sharded(args.usercode, devlist, args)
+                return
+            _netobj = LLNetReal(devlist, engine=args.engine, backend=args.backend,
+                queue_limit=args.queue_limit, queue_policy=args.queue_policy)
             main_real(args.usercode, _netobj, args)
 
 
@@ -1,6 +1,11 @@
 from switchyard.lib.packet import *
 from switchyard.lib.address import *
+from switchyard.lib.interface import Interface
 from ipaddress import AddressValueError
+import ipaddress
+import copy
+import gc
+import pickle
 import unittest 
 
 class AddressTests(unittest.TestCase):
@@ -63,6 +68,83 @@ class AddressTests(unittest.TestCase):
         self.assertEqual(infer_netmask(IPv4Address("242.0.0.0")), 32)
         self.assertEqual(infer_netmask(IPv4Address("224.0.0.0")), 32)
 
+    def testInterning(self):
+        e = EthAddr("11:22:33:44:55:66")
+        self.assertIs(EthAddr(e), e)
+        self.assertIs(EthAddr("11-22-33-44-55-66"), e)
+        self.assertIs(EthAddr(b'\x11\x22\x33\x44\x55\x66'), e)
+        self.assertIs(pickle.loads(pickle.dumps(e)), e)
+        self.assertIs(copy.deepcopy(e), e)
+        self.assertEqual(e, "11:22:33:44:55:66")
+        self.assertNotEqual(e, EthAddr())
+        with self.assertRaises(RuntimeError):
+            EthAddr(bytearray(6))
+
+        a = IPAddr("10.0.0.1")
+        self.assertIs(IPAddr(a), a)
+        self.assertIs(IPAddr(b'\x0a\x00\x00\x01'), a)
+        self.assertIs(IPAddr(0x0a000001), a)
+        self.assertIs(IPAddr(IPv4Address("10.0.0.1")), a)
+        self.assertIs(pickle.loads(pickle.dumps(a)), a)
+        self.assertIs(copy.deepcopy(a), a)
+        self.assertIsInstance(a, IPv4Address)
+        self.assertEqual(repr(a), "IPv4Address('10.0.0.1')")
+        self.assertTrue(a < IPAddr("10.0.0.2"))
+        self.assertTrue(a < IPv4Address("10.0.0.2"))
+        self.assertEqual(a + 1, IPAddr("10.0.0.2"))
+        self.assertIn(a, ipaddress.ip_network("10.0.0.0/8"))
+
+        a6 = IPv6Addr("fe80::1")
+        self.assertIs(IPv6Addr(IPv6Address("fe80::1")), a6)
+        self.assertIs(IPv6Addr(a6.packed), a6)
+        self.assertNotEqual(IPv6Addr("fe80::1%eth0"), a6)
+        self.assertEqual(IPv6Addr("fe80::1%eth0"), IPv6Address("fe80::1%eth0"))
+
+        # interned addresses hash and compare like the ipaddress types,
+        # so they can be mixed as dictionary keys
+        table = {IPv4Address("10.0.0.1"): 1, IPv6Address("fe80::1"): 2, e: 3}
+        self.assertEqual(table[a], 1)
+        self.assertEqual(table[a6], 2)
+        self.assertEqual(table[EthAddr(e.raw)], 3)
+
+        # entries go away with the addresses, and the tables are bounded
+        IPAddr("192.0.2.1")
+        gc.collect()
+        self.assertNotIn("192.0.2.1", IPAddr._interned)
+        maxsize = IPAddr._interned.maxsize
+        IPAddr._interned.maxsize = len(IPAddr._interned)
+        try:
+            b = IPAddr("192.0.2.2")
+            self.assertIsNot(IPAddr("192.0.2.2"), b)
+            self.assertEqual(IPAddr("192.0.2.2"), b)
+        finally:
+            IPAddr._interned.maxsize = maxsize
+
+    def testHeaderAddresses(self):
+        e = Ethernet(src="11:22:33:44:55:66", dst=EthAddr("66:55:44:33:22:11"))
+        ip = IPv4(src="10.0.0.1", dst=IPv4Address("10.0.0.2"))
+        ip6 = IPv6(src="fe80::1", dst=IPv6Address("fe80::2"))
+        self.assertIs(e.src, EthAddr("11:22:33:44:55:66"))
+        self.assertIs(ip.dst, IPAddr("10.0.0.2"))
+        self.assertIs(ip6.src, IPv6Addr("fe80::1"))
+        p = Packet(raw=(e + ip + UDP()).to_bytes())
+        self.assertIs(p[0].dst, e.dst)
+        self.assertIs(p[1].src, ip.src)
+        e.dst = e.src
+        self.assertIs(e.dst, e.src)
+
+    def testInterfaceAddresses(self):
+        # interned and plain ipaddress values are both accepted
+        intf = Interface('eth0', '11:22:33:44:55:66', IPv4Address('10.0.0.1'), IPAddr('255.255.255.0'))
+        self.assertEqual(intf.ipaddr, IPAddr('10.0.0.1'))
+        intf2 = Interface('eth1', '11:22:33:44:55:67')
+        intf2.ipaddr = intf.ipaddr
+        intf2.netmask = IPv4Address('255.255.0.0')
+        self.assertEqual(intf2.ipinterface, ipaddress.ip_interface('10.0.0.1/16'))
+        intf2.ipaddr = IPAddr('10.1.0.1')
+        intf2.netmask = intf.netmask
+        self.assertEqual(intf2.ipinterface, ipaddress.ip_interface('10.1.0.1/24'))
+
 
 if __name__ == '__main__':
     unittest.main()
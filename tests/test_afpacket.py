@@ -0,0 +1,110 @@
+import unittest
+import sys
+import time
+import socket
+import struct
+from unittest.mock import patch
+
+from switchyard.lib.packet import *
+from switchyard.pcapffi import PcapException, Dlt, bpf_compile
+from switchyard import afpacket
+from switchyard.afpacket import AfPacketDevice
+
+def _open(filterstr):
+    try:
+        return AfPacketDevice('lo', filterstr=filterstr, block_size=1<<16, block_nr=4)
+    except PcapException as e:
+        raise unittest.SkipTest("Can't open AF_PACKET device: {}".format(e))
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), "AF_PACKET is Linux-only")
+class AfPacketTests(unittest.TestCase):
+    def setUp(self):
+        self.dev = _open('udp port 9998')
+
+    def tearDown(self):
+        self.dev.close()
+
+    def _send(self, n):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for i in range(n):
+            s.sendto(bytes([i]) * 10, ('127.0.0.1', 9998))
+        s.close()
+
+    def _recv_all(self, dev):
+        pkts = []
+        while True:
+            batch = dev.recv_packets(timeout=0.1)
+            if not batch:
+                return pkts
+            pkts.extend(batch)
+
+    def testRecv(self):
+        self.assertEqual(self.dev.dlt, Dlt.DLT_EN10MB)
+        self.assertEqual(self.dev.recv_packets(timeout=0), [])
+        self._send(50)
+        pkts = self._recv_all(self.dev)
+        # loopback delivers each packet once on output and once on input
+        self.assertEqual(len(pkts), 100)
+        p = Packet(pkts[0].raw, first_header=Ethernet)
+        self.assertEqual(p[UDP].dst, 9998)
+        self.assertEqual(p[-1].to_bytes(), b'\x00' * 10)
+        self.assertEqual(pkts[0].capture_length, len(pkts[0].raw))
+        self.assertAlmostEqual(pkts[0].timestamp, time.time(), delta=5)
+        self.assertEqual(self.dev.stats().ps_recv, 100)
+
+    def testFrames(self):
+        self._send(3)
+        time.sleep(0.05)
+        raws = []
+        for pkt in self.dev.frames():
+            self.assertIsInstance(pkt.raw, memoryview)
+            raws.append(bytes(pkt.raw))
+        self.assertEqual(len(raws), 6)
+        self.assertEqual(list(self.dev.frames()), [])
+
+        # a partly consumed block is picked up where it left off
+        self._send(2)
+        time.sleep(0.05)
+        self.assertEqual(len(list(self.dev.frames(1))), 1)
+        self.assertEqual(len(self.dev.recv_packets(timeout=0)), 3)
+
+    def testSend(self):
+        e = Ethernet(src="00:00:00:00:00:00", dst="00:00:00:00:00:00") + \
+            IPv4(src="127.0.0.1", dst="127.0.0.1", protocol=IPProtocol.UDP, ttl=64) + \
+            UDP(src=1, dst=9998) + b'sent'
+        rdev = _open('udp port 9998')
+        try:
+            for i in range(3):
+                self.dev.queue_packet(e.to_bytes())
+            self.dev.flush()
+            self.dev.send_packet(e.to_bytes())
+            pkts = self._recv_all(rdev)
+            self.assertEqual(len(pkts), 8)
+            self.assertEqual(Packet(pkts[0].raw, first_header=Ethernet), e)
+        finally:
+            rdev.close()
+        with self.assertRaises(PcapException):
+            self.dev.send_packet(b'\x00' * 10000)
+
+    def testSendStuckFrame(self):
+        # a frame the kernel never gives back: queueing into it gives up
+        dev = self.dev
+        status = dev._tx_base + dev._tx_cur * dev._tx_frame_size + afpacket._tp_status_offset
+        struct.pack_into('=I', dev._ring, status, afpacket.TP_STATUS_SENDING)
+        with patch('switchyard.afpacket._tx_wait_timeout', 0.2):
+            start = time.time()
+            with self.assertRaises(PcapException):
+                dev.queue_packet(b'\x00' * 60)
+            self.assertLess(time.time() - start, 2)
+        struct.pack_into('=I', dev._ring, status, afpacket.TP_STATUS_AVAILABLE)
+        dev.queue_packet(b'\x00' * 60)
+
+    def testFilter(self):
+        with self.assertRaises(PcapException):
+            bpf_compile("not a filter")
+        self.assertEqual(len(bpf_compile("udp")) % 8, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
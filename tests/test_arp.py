@@ -27,11 +27,16 @@ class ArpTests(unittest.TestCase):
         with self.assertRaises(Exception):
             other.from_bytes(serialized[:-3])
         xbytes = arp.to_bytes()
-        # inject an invalid arp operation
+        # inject an unknown arp operation: it's decoded to a stand-in
+        # value rather than raising an exception
         xbytes = xbytes[:6] + b'\xff\xff' + xbytes[8:]
         a = Arp()
-        with self.assertRaises(Exception):
-            a.from_bytes(xbytes)
+        a.from_bytes(xbytes)
+        self.assertEqual(a.operation, 0xffff)
+        self.assertEqual(a.operation.name, "Unknown65535")
+        self.assertEqual(a.to_bytes(), xbytes)
+        with self.assertRaises(ValueError):
+            a.operation = 0xffff
 
     def testArpReply(self):
         p = create_ip_arp_reply("aa:bb:cc:dd:ee:ff", "00:00:00:11:22:33", "10.11.12.13", "1.2.3.4")
@@ -0,0 +1,72 @@
+import array
+import os
+import struct
+import unittest
+from socket import ntohs
+
+import switchyard.lib.packet.common as common
+from switchyard.lib.packet.common import checksum, checksum_many
+
+def reference_checksum(data, start=0, skip_word=None):
+    # the original (array-based) implementation
+    if len(data) % 2 != 0:
+        arr = array.array('H', data[:-1])
+    else:
+        arr = array.array('H', data)
+    for i in range(0, len(arr)):
+        if i == skip_word:
+            continue
+        start += arr[i]
+    if len(data) % 2 != 0:
+        start += struct.unpack('H', data[-1:]+b'\x00')[0]
+    start = (start >> 16) + (start & 0xffff)
+    start += (start >> 16)
+    return ntohs(~start & 0xffff)
+
+
+class ChecksumTests(unittest.TestCase):
+    def setUp(self):
+        self.numpy = common._numpy
+
+    def tearDown(self):
+        common._numpy = self.numpy
+
+    def _buffers(self):
+        bufs = [b'', b'\x00', b'\xff', b'\x00\x00', b'\xff\xff',
+                b'\xff' * 1501, b'\x00' * 64, b'\x01\x00', b'\x00\x01']
+        for xlen in (1, 2, 3, 20, 63, 64, 576, 1023, 1024, 1500, 9001):
+            bufs.append(os.urandom(xlen))
+        return bufs
+
+    def _check_all(self):
+        for buf in self._buffers():
+            self.assertEqual(checksum(buf), reference_checksum(buf))
+            self.assertEqual(checksum(memoryview(buf)), reference_checksum(buf))
+            self.assertEqual(checksum(bytearray(buf)), reference_checksum(buf))
+            for start in (1, 0xffff, 0x10000, 2**20):
+                self.assertEqual(checksum(buf, start), reference_checksum(buf, start))
+            for skip in (-1, 0, 5, len(buf)//2 - 1, len(buf)//2):
+                self.assertEqual(checksum(buf, 0, skip), reference_checksum(buf, 0, skip))
+        bufs = self._buffers()
+        self.assertEqual(checksum_many(bufs), [reference_checksum(b) for b in bufs])
+        self.assertEqual(checksum_many(bufs, 7), [reference_checksum(b, 7) for b in bufs])
+        self.assertEqual(checksum_many([]), [])
+
+    def testChecksum(self):
+        self._check_all()
+
+    def testChecksumNoNumpy(self):
+        common._numpy = None
+        self._check_all()
+
+    def testVerify(self):
+        data = bytearray(os.urandom(40))
+        data[10:12] = b'\x00\x00'
+        csum = checksum(data)
+        struct.pack_into('!H', data, 10, csum)
+        self.assertEqual(checksum(data, 0, 5), csum)
+        self.assertEqual(checksum(data), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
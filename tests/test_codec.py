@@ -0,0 +1,98 @@
+import unittest
+
+from switchyard.lib.packet import *
+from switchyard.lib.packet.codec import HeaderCodec, Field, BitFields
+from switchyard.lib.address import EthAddr, IPAddr
+from switchyard.lib.exceptions import NotEnoughDataError
+
+class Hdr(object):
+    __slots__ = ['_a', '_b', '_c', '_d', '_addr', '_proto']
+
+    @property
+    def hl(self):
+        return 5
+
+
+class CodecTests(unittest.TestCase):
+    def setUp(self):
+        self.codec = HeaderCodec(
+            BitFields('B', Field('hl', 4, readonly=True), Field('_a', 4)),
+            BitFields('H', Field('_b', 3), Field(None, 1), Field('_c', 12)),
+            Field(None, 'B'),
+            Field('_d', 'I'),
+            Field('_addr', '4s', IPAddr),
+            Field('_proto', 'B', IPProtocol))
+
+    def testDecodeEncode(self):
+        raw = b'\x53\xff\xff\xaa\x00\x00\x00\x01\x0a\x00\x00\x01\x06extra'
+        h = Hdr()
+        fields = self.codec.decode(h, raw)
+        self.assertEqual(self.codec.size, 13)
+        self.assertEqual(fields[0], 0x53)
+        self.assertEqual(h._a, 3)
+        self.assertEqual(h._b, 7)
+        self.assertEqual(h._c, 0xfff)
+        self.assertEqual(h._d, 1)
+        self.assertEqual(h._addr, IPAddr("10.0.0.1"))
+        self.assertIs(h._proto, IPProtocol.TCP)
+
+        # readonly fields come from the attribute, padding is zero
+        self.assertEqual(self.codec.encode(h),
+            b'\x53\xef\xff\x00\x00\x00\x00\x01\x0a\x00\x00\x01\x06')
+        buf = bytearray(15)
+        self.assertEqual(self.codec.encode_into(h, buf, 2), 13)
+        self.assertEqual(bytes(buf[2:]), self.codec.encode(h))
+
+        # bit field values are masked to their width
+        h._a = 0x13
+        self.assertEqual(self.codec.encode(h)[0], 0x53)
+
+        with self.assertRaises(NotEnoughDataError):
+            self.codec.decode(Hdr(), raw[:12])
+
+        # enum fields decode through a table, and unknown values don't raise
+        h = Hdr()
+        self.codec.decode(h, raw[:12] + b"\xfe")
+        self.assertIsInstance(h._proto, IPProtocol)
+        self.assertEqual(h._proto, 0xfe)
+        self.assertEqual(h._proto.name, "Unknown254")
+        self.assertEqual(self.codec.encode(h)[-1], 0xfe)
+
+    def testByteOrder(self):
+        codec = HeaderCodec(Field('_d', 'I'), byteorder='<')
+        h = Hdr()
+        codec.decode(h, b'\x01\x00\x00\x00')
+        self.assertEqual(h._d, 1)
+        self.assertEqual(codec.encode(h), b'\x01\x00\x00\x00')
+
+    def testBadBitFields(self):
+        with self.assertRaises(ValueError):
+            BitFields('H', Field('_a', 4), Field('_b', 4))
+
+    def testHeaders(self):
+        # headers built on the codec round-trip as before
+        e = Ethernet(src="11:22:33:44:55:66", dst="66:55:44:33:22:11",
+                     ethertype=EtherType.x8021Q)
+        v = Vlan(vlanid=4000, pcp=2, ethertype=EtherType.IPv4)
+        ip = IPv4(src="1.2.3.4", dst="5.6.7.8", protocol=IPProtocol.TCP,
+                  ttl=32, tos=0x21, ipid=9, flags=IPFragmentFlag.DontFragment,
+                  fragment_offset=77)
+        t = TCP(src=1, dst=2, seq=2**32-1, ack=5, window=9, SYN=1, NS=1)
+        p = Packet(raw=(e + v + ip + t).to_bytes())
+        self.assertEqual(p[0], e)
+        self.assertEqual(p[1], v)
+        self.assertEqual(p[1].pcp, 2)
+        self.assertEqual(p[2], ip)
+        self.assertEqual(p[2].version, 4)
+        self.assertEqual(p[3], t)
+        self.assertEqual(p[3].flagstr, "SN")
+
+        raw = b'\xff\xff' + (b'\x00' * 12) + b'\x00\x40'
+        e = Ethernet()
+        e.from_bytes(raw)
+        self.assertEqual(e.ethertype, EtherType.NoType)
+        self.assertEqual(e.dst, EthAddr("ff:ff:00:00:00:00"))
+
+
+if __name__ == '__main__':
+    unittest.main()
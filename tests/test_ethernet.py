@@ -1,5 +1,6 @@
 from switchyard.lib.packet import *
 from switchyard.lib.address import EthAddr, IPAddr
+import pickle
 import unittest 
 
 class EthernetPacketTests(unittest.TestCase):
@@ -42,6 +43,18 @@ class EthernetPacketTests(unittest.TestCase):
         self.assertEqual(e.src, EthAddr(':'.join(astr.split(':')[::-1])))
         self.assertEqual(e.ethertype, EtherType.IP)
 
+    def testUnknownEType(self):
+        raw = b'\x01\x02\x03\x04\x05\x06\x06\x05\x04\x03\x02\x01\x12\x34data'
+        p = Packet(raw=raw)
+        self.assertIs(p[0].ethertype, Packet(raw=raw)[0].ethertype)
+        self.assertEqual(p[0].ethertype, 0x1234)
+        self.assertEqual(p[0].ethertype.name, "Unknown4660")
+        self.assertIsInstance(p[1], RawPacketContents)
+        self.assertEqual(p.to_bytes(), raw)
+        p2 = pickle.loads(pickle.dumps(p))
+        self.assertIs(p2[0].ethertype, p[0].ethertype)
+        self.assertEqual(p2.to_bytes(), raw)
+
     def testBadParse(self):
         raw = b'x\01'
         e = Ethernet()
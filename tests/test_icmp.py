@@ -188,6 +188,19 @@ class ICMPPacketTests(unittest.TestCase):
         with self.assertRaises(Exception):
             i.from_bytes(b'\x04\x00\xfb\xff\x00\x00\x00')
 
+    def testDeserializeUnknown(self):
+        # unknown types and codes don't raise; the data is kept as is
+        i = ICMP()
+        i.from_bytes(b'\x63\x07\x00\x00\x01\x02')
+        self.assertEqual(i.icmptype, 99)
+        self.assertEqual(i.icmpcode, 7)
+        self.assertEqual(str(i), "ICMP Unknown99:Unknown7 2 bytes of raw payload (b'\\x01\\x02')")
+        self.assertEqual(i.icmpdata.data, b'\x01\x02')
+        self.assertEqual(i.to_bytes()[:2], b'\x63\x07')
+        i.from_bytes(b'\x08\x07\x00\x00\x00\x00\x00\x00')
+        self.assertEqual(i.icmptype, ICMPType.EchoRequest)
+        self.assertEqual(i.icmpcode.name, "Unknown7")
+
     def testUnreachableMtu(self):
         i = ICMP()
         i.icmptype = ICMPType.DestinationUnreachable
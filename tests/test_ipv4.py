@@ -142,6 +142,25 @@ class IPv4PacketTests(unittest.TestCase):
         optlist2 = IPOptionList.from_bytes(raw)
         self.assertEqual(optlist[0], optlist2[0])
 
+    def testUnknownOption(self):
+        # option 25 with the copy flag set, then a NOP
+        raw = b'\x99\x04\xab\xcd\x01'
+        optlist = IPOptionList.from_bytes(raw)
+        self.assertEqual(len(optlist), 2)
+        self.assertIsInstance(optlist[0], IPOptionUnknown)
+        self.assertEqual(optlist[0].optnum, 25)
+        self.assertEqual(optlist[0].optnum.name, "Unknown25")
+        self.assertEqual(optlist[0].data, b'\xab\xcd')
+        self.assertEqual(optlist.to_bytes(), raw + b'\x00' * 3)
+
+        iphdr = IPv4(src="1.2.3.4", dst="4.5.6.7", protocol=IPProtocol.UDP, ttl=8)
+        iphdr.options.append(IPOptionUnknown(0x99, b'\xab\xcd'))
+        p = Packet(raw=(iphdr + UDP()).to_bytes(), first_header=IPv4)
+        self.assertEqual(p[0].options[0], iphdr.options[0])
+
+        with self.assertRaises(ValueError):
+            IPOptionList.from_bytes(b'\x99\x01')
+
     def routeOptTestHelper(self, ropt):
         ropt = IPOptionRecordRoute()
         self.pkt[1] = IPv4()
@@ -246,6 +265,35 @@ class IPv4PacketTests(unittest.TestCase):
         xtopt.from_bytes(raw) 
         self.assertIn("TimestampEntry(ipv4addr=IPv4Address('127.0.0.1'), timestamp=0)", str(xtopt))
 
+    def testIncrementalChecksum(self):
+        ip = IPv4(src="10.0.0.1", dst="10.0.0.2", ttl=64,
+                  protocol=IPProtocol.UDP, ipid=42)
+        p = Packet(raw=(Ethernet() + ip + UDP() + b'x' * 100).to_bytes())
+        ip = p[IPv4]
+        ip.ttl -= 1
+        ip.tos = 0x10
+        ip.ipid = 0xffff
+        ip.flags = IPFragmentFlag.MoreFragments
+        ip.fragment_offset = 100
+        ip.src = "192.168.100.1"
+        ip.dst = "172.16.0.2"
+        ip.protocol = IPProtocol.TCP
+        ip.dscp = 3
+        b = ip.to_bytes()
+        self.assertEqual(checksum(b), 0)
+        fresh = IPv4(src=ip.src, dst=ip.dst, ttl=ip.ttl, tos=ip.tos,
+                  protocol=ip.protocol, ipid=ip.ipid, flags=ip.flags,
+                  fragment_offset=ip.fragment_offset)
+        fresh._totallen = ip.total_length
+        self.assertEqual(fresh.to_bytes(), b)
+
+        # options aren't tracked; the checksum is recomputed
+        ip.options.append(IPOptionNoOperation())
+        self.assertEqual(checksum(ip.to_bytes()), 0)
+        del ip.options[0]
+        ip.ttl = 1
+        self.assertEqual(checksum(ip.to_bytes()), 0)
+
 
 if __name__ == '__main__':
     unittest.main()
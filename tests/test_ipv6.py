@@ -210,5 +210,20 @@ class IPv6PacketTests(unittest.TestCase):
         # yes: there are currently bugs in IPv6 mobility header handling
         
 
+    def testUnknownICMPv6Option(self):
+        # option 34 (8 bytes), then a source link-layer address
+        raw = b'\x22\x01\x01\x02\x03\x04\x05\x06' + \
+              b'\x01\x01\x11\x22\x33\x44\x55\x66'
+        optlist = ICMPv6OptionList.from_bytes(raw)
+        self.assertEqual(len(optlist), 2)
+        self.assertIsInstance(optlist[0], ICMPv6OptionUnknown)
+        self.assertEqual(optlist[0].optnum.name, "Unknown34")
+        self.assertEqual(optlist[0].data, b'\x01\x02\x03\x04\x05\x06')
+        self.assertEqual(optlist[0].to_bytes(), raw[:8])
+        self.assertIsInstance(optlist[1], ICMPv6OptionSourceLinkLayerAddress)
+        with self.assertRaises(ValueError):
+            ICMPv6OptionList.from_bytes(b'\x22\x00')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,17 +1,20 @@
 import sys
+import struct
 import unittest
 from unittest.mock import Mock, MagicMock
 
 from switchyard.lib.address import *
 from switchyard.lib.packet import *
 from switchyard.lib.interface import Interface, make_device_list, InterfaceType
-from switchyard.lib.testing import TestScenario, SwitchyardTestEvent
+from switchyard.lib.testing import TestScenario, SwitchyardTestEvent, PacketInputEvent, PacketOutputEvent, TestScenarioFailure
 from switchyard.lib.exceptions import *
 from switchyard.llnettest import LLNetTest, _prepare_debugger
-from switchyard.llnetreal import LLNetReal, _RawSocket
+from switchyard.llnetreal import LLNetReal, _RawSocket, _DeviceCounters, _TailDropQueue, _HeadDropQueue, _FairShareQueue
 from switchyard.llnetbase import LLNetBase
 import switchyard.llnetreal as llreal
-from switchyard.pcapffi import Dlt, PcapStats, PcapException
+from switchyard.pcapffi import Dlt, PcapStats, PcapException, PcapPacket
+from queue import Empty
+from collections import deque
 from socket import error as sockerr
 
 class WrapLLNet(LLNetReal):
@@ -193,6 +196,264 @@ class LLNetDevTests(unittest.TestCase):
         lr.shutdown()
         self.assertFalse(LLNetReal.running)
 
+    def testRealRecvBatches(self):
+        pkts = [create_ip_arp_request("30:00:00:00:00:0{}".format(i), "10.0.0.{}".format(i), "10.0.0.9") for i in range(5)]
+        raws = [PcapPacket(i * 1000000000, len(p), len(p), p.to_bytes()) for i,p in enumerate(pkts)]
+        self.real._counters = {'eth0': _DeviceCounters(), 'eth1': _DeviceCounters()}
+        self.real._pktqueue = _TailDropQueue(100, self.real._counters)
+        self.real._pending = deque()
+        self.real._burst = 2
+        self.real._selector = None
+        self.real._pktqueue.put('eth0', Dlt.DLT_EN10MB, raws[:3])
+        self.real._pktqueue.put('eth1', Dlt.DLT_EN10MB, raws[3:])
+        LLNetReal.running = True
+        try:
+            rv = self.real.recv_packets(2, timeout=0)
+            self.assertEqual([r.packet for r in rv], pkts[:2])
+            self.assertEqual([r.input_port for r in rv], ['eth0', 'eth0'])
+            rv = self.real.recv_packets(10, timeout=0)
+            self.assertEqual([r.packet for r in rv], pkts[2:])
+            self.assertEqual([r.input_port for r in rv], ['eth0', 'eth1', 'eth1'])
+            self.assertEqual(rv[-1].timestamp, 4.0)
+            self.assertEqual(rv[-1].timestamp_ns, 4000000000)
+            with self.assertRaises(NoPackets):
+                self.real.recv_packets(10, timeout=0)
+        finally:
+            LLNetReal.running = False
+
+    def testIngressQueues(self):
+        def fill(qclass, limit, batches):
+            counters = {'eth0': _DeviceCounters(), 'eth1': _DeviceCounters()}
+            q = qclass(limit, counters)
+            for dev,pkts in batches:
+                q.put(dev, Dlt.DLT_EN10MB, pkts)
+            self.assertLessEqual(q.qsize(), limit)
+            rv = [(dev,pkt) for dev,dlt,pkt in q.get_all(0)]
+            self.assertTrue(q.empty())
+            return rv, {dev:c.snapshot() for dev,c in counters.items()}
+
+        batches = [('eth0', list(range(6))), ('eth1', [10, 11]), ('eth0', [6, 7])]
+        rv, stats = fill(_TailDropQueue, 5, batches)
+        self.assertEqual(rv, [('eth0', i) for i in range(5)])
+        self.assertEqual(stats['eth0'].received, 8)
+        self.assertEqual(stats['eth0'].enqueued, 5)
+        self.assertEqual(stats['eth0'].queue_drops, 3)
+        self.assertEqual(stats['eth1'].queue_drops, 2)
+
+        rv, stats = fill(_HeadDropQueue, 5, batches)
+        self.assertEqual(rv, [('eth0', 5), ('eth1', 10), ('eth1', 11), ('eth0', 6), ('eth0', 7)])
+        self.assertEqual(stats['eth0'].enqueued, 8)
+        self.assertEqual(stats['eth0'].queue_drops, 5)
+        self.assertEqual(stats['eth1'].queue_drops, 0)
+
+        # eth1 gets its share of the queue by pushing out eth0's oldest
+        rv, stats = fill(_FairShareQueue, 6, batches + [('eth1', [12, 13, 14])])
+        self.assertEqual(rv, [('eth0', 3), ('eth1', 10), ('eth0', 4), ('eth1', 11), ('eth0', 5), ('eth1', 12)])
+        self.assertEqual(stats['eth0'].enqueued, 6)
+        self.assertEqual(stats['eth0'].queue_drops, 5)
+        self.assertEqual(stats['eth1'].enqueued, 3)
+        self.assertEqual(stats['eth1'].queue_drops, 2)
+
+        # takes of at most limit packets
+        for qclass in (_TailDropQueue, _HeadDropQueue, _FairShareQueue):
+            counters = {'eth0': _DeviceCounters(), 'eth1': _DeviceCounters()}
+            q = qclass(10, counters)
+            q.put('eth0', Dlt.DLT_EN10MB, [0, 1, 2])
+            q.put('eth1', Dlt.DLT_EN10MB, [10, 11])
+            got = [pkt for dev,dlt,pkt in q.get_all(0, 2)]
+            self.assertEqual(q.qsize(), 3)
+            got += [pkt for dev,dlt,pkt in q.get_all(0, 2)]
+            got += [pkt for dev,dlt,pkt in q.get_all(0, 2)]
+            self.assertTrue(q.empty())
+            if qclass is _FairShareQueue:
+                self.assertEqual(got, [0, 10, 1, 11, 2])
+            else:
+                self.assertEqual(got, [0, 1, 2, 10, 11])
+
+        q = _TailDropQueue(5, {'eth0': _DeviceCounters()})
+        with self.assertRaises(Empty):
+            q.get_all(0)
+        q.put_marker()
+        self.assertFalse(q.empty())
+        self.assertEqual(list(q.get_all()), [])
+        with self.assertRaises(ValueError):
+            _TailDropQueue(0, {})
+
+    def testRealSelector(self):
+        import os
+        import signal
+
+        class FakePcap(object):
+            # a device whose fd is readable while it has packets queued
+            def __init__(self, name):
+                self.rfd, self.wfd = os.pipe()
+                self.fd = self.rfd
+                self.dlt = Dlt.DLT_EN10MB
+                self.pkts = deque()
+            def inject(self, pkt):
+                self.pkts.append(PcapPacket(0, pkt.size(), pkt.size(), pkt.to_bytes()))
+                os.write(self.wfd, b'x')
+            def dispatch(self, callback, count=-1):
+                n = len(os.read(self.rfd, count))
+                for i in range(n):
+                    callback(self.pkts.popleft())
+                return n
+            def stats(self):
+                return PcapStats(0, 0, 0)
+            def close(self):
+                os.close(self.rfd)
+                os.close(self.wfd)
+
+        devdict = {d: Interface(d, "0:0:0:0:0:0", "1.2.3.4", "255.255.255.255", i, InterfaceType.Wired) for i,d in enumerate(['en0','en1'])}
+        saved = (signal.signal, LLNetReal.__dict__['_assemble_devinfo'], llreal.PcapLiveDevice)
+        setattr(signal, "signal", Mock())
+        setattr(LLNetReal, "_assemble_devinfo", Mock(return_value=devdict))
+        setattr(llreal, "PcapLiveDevice", FakePcap)
+        try:
+            with self.assertRaises(ValueError):
+                LLNetReal(['en0','en1'], engine='nosuch')
+            with self.assertRaises(ValueError):
+                LLNetReal(['en0','en1'], queue_policy='nosuch')
+            lr = LLNetReal(['en0','en1'], engine='selector', burst=2)
+            self.assertEqual(lr._threads, [])
+            with self.assertRaises(NoPackets):
+                lr.recv_packet(timeout=0)
+
+            pkts = [create_ip_arp_request("30:00:00:00:00:0{}".format(i), "10.0.0.{}".format(i), "10.0.0.9") for i in range(6)]
+            for p in pkts[:4]:
+                lr._pcaps['en0'].inject(p)
+            for p in pkts[4:]:
+                lr._pcaps['en1'].inject(p)
+            # each ready device gets a burst of (at most) 2 per wakeup
+            rv = lr.recv_packets(4, timeout=0)
+            self.assertEqual(sorted(r.input_port for r in rv), ['en0', 'en0', 'en1', 'en1'])
+            rv = lr.recv_packets(10, timeout=0)
+            self.assertEqual([r.packet for r in rv], pkts[2:4])
+            stats = lr.stats()
+            self.assertEqual(stats['en0'].received, 4)
+            self.assertEqual(stats['en1'].enqueued, 2)
+            self.assertEqual(stats['en1'].queue_drops, 0)
+            with self.assertRaises(NoPackets):
+                lr.recv_packet(timeout=0.01)
+
+            # a signal wakes up a blocked receiver
+            lr._sig_handler(signal.SIGINT, None)
+            with self.assertRaises(Shutdown):
+                lr.recv_packet()
+            LLNetReal.running = True
+            lr.shutdown()
+            self.assertFalse(LLNetReal.running)
+        finally:
+            signal.signal, LLNetReal._assemble_devinfo, llreal.PcapLiveDevice = saved
+
+    def testRealSendPackets(self):
+        class FakeDev(object):
+            def __init__(self):
+                self.sent = []
+            def send_packet(self, raw):
+                if len(raw) > 100:
+                    raise PcapException("too big")
+                self.sent.append(raw)
+
+        class FakeRingDev(FakeDev):
+            def __init__(self):
+                super().__init__()
+                self.queued = []
+                self.flushes = 0
+            def queue_packet(self, raw):
+                self.queued.append(raw)
+            def flush(self):
+                self.sent.extend(self.queued)
+                self.queued = []
+                self.flushes += 1
+
+        self.real._devinfo = {
+            'eth0': Interface('eth0', '00:00:00:00:00:01', '10.0.0.1', '255.0.0.0', 1, InterfaceType.Wired),
+            'eth1': Interface('eth1', '00:00:00:00:00:02', '10.0.0.2', '255.0.0.0', 2, InterfaceType.Wired),
+        }
+        self.real._pcaps = {'eth0': FakeDev(), 'eth1': FakeRingDev()}
+        p = create_ip_arp_request("30:00:00:00:00:01", "10.0.0.1", "10.0.0.9")
+        big = p + b'x' * 100
+        bad = Ethernet() + IPv4(protocol=IPProtocol.UDP) + UDP(src=70000)
+        results = self.real.send_packets([
+            ('eth0', p), (self.real._devinfo['eth1'], p), (2, p),
+            ('baddev', p), ('eth0', None), ('eth0', big), (99, p),
+            ('eth0', bad), ('eth1', bad)])
+        self.assertEqual(results[:3], [None, None, None])
+        self.assertIsInstance(results[3], ValueError)
+        self.assertIsInstance(results[4], ValueError)
+        self.assertIsInstance(results[5], PcapException)
+        self.assertIsInstance(results[6], KeyError)
+        # a packet that can't be serialized fails on its own
+        self.assertIsInstance(results[7], struct.error)
+        self.assertIs(results[8], results[7])
+        eth0 = self.real._pcaps['eth0']
+        eth1 = self.real._pcaps['eth1']
+        self.assertEqual(eth0.sent, [p.to_bytes()])
+        self.assertEqual(eth1.sent, [p.to_bytes()] * 2)
+        self.assertEqual(eth1.flushes, 1)
+        # serialized once for all three
+        self.assertIs(eth0.sent[0], eth1.sent[0])
+        self.assertIs(eth1.sent[0], eth1.sent[1])
+
+    def testFakeSendPackets(self):
+        p = Packet()
+        self.ev.match = Mock(return_value=SwitchyardTestEvent.MATCH_PARTIAL)
+        self.assertEqual(self.fake.send_packets([("eth1", p), (2, p)]), [None, None])
+        self.ev.match.assert_called_with(SwitchyardTestEvent.EVENT_OUTPUT, device='eth2', packet=p)
+        self.assertEqual(self.ev.match.call_count, 2)
+        # test failures aren't swallowed as failed sends
+        self.ev.match = Mock(return_value=SwitchyardTestEvent.MATCH_FAIL)
+        with self.assertRaises(TestScenarioFailure):
+            self.fake.send_packets([("eth1", p)])
+
+    def testFakeRecvPackets(self):
+        s = TestScenario('burst')
+        s.add_interface('eth0', '11:11:11:11:11:11')
+        pkts = [create_ip_arp_request("30:00:00:00:00:0{}".format(i), "10.0.0.{}".format(i), "10.0.0.9") for i in range(3)]
+        for p in pkts:
+            s.expect(PacketInputEvent('eth0', p), "input")
+        s.expect(PacketOutputEvent('eth0', pkts[0]), "output")
+        net = LLNetTest(s)
+        try:
+            rv = net.recv_packets(2)
+            self.assertEqual([r.packet for r in rv], pkts[:2])
+            # stops at the first event that isn't an input
+            rv = net.recv_packets(10)
+            self.assertEqual([r.packet for r in rv], pkts[2:])
+            self.assertIsInstance(s.next(), PacketOutputEvent)
+        finally:
+            s.cancel_timer()
+
+    def testSysfsDevinfo(self):
+        import os
+        import tempfile
+        import shutil
+        sysfs = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, sysfs)
+        devs = { 'eth0': ('1', '2', '02:00:00:00:00:01', None),
+                 'wlan0': ('1', '3', '02:00:00:00:00:02', 'wireless'),
+                 'lo': ('772', '1', '00:00:00:00:00:00', None),
+                 'tun0': ('65534', '4', '', None) }
+        for devname,(arptype,ifindex,address,subdir) in devs.items():
+            os.mkdir(os.path.join(sysfs, devname))
+            for attr,value in (('type', arptype), ('ifindex', ifindex), ('address', address)):
+                with open(os.path.join(sysfs, devname, attr), 'w') as f:
+                    f.write(value + '\n')
+            if subdir:
+                os.mkdir(os.path.join(sysfs, devname, subdir))
+
+        saved = llreal._sysfs_net
+        llreal._sysfs_net = sysfs
+        try:
+            self.assertEqual(llreal._sysfs_devinfo('eth0'), (InterfaceType.Wired, EthAddr('02:00:00:00:00:01'), 2))
+            self.assertEqual(llreal._sysfs_devinfo('wlan0'), (InterfaceType.Wireless, EthAddr('02:00:00:00:00:02'), 3))
+            self.assertEqual(llreal._sysfs_devinfo('lo'), (InterfaceType.Loopback, EthAddr('00:00:00:00:00:00'), 1))
+            self.assertEqual(llreal._sysfs_devinfo('tun0'), (InterfaceType.Wired, None, 4))
+            self.assertIsNone(llreal._sysfs_devinfo('eth1'))
+        finally:
+            llreal._sysfs_net = saved
+
     def testRawSock(self):
         with self.assertRaises(socket.error):
             r = _RawSocket('loop')
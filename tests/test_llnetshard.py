@@ -0,0 +1,149 @@
+import unittest
+
+from switchyard.lib.packet import *
+from switchyard.lib.address import *
+from switchyard.lib.interface import Interface, InterfaceType
+from switchyard.lib.exceptions import *
+from switchyard.pcapffi import Dlt
+from switchyard.llnetshard import flow_hash, _ShmRing, LLNetShard, _send_from_ring
+
+def _udp(src, dst, sport, dport, ipcls=IPv4):
+    return Ethernet(src="11:11:11:11:11:11", dst="22:22:22:22:22:22",
+                    ethertype=EtherType.IPv4 if ipcls is IPv4 else EtherType.IPv6) + \
+        (IPv4(src=src, dst=dst, protocol=IPProtocol.UDP, ttl=64) if ipcls is IPv4 else
+         IPv6(src=src, dst=dst, nextheader=IPProtocol.UDP, ttl=64)) + \
+        UDP(src=sport, dst=dport) + b'hello'
+
+
+class FlowHashTests(unittest.TestCase):
+    def testSymmetric(self):
+        fwd = _udp("10.0.0.1", "192.168.1.1", 1234, 53)
+        rev = _udp("192.168.1.1", "10.0.0.1", 53, 1234)
+        self.assertEqual(flow_hash(fwd.to_bytes()), flow_hash(rev.to_bytes()))
+        other = _udp("10.0.0.1", "192.168.1.1", 1235, 53)
+        self.assertNotEqual(flow_hash(fwd.to_bytes()), flow_hash(other.to_bytes()))
+
+        fwd = _udp("fe80::1", "fe80::2", 1234, 53, IPv6)
+        rev = _udp("fe80::2", "fe80::1", 53, 1234, IPv6)
+        self.assertEqual(flow_hash(fwd.to_bytes()), flow_hash(rev.to_bytes()))
+
+        fwd = create_ip_arp_reply("11:11:11:11:11:11", "22:22:22:22:22:22", "10.0.0.1", "10.0.0.2")
+        rev = create_ip_arp_reply("22:22:22:22:22:22", "11:11:11:11:11:11", "10.0.0.2", "10.0.0.1")
+        self.assertEqual(flow_hash(fwd.to_bytes()), flow_hash(rev.to_bytes()))
+        self.assertIsInstance(flow_hash(b'\x00' * 10), int)
+
+    def testVlanAndFragments(self):
+        p = _udp("10.0.0.1", "192.168.1.1", 1234, 53)
+        raw = p.to_bytes()
+        tagged = raw[:12] + b'\x81\x00\x00\x05' + raw[12:]
+        self.assertEqual(flow_hash(raw), flow_hash(tagged))
+
+        # a later fragment (no ports) goes with the first one
+        first = bytearray(_udp("10.0.0.1", "192.168.1.1", 1234, 53).to_bytes())
+        first[20] |= 0x20   # more fragments
+        later = Ethernet() + IPv4(src="10.0.0.1", dst="192.168.1.1", protocol=IPProtocol.UDP, ttl=64, fragment_offset=100) + b'x' * 8
+        self.assertEqual(flow_hash(bytes(first)), flow_hash(later.to_bytes()))
+
+
+class ShmRingTests(unittest.TestCase):
+    def testPutGet(self):
+        ring = _ShmRing(256)
+        self.assertEqual(ring.get_all(0), [])
+        frames = [(i, 1, i * 1000000001, bytes([i]) * (10 + i)) for i in range(4)]
+        ring.put(frames)
+        self.assertEqual(ring.get_all(0), frames)
+
+        # records wrap around the end of the ring
+        for i in range(20):
+            ring.put(frames[:2])
+            self.assertEqual(ring.get_all(0), frames[:2])
+        self.assertEqual(ring.drops, 0)
+
+        # and don't fit once it's full
+        ring.put(frames * 5)
+        got = ring.get_all(0)
+        self.assertLess(len(got), 20)
+        self.assertEqual(len(got) + ring.drops, 20)
+        self.assertEqual(got, (frames * 5)[:len(got)])
+
+        ring.put(frames[:1])
+        ring.close()
+        self.assertTrue(ring.closed)
+        self.assertEqual(ring.get_all(0), frames[:1])
+        with self.assertRaises(Shutdown):
+            ring.get_all(0)
+
+
+class LLNetShardTests(unittest.TestCase):
+    def setUp(self):
+        self.devinfo = {
+            'eth0': Interface('eth0', '00:00:00:00:00:01', '10.0.0.1', '255.0.0.0', 1, InterfaceType.Wired),
+            'eth1': Interface('eth1', '00:00:00:00:00:02', '10.0.0.2', '255.0.0.0', 2, InterfaceType.Wired),
+        }
+        self.rx = _ShmRing()
+        self.tx = _ShmRing()
+        self.net = LLNetShard('node', self.devinfo, self.rx, self.tx, 1, 4)
+
+    def testRecvSend(self):
+        self.assertEqual(self.net.worker, (1, 4))
+        self.assertEqual(self.net.name, 'node')
+        self.assertEqual(len(self.net.interfaces()), 2)
+        with self.assertRaises(NoPackets):
+            self.net.recv_packet(timeout=0)
+
+        p = _udp("10.0.0.1", "192.168.1.1", 1234, 53)
+        self.rx.put([(1, Dlt.DLT_EN10MB.value, 2500000001, p.to_bytes())] * 2)
+        rp = self.net.recv_packet()
+        ts,dev,pkt = rp
+        self.assertEqual((ts, dev, pkt), (2.500000001, 'eth1', p))
+        self.assertEqual(rp.timestamp_ns, 2500000001)
+        self.assertEqual(len(self.net.recv_packets()), 1)
+
+        self.net.send_packet('eth0', p)
+        self.net.send_packet(self.devinfo['eth1'], p)
+        results = self.net.send_packets([(1, p), ('nosuch', p), ('eth0', b'xx')])
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], ValueError)
+        self.assertIsInstance(results[2], ValueError)
+        with self.assertRaises(ValueError):
+            self.net.send_packet('nosuch', p)
+        sent = [(devindex, dlt, frame) for devindex,dlt,ts,frame in self.tx.get_all(0)]
+        en10mb = Dlt.DLT_EN10MB.value
+        self.assertEqual(sent, [(0, en10mb, p.to_bytes()), (1, en10mb, p.to_bytes()),
+                                (0, en10mb, p.to_bytes())])
+
+        self.rx.close()
+        with self.assertRaises(Shutdown):
+            self.net.recv_packet()
+
+    def testLoopbackSend(self):
+        # frames for a loopback device are decoded with its link type
+        class FakeNet(object):
+            def __init__(self):
+                self.sent = []
+                self.frames = {}
+            def send_packet(self, dev, packet):
+                self.sent.append((dev, packet))
+            def _send_frames(self, perdev, results):
+                self.frames.update(perdev)
+
+        devinfo = {
+            'lo0': Interface('lo0', '00:00:00:00:00:00', '127.0.0.1', '255.0.0.0', 1, InterfaceType.Loopback),
+            'eth0': self.devinfo['eth0'],
+        }
+        net = LLNetShard('node', devinfo, self.rx, self.tx, 0, 1,
+            [Dlt.DLT_NULL.value, Dlt.DLT_EN10MB.value])
+        lo = Null() + IPv4(src="127.0.0.1", dst="127.0.0.1", protocol=IPProtocol.UDP, ttl=64) + \
+            UDP(src=1, dst=2) + b'hello'
+        p = _udp("10.0.0.1", "192.168.1.1", 1234, 53)
+        net.send_packets([('lo0', lo), ('eth0', p)])
+
+        fake = FakeNet()
+        _send_from_ring(fake, list(devinfo), {'lo0'}, self.tx)
+        self.assertEqual(fake.sent, [('lo0', lo)])
+        self.assertIsInstance(fake.sent[0][1][0], Null)
+        self.assertEqual(fake.frames, {'eth0': [(0, p.to_bytes())]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,8 @@ OF (v13) switch unit tests.
 import sys
 import asyncore
 import socket
+import random
+import time
 import unittest
 
 from unittest.mock import MagicMock
@@ -15,7 +17,8 @@ from switchyard.lib.packet import *
 from switchyard.lib.exceptions import *
 import switchyard.lib.openflow.openflow13 as of13
 import switchyard.lib.openflow.openflow10 as of10
-from switchyard.lib.openflow.ofswitch import OpenflowSwitch, SwitchActionCallbacks, FlowTable
+from switchyard.lib.openflow.ofswitch import OpenflowSwitch, SwitchActionCallbacks, FlowTable, \
+    ControllerConnection
 from switchyard.llnetbase import LLNetBase
 from switchyard.lib.interface import Interface
 
@@ -128,11 +131,36 @@ class SwitchUnitTests(unittest.TestCase):
     def testData1(self):
         self.switch = OpenflowSwitch(self.net, "abcdef00", self.cb, 0x01)
         self.assertEqual(self.switch._version, 0x01)
+        self.lastrecv = []
         self.switch._send_openflow_message_internal = self._receiver
+        self.switch._controller_connections.append((None, MagicMock()))
         self.switch._running = False
 
+        # a table miss goes to the controller as a packet-in
         self.switch._handle_datapath("eth0", Ethernet() + IPv4() + ICMP())
         self.assertTrue(self.lastrecv) # check that it's non-empty
+        self.assertEqual(self.lastrecv[-1][0].type, of10.OpenflowType.PacketIn)
+
+    def testFlowMod10(self):
+        pkt = Ethernet(src="11:00:00:00:00:01", dst="11:00:00:00:00:02") + \
+            IPv4(src="10.0.0.1", dst="10.0.0.2", protocol=IPProtocol.UDP, ttl=32) + UDP(src=1, dst=2)
+        flowmod = of10.OpenflowHeader.build(of10.OpenflowType.FlowMod, xid=42)
+        for w in (of10.OpenflowWildcard.InPort, of10.OpenflowWildcard.DlSrc,
+                  of10.OpenflowWildcard.DlDst, of10.OpenflowWildcard.TpSrc):
+            flowmod[1].match.add_wildcard(w)
+        flowmod[1].match.nw_src = "10.0.0.1"
+        flowmod[1].match.nw_dst = "10.0.0.2"
+        flowmod[1].match.nw_proto = IPProtocol.UDP
+        flowmod[1].match.tp_dst = 2
+        flowmod[1].actions.append(of10.ActionOutput(port=1))
+        flowmod[1].buffer_id = 0xffffffff
+        self._setup_switch(flowmod, 0x01)
+        self.switch._controller_thread(MagicMock())
+
+        self.assertEqual(self.lastrecv, [])
+        self.assertEqual(len(self.switch._tables[0]), 1)
+        actions = self.switch._tables[0].match_packet(1, pkt)
+        self.assertEqual(actions[0].port, 1)
 
 
     # def testTable1(self):
@@ -205,5 +233,332 @@ class SwitchUnitTests(unittest.TestCase):
     #     # flowmod[1].set_flag(FlowModFlags.Emergency)
 
 
+
+def _flowmod(match, priority, port, flags=()):
+    fmod = of10.OpenflowFlowMod(match)
+    fmod.priority = priority
+    for f in flags:
+        fmod.set_flag(f)
+    fmod.actions.append(of10.ActionOutput(port=port))
+    return fmod
+
+def _outport(actions):
+    return actions[0].port if actions else None
+
+class FlowTableTests(unittest.TestCase):
+    def setUp(self):
+        self.table = FlowTable(SwitchActionCallbacks())
+        self.pkt = Ethernet(src="11:00:00:00:00:01", dst="11:00:00:00:00:02") + \
+            IPv4(src="10.1.2.3", dst="192.168.0.1", protocol=IPProtocol.UDP, ttl=32) + \
+            UDP(src=1234, dst=53)
+
+    def _wildcarded(self, *wildcards, **fields):
+        m = of10.OpenflowMatch.build_from_packet(self.pkt)
+        for w in wildcards:
+            m.add_wildcard(w)
+        for k,v in fields.items():
+            setattr(m, k, v)
+        return m
+
+    def testPriorityAndWildcards(self):
+        W = of10.OpenflowWildcard
+        anything = of10.OpenflowMatch()
+        anything.wildcard_all()
+        self.table.add(_flowmod(anything, 1, 1))
+        self.table.add(_flowmod(self._wildcarded(W.InPort, W.TpSrc, W.TpDst), 10, 2))
+        self.table.add(_flowmod(self._wildcarded(W.InPort, W.TpSrc, tp_dst=80), 20, 3))
+        self.assertEqual(len(self.table), 3)
+        self.assertEqual(_outport(self.table.match_packet(5, self.pkt)), 2)
+        self.pkt[UDP].dst = 80
+        self.assertEqual(_outport(self.table.match_packet(5, self.pkt)), 3)
+        self.pkt[IPv4].src = "10.1.2.4"
+        self.assertEqual(_outport(self.table.match_packet(5, self.pkt)), 1)
+
+        # an exact match beats any wildcarded entry, whatever its priority
+        m = of10.OpenflowMatch.build_from_packet(self.pkt)
+        m.in_port = 5
+        self.table.add(_flowmod(m, 0, 4))
+        self.assertEqual(_outport(self.table.match_packet(5, self.pkt)), 4)
+        self.assertEqual(_outport(self.table.match_packet(6, self.pkt)), 1)
+
+    def testPrefixAndMissingHeaders(self):
+        W = of10.OpenflowWildcard
+        m = self._wildcarded(W.InPort, W.TpSrc, W.TpDst, W.NwProto, W.DlType,
+            nw_src="10.1.0.0", nwsrc_wildcard=16)
+        self.table.add(_flowmod(m, 10, 1))
+        self.assertEqual(_outport(self.table.match_packet(1, self.pkt)), 1)
+        self.pkt[IPv4].src = "10.1.200.9"
+        self.assertEqual(_outport(self.table.match_packet(1, self.pkt)), 1)
+        self.pkt[IPv4].src = "10.2.0.1"
+        self.assertIsNone(self.table.match_packet(1, self.pkt))
+
+        # fields from headers a packet doesn't have are ignored, as in
+        # OpenflowMatch.matches_packet
+        arp = Ethernet(src="11:00:00:00:00:01", dst="11:00:00:00:00:02", ethertype=EtherType.ARP) + \
+            Arp(senderprotoaddr="10.1.9.9", targetprotoaddr="192.168.0.1")
+        self.assertEqual(_outport(self.table.match_packet(1, arp)), 1)
+        eth = Packet() + Ethernet(src="11:00:00:00:00:01", dst="11:00:00:00:00:02")
+        self.assertEqual(_outport(self.table.match_packet(1, eth)), 1)
+        for p in (self.pkt, arp, eth):
+            self.assertEqual(m.matches_packet(p), self.table.match_packet(1, p) is not None)
+
+    def testReplaceDeleteOverlap(self):
+        W = of10.OpenflowWildcard
+        m = self._wildcarded(W.InPort)
+        self.table.add(_flowmod(m, 10, 1))
+        self.table.add(_flowmod(self._wildcarded(W.InPort), 10, 2))
+        self.assertEqual(len(self.table), 1)
+        self.assertEqual(_outport(self.table.match_packet(1, self.pkt)), 2)
+        rv = self.table.add(_flowmod(self._wildcarded(W.InPort), 10, 3,
+            flags=[of10.FlowModFlags.CheckOverlap]))
+        self.assertEqual(rv, of10.OpenflowFlowModFailedCode.Overlap)
+        self.table.add(_flowmod(self._wildcarded(W.InPort), 5, 4))
+        self.assertEqual(len(self.table), 2)
+
+        self.table.delete(self._wildcarded(W.InPort))
+        self.assertEqual(len(self.table), 0)
+        self.assertIsNone(self.table.match_packet(1, self.pkt))
+        self.assertEqual(self.table._groups, {})
+
+    def testFlowCache(self):
+        W = of10.OpenflowWildcard
+        fmod = _flowmod(self._wildcarded(W.InPort, W.TpSrc), 10, 1, flags=[of10.FlowModFlags.SendFlowRemove])
+        fmod.hard_timeout = 30
+        self.table.add(fmod)
+        for i in range(3):
+            self.assertEqual(_outport(self.table.match_packet(1, self.pkt)), 1)
+        self.assertEqual((self.table.cache_hits, self.table.cache_misses), (2, 1))
+        self.assertEqual(list(self.table._table)[0]._packets_matched, 3)
+
+        # a new entry that wins for a cached packet evicts it; one that
+        # loses (or doesn't match) doesn't
+        self.table.add(_flowmod(self._wildcarded(W.InPort, W.TpSrc, W.TpDst), 5, 2))
+        self.table.add(_flowmod(self._wildcarded(W.InPort, tp_src=1), 20, 3))
+        self.assertEqual(len(self.table._cache), 1)
+        self.table.add(_flowmod(self._wildcarded(W.InPort, W.DlSrc), 20, 4))
+        self.assertEqual(_outport(self.table.match_packet(1, self.pkt)), 4)
+        self.assertEqual(self.table.cache_misses, 2)
+
+        # modified actions show up straight away
+        self.table.modify(_flowmod(self._wildcarded(W.InPort, W.DlSrc), 20, 5), strict=True)
+        self.assertEqual(_outport(self.table.match_packet(1, self.pkt)), 5)
+        self.assertEqual(self.table.cache_hits, 3)
+
+        # and removed entries (by delete or expiry) are evicted
+        self.table.delete(self._wildcarded(W.InPort, W.DlSrc), strict=True)
+        self.assertEqual(_outport(self.table.match_packet(1, self.pkt)), 1)
+        self.assertEqual(self.table.cache_misses, 3)
+        entry = [e for e in self.table._table if e.priority == 10][0]
+        self.assertEqual(self.table.expire_entries(time.time() + 31), [entry])
+        self.assertEqual(_outport(self.table.match_packet(1, self.pkt)), 2)
+
+        # table misses are cached too
+        other = Packet() + Ethernet(src="11:00:00:00:00:09")
+        self.assertIsNone(self.table.match_packet(1, other))
+        self.assertIsNone(self.table.match_packet(1, other))
+        self.assertEqual((self.table.cache_hits, self.table.cache_misses), (4, 5))
+
+    def testFlowCacheAgreesWithLookup(self):
+        W = of10.OpenflowWildcard
+        rand = random.Random(7)
+        uncached = FlowTable(SwitchActionCallbacks(), cache_size=0)
+        arp = Ethernet(src="11:00:00:00:00:01", dst="11:00:00:00:00:02", ethertype=EtherType.ARP) + \
+            Arp(senderprotoaddr="10.1.2.3", targetprotoaddr="192.168.0.1")
+        packets = [arp]
+        for sport in (1234, 80):
+            for dst in ("192.168.0.1", "192.168.1.1"):
+                p = Packet(self.pkt.to_bytes())
+                p[UDP].src = sport
+                p[IPv4].dst = dst
+                packets.append(p)
+        masks = [(W.InPort,), (W.InPort, W.TpSrc), (W.InPort, W.TpSrc, W.TpDst, W.NwProto),
+            (W.TpSrc, W.TpDst), (W.InPort, W.DlSrc, W.TpDst)]
+        for i in range(60):
+            fields = {}
+            if rand.random() < 0.5:
+                fields['tp_src'] = rand.choice((1234, 80))
+            if rand.random() < 0.5:
+                fields['nw_dst'] = rand.choice(("192.168.0.0", "192.168.1.1"))
+                fields['nwdst_wildcard'] = rand.choice((0, 16))
+            match = self._wildcarded(*rand.choice(masks), **fields)
+            if rand.random() < 0.2:
+                for table in (self.table, uncached):
+                    table.delete(match)
+            else:
+                priority = rand.randrange(3)
+                for table in (self.table, uncached):
+                    table.add(_flowmod(match, priority, i))
+            for p in packets:
+                for port in (1, 2):
+                    self.assertEqual(_outport(self.table.match_packet(port, p)),
+                        _outport(uncached.match_packet(port, p)))
+        self.assertGreater(self.table.cache_hits, 0)
+        self.table.flush_cache()
+        self.assertEqual(self.table._cache_index, {})
+
+    def testExpiry(self):
+        W = of10.OpenflowWildcard
+        Notify = of10.FlowModFlags.SendFlowRemove
+        idle = _flowmod(self._wildcarded(W.InPort), 10, 1, flags=[Notify])
+        idle.idle_timeout = 10
+        idle.hard_timeout = 100
+        self.table.add(idle)
+        hard = _flowmod(self._wildcarded(W.InPort, W.TpSrc), 5, 2)
+        hard.hard_timeout = 20
+        self.table.add(hard)
+        gone = _flowmod(self._wildcarded(W.InPort, W.TpDst), 5, 3, flags=[Notify])
+        gone.hard_timeout = 5
+        self.table.add(gone)
+        idle,hard,gone = self.table._table
+        start = time.time()
+        self.assertEqual(self.table.expire_entries(start), [])
+        self.table.delete(self._wildcarded(W.InPort, W.TpDst), strict=True)
+        self.assertEqual(gone._removed_reason, of10.FlowRemovedReason.Delete)
+
+        # matching refreshes the idle timeout
+        idle._last_match = start + 15
+        self.assertEqual(self.table.expire_entries(start + 12), [])
+        self.assertEqual(len(self.table), 2)
+        self.assertFalse(self.table._expiry_stale)
+
+        # entries that don't ask for a notification are still removed
+        self.assertEqual(self.table.expire_entries(start + 21), [])
+        self.assertEqual(list(self.table._table), [idle])
+        self.assertEqual(self.table.expire_entries(start + 19), [])
+        self.assertEqual(self.table.expire_entries(start + 30), [idle])
+        self.assertEqual(idle._removed_reason, of10.FlowRemovedReason.IdleTimeout)
+        self.assertEqual((len(self.table), self.table._expiry), (0, []))
+
+class FakeSocket(object):
+    '''
+    Stands in for a connected socket: recv_into hands out the given
+    chunks of bytes one per call, then times out; sendall records what
+    it's given.
+    '''
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+        self.sent = []
+        self.closed = False
+
+    def recv_into(self, buf):
+        if not self.chunks:
+            raise socket.timeout()
+        data = self.chunks.pop(0)
+        n = min(len(data), len(buf))
+        buf[:n] = data[:n]
+        if n < len(data):
+            self.chunks.insert(0, data[n:])
+        return n
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+    def close(self):
+        self.closed = True
+
+class ControllerConnectionTests(unittest.TestCase):
+    def _connection(self, *chunks, **kwargs):
+        cc = ControllerConnection('localhost', 6633, usetls=False, **kwargs)
+        cc._socket = FakeSocket(*chunks)
+        cc._connected = True
+        return cc
+
+    def _messages(self, cc):
+        rv = []
+        while True:
+            p = cc.receive_openflow_message()
+            if p is None:
+                return rv
+            rv.append(p)
+
+    def testReceiveFraming(self):
+        hello10 = of10.OpenflowHeader.build(of10.OpenflowType.Hello, xid=1)
+        echo10 = of10.OpenflowHeader.build(of10.OpenflowType.EchoRequest, xid=2)
+        echo10[1].data = b'\x01' * 20
+        hello13 = of13.OpenflowHeader.build(of13.OpenflowType.Hello, xid=3)
+        raw = hello10.to_bytes() + echo10.to_bytes() + hello13.to_bytes()
+
+        # several messages in one recv, decoded by version
+        cc = self._connection(raw)
+        msgs = self._messages(cc)
+        self.assertEqual(msgs, [hello10, echo10, hello13])
+        self.assertIsInstance(msgs[2][0], of13.OpenflowHeader)
+
+        # messages split across recvs (one chunk per recv)
+        cc = self._connection(raw[:5], raw[5:17], raw[17:30], raw[30:])
+        recv = cc.receive_openflow_message
+        self.assertEqual([recv() for i in range(6)], [None, hello10, None, echo10, hello13, None])
+        self.assertEqual(cc._start, cc._end)
+
+        # buffer smaller than a message: it grows
+        cc = self._connection(raw, bufsize=12)
+        recv = cc.receive_openflow_message
+        self.assertEqual([recv() for i in range(6)], [hello10, None, None, echo10, hello13, None])
+        self.assertEqual(len(cc._recvbuf), 48)
+
+    def testSendCoalescing(self):
+        cc = self._connection(flush_size=64)
+        reply = of10.OpenflowHeader.build(of10.OpenflowType.BarrierReply, xid=1)
+        for i in range(3):
+            cc.send_openflow_message(reply)
+        self.assertEqual(cc.sock.sent, [])
+        cc.flush()
+        self.assertEqual(cc.sock.sent, [reply.to_bytes() * 3])
+        cc.flush()
+        self.assertEqual(len(cc.sock.sent), 1)
+
+        # queued messages go out before waiting on the controller,
+        # and when the queue is past flush_size
+        cc.send_openflow_message(reply)
+        self.assertIsNone(cc.receive_openflow_message())
+        self.assertEqual(cc.sock.sent[1:], [reply.to_bytes()])
+        for i in range(8):
+            cc.send_openflow_message(reply)
+        self.assertEqual(cc.sock.sent[2:], [reply.to_bytes() * 8])
+
+    def testSendFailure(self):
+        reply = of10.OpenflowHeader.build(of10.OpenflowType.BarrierReply, xid=1)
+
+        # a failed write from the datapath loop's flush doesn't escape
+        cc = self._connection()
+        cc.sock.sendall = MagicMock(side_effect=socket.timeout())
+        switch = OpenflowSwitch(NetConnection(), "abcdef00", SwitchActionCallbacks(), 0x01)
+        switch._controller_connections.append((None, cc))
+        cc.send_openflow_message(reply)
+        switch._flush_controllers()
+        self.assertFalse(cc.isconnected())
+        self.assertTrue(cc.sock.closed)
+        self.assertEqual(cc._sendq, [])
+
+        # nor does one from the receive path
+        cc = self._connection()
+        cc.sock.sendall = MagicMock(side_effect=OSError())
+        cc.send_openflow_message(reply)
+        self.assertIsNone(cc.receive_openflow_message())
+        self.assertFalse(cc.isconnected())
+
+        # nor does one when the queue goes past flush_size
+        cc = self._connection(flush_size=8)
+        cc.sock.sendall = MagicMock(side_effect=BrokenPipeError())
+        cc.send_openflow_message(reply)
+        self.assertFalse(cc.isconnected())
+        self.assertEqual(cc._sendq, [])
+
+    def testReceiveFailure(self):
+        hello = of10.OpenflowHeader.build(of10.OpenflowType.Hello, xid=1)
+        # a message claiming to be shorter than a header: the messages
+        # before it are still handed out, then the connection is closed
+        cc = self._connection(hello.to_bytes() + b'\x01\x00\x00\x04' + bytes(4))
+        self.assertEqual(cc.receive_openflow_message(), hello)
+        self.assertFalse(cc.isconnected())
+        self.assertTrue(cc.sock.closed)
+        self.assertEqual(len(cc._received), 0)
+
+        cc = self._connection()
+        cc.sock.recv_into = MagicMock(side_effect=ConnectionResetError())
+        self.assertIsNone(cc.receive_openflow_message())
+        self.assertFalse(cc.isconnected())
+
+
 if __name__ == '__main__':
     unittest.main()
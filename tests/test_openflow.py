@@ -186,7 +186,42 @@ class OpenflowPacketTests(unittest.TestCase):
                           dl_type=EtherType.IP, dl_vlan=65535, dl_vlan_pcp=0, \
                           in_port=2)
         self.assertTrue(m.matches_packet(pkt))
-        
+
+    def testPacketKey(self):
+        pkt = Ethernet(src="11:22:33:44:55:66", dst="aa:bb:cc:dd:ee:ff") + \
+              IPv4(src="1.2.3.4", dst="5.6.7.8", protocol=17) + \
+              UDP(src=4000, dst=53)
+        key = OpenflowMatch.packet_key(pkt)
+        self.assertEqual(key[-4:], [4000, 53, 0x01020304, 0x05060708])
+        self.assertIsNone(key[2])
+        m = OpenflowMatch.build_from_packet(pkt)
+        self.assertTrue(m.matches_key(key))
+        m.tp_dst = 54
+        self.assertFalse(m.matches_key(key))
+        m.add_wildcard(OpenflowWildcard.TpDst)
+        self.assertTrue(m.matches_key(key))
+
+        # the outer and inner ethertypes of a tagged frame can't both match
+        tagged = Ethernet(ethertype=EtherType.x8021Q) + Vlan(vlanid=5, ethertype=EtherType.IPv4) + \
+                 IPv4(src="1.2.3.4", dst="5.6.7.8", protocol=17) + UDP(src=4000, dst=53)
+        key = OpenflowMatch.packet_key(tagged)
+        self.assertEqual(key[2], 5)
+        m = OpenflowMatch(dl_type=EtherType.IPv4)
+        m.wildcard_all()
+        self.assertTrue(m.matches_key(key))
+        m.remove_wildcard(OpenflowWildcard.All)
+        for w in OpenflowWildcard:
+            if w.name not in ('DlType', 'All') and not w.name.startswith('Nw'):
+                m.add_wildcard(w)
+        self.assertFalse(m.matches_key(key))
+
+        # IPv6 addresses never fall within an nw_src prefix
+        m = OpenflowMatch()
+        m.wildcard_all()
+        pkt6 = Ethernet(ethertype=EtherType.IPv6) + IPv6(src="fe80::1", dst="fe80::2", nextheader=17) + UDP()
+        self.assertFalse(m.matches_packet(pkt6))
+        self.assertTrue(m.matches_packet(Ethernet() + Arp()))
+
     def testError(self):
         e = OpenflowHeader.build(OpenflowType.Error, xid=0, version=0x01)
         e[1].errortype = OpenflowErrorType.HelloFailed
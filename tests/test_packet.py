@@ -1,4 +1,5 @@
 from io import StringIO
+from copy import deepcopy
 import sys
 import unittest 
 
@@ -129,6 +130,15 @@ class PacketTests(unittest.TestCase):
         self.assertEqual(p[ICMP], icmp)
         with self.assertRaises(KeyError):
             p[IPv6]
+
+        # a tuple of classes works as it does for isinstance
+        self.assertTrue(p.has_header((IPv6, IPv4)))
+        self.assertFalse(p.has_header((IPv6, Arp)))
+        self.assertEqual(p.get_header((ICMP, IPv4)), ip)
+        self.assertIsNone(p.get_header((IPv6, Arp)))
+        self.assertEqual(p.get_header_index((ICMP, IPv6)), 2)
+        lazy = Packet((Ethernet() + IPv4(protocol=IPProtocol.UDP) + UDP()).to_bytes(), lazy=True)
+        self.assertEqual(lazy.get_header_index((UDP, TCP)), 2)
         del p[Ethernet]
         self.assertFalse(p.has_header(Ethernet))
         self.assertEqual(p.num_headers(), 2)
@@ -204,6 +214,183 @@ class PacketTests(unittest.TestCase):
         with self.assertRaises(TypeError):
             raw.from_bytes(1234567890)
 
+    def testLazyParse(self):
+        p = Ethernet() + IPv4(protocol=IPProtocol.UDP, ttl=64) + UDP(src=1, dst=2) + b'payload'
+        raw = p.to_bytes()
+
+        lazy = Packet(raw, lazy=True)
+        self.assertIsInstance(lazy[0], Ethernet)
+        self.assertEqual(lazy._headers, [lazy[0]])
+        self.assertTrue(lazy.has_header(IPv4))
+        self.assertEqual(len(lazy._headers), 2)
+        self.assertEqual(lazy[IPv4].ttl, 64)
+        self.assertEqual(lazy.get_header_index(UDP), 2)
+        self.assertEqual(len(lazy._headers), 3)
+        self.assertEqual(lazy[-1].to_bytes(), b'payload')
+        self.assertEqual(lazy, p)
+        self.assertEqual(lazy.to_bytes(), raw)
+
+        lazy = Packet(raw, lazy=True)
+        self.assertEqual([h.__class__ for h in lazy],
+            [Ethernet, IPv4, UDP, RawPacketContents])
+        lazy = Packet(raw, lazy=True)
+        self.assertEqual(lazy.num_headers(), 4)
+        self.assertEqual(str(lazy), str(Packet(raw)))
+
+        # adding/inserting headers must see fully decoded packet
+        lazy = Packet(raw, lazy=True)
+        lazy.add_header(b'more')
+        self.assertEqual(lazy.num_headers(), 5)
+        self.assertEqual(lazy[-1].to_bytes(), b'more')
+        lazy = Packet(raw, lazy=True)
+        lazy.insert_header(1, Vlan())
+        self.assertEqual(lazy.headers(),
+            ['Ethernet', 'Vlan', 'IPv4', 'UDP', 'RawPacketContents'])
+
+        # decode errors are deferred until the header is reached
+        lazy = Packet(raw[:20], lazy=True)
+        self.assertIsInstance(lazy[0], Ethernet)
+        with self.assertRaises(NotEnoughDataError):
+            lazy[1]
+        with self.assertRaises(NotEnoughDataError):
+            Packet(raw[:20])
+
+    def testZeroCopyPayload(self):
+        import copy, pickle
+        p = Ethernet() + IPv4(protocol=IPProtocol.UDP) + UDP() + b'payload'
+        raw = p.to_bytes()
+        pkt = Packet(memoryview(raw))
+        payload = pkt[-1]
+        self.assertIsInstance(payload, RawPacketContents)
+        self.assertIsInstance(payload._raw, memoryview)
+        self.assertEqual(payload.size(), 7)
+        self.assertEqual(str(payload), "RawPacketContents (7 bytes) b'payload'")
+        self.assertEqual(copy.deepcopy(pkt), p)
+        self.assertEqual(pickle.loads(pickle.dumps(pkt)), p)
+        self.assertEqual(payload.data, b'payload')
+        self.assertIsInstance(payload._raw, bytes)
+        self.assertEqual(pkt.to_bytes(), raw)
+        self.assertEqual(RawPacketContents(bytearray(b'abc')).to_bytes(), b'abc')
+
+    def testSerializeCache(self):
+        p = Ethernet() + IPv4(protocol=IPProtocol.UDP, ttl=64, src="1.2.3.4", dst="5.6.7.8") + UDP(src=1, dst=2) + b'payload'
+        raw = p.to_bytes()
+
+        def rebuilt(pkt):
+            fresh = Packet()
+            for hdr in pkt:
+                fresh += deepcopy(hdr)
+            return fresh.to_bytes()
+
+        pkt = Packet(raw)
+        self.assertIs(pkt.to_bytes(), raw)
+
+        # only the modified headers change; udp checksum is untouched
+        pkt[0].src = "00:00:00:00:00:01"
+        pkt[1].ttl -= 1
+        b = pkt.to_bytes()
+        self.assertEqual(b, rebuilt(pkt))
+        self.assertNotEqual(b[14:34], raw[14:34])
+        self.assertEqual(b[34:], raw[34:])
+
+        # the udp checksum covers the ip addresses
+        pkt[1].src = "9.9.9.9"
+        b = pkt.to_bytes()
+        self.assertEqual(b, rebuilt(pkt))
+        self.assertNotEqual(b[40:42], raw[40:42])
+
+        # lengths follow a change to the payload
+        pkt[-1] = RawPacketContents(b'abc')
+        self.assertEqual(pkt.to_bytes(), rebuilt(pkt))
+        self.assertEqual(pkt[IPv4].total_length, 31)
+
+        pkt = Packet(raw)
+        del pkt[0]
+        self.assertEqual(pkt.to_bytes(), raw[14:])
+        pkt = Packet(raw)
+        del pkt[-1]
+        self.assertEqual(pkt.to_bytes(), rebuilt(pkt))
+        pkt = Packet(raw)
+        pkt.insert_header(1, Vlan())
+        self.assertEqual(pkt.to_bytes(), rebuilt(pkt))
+
+        # changes inside nested objects are picked up, too
+        raw = (Ethernet() + IPv4(protocol=IPProtocol.ICMP) + ICMP()).to_bytes()
+        pkt = Packet(raw)
+        pkt[ICMP].icmpdata.sequence = 42
+        self.assertNotEqual(pkt.to_bytes(), raw)
+        self.assertEqual(pkt.to_bytes(), rebuilt(pkt))
+
+    def testSerializeInto(self):
+        p = Ethernet() + IPv4(protocol=IPProtocol.TCP, src="1.2.3.4", dst="5.6.7.8") + TCP(src=1, dst=2) + b'payload'
+        raw = p.to_bytes()
+        buf = bytearray(100)
+        self.assertEqual(p.serialize_into(buf, 2), len(raw))
+        self.assertEqual(buf[2:2+len(raw)], raw)
+        self.assertEqual(buf[:2], b'\x00\x00')
+
+        pkt = Packet(raw)
+        pkt[IPv4].ttl = 3
+        pkt[TCP].dst = 80
+        xlen = pkt.serialize_into(memoryview(buf)[10:])
+        self.assertEqual(buf[10:10+xlen], pkt.to_bytes())
+
+        # default write_into for headers without their own
+        p = IPv4(protocol=IPProtocol.ICMP) + ICMP()
+        xlen = p.serialize_into(buf)
+        self.assertEqual(buf[:xlen], p.to_bytes())
+
+        with self.assertRaises(ValueError):
+            p.serialize_into(bytearray(10))
+        with self.assertRaises(TypeError):
+            p.serialize_into(bytes(100))
+
+    def testHeaderIndex(self):
+        class MyUDP(UDP):
+            pass
+
+        p = Ethernet() + IPv4() + MyUDP()
+        self.assertTrue(p.has_header(UDP))
+        self.assertTrue(p.has_header(MyUDP))
+        self.assertTrue(p.has_header('MyUDP'))
+        self.assertFalse(p.has_header('UDP'))
+        self.assertEqual(p.get_header_index(UDP), 2)
+        self.assertEqual(p.get_header_index(PacketHeaderBase), 0)
+        self.assertEqual(p.get_header_index(PacketHeaderBase, 1), 1)
+        self.assertIs(p[UDP], p[2])
+
+        p.prepend_header(Vlan())
+        self.assertEqual(p.get_header_index(Ethernet), 1)
+        self.assertEqual(p.get_header_index(PacketHeaderBase), 0)
+        p.insert_header(2, Vlan())
+        self.assertEqual(p.get_header_index(Vlan, 1), 2)
+        self.assertEqual(p.get_header_index(IPv4), 3)
+        p[4] = TCP()
+        self.assertFalse(p.has_header(UDP))
+        self.assertIsInstance(p.get_header(TCP), TCP)
+        del p[Vlan]
+        del p[0]
+        self.assertEqual(p.headers(), ['Vlan', 'IPv4', 'TCP'])
+        self.assertEqual(p.get_header_index(TCP), 2)
+        p += b'payload'
+        self.assertEqual(p.get_header_index(RawPacketContents), 3)
+        self.assertIsNone(p.get_header_by_name('Ethernet'))
+        self.assertEqual(p.get_header(Ethernet, 'none'), 'none')
+        with self.assertRaises(KeyError):
+            p[ICMP]
+
+        q = deepcopy(p)
+        self.assertIs(q[TCP], q[2])
+
+        raw = (Ethernet() + IPv4(protocol=IPProtocol.UDP) + UDP() + b'x').to_bytes()
+        lazy = Packet(raw, lazy=True)
+        self.assertFalse(lazy.has_header(TCP))
+        self.assertEqual(lazy.num_headers(), 4)
+        lazy = Packet(raw, lazy=True)
+        lazy.insert_header(1, Vlan())
+        self.assertEqual(lazy.get_header_index(UDP), 3)
+        self.assertEqual(lazy.get_header_index(Vlan), 1)
+
 
 if __name__ == '__main__':
     unittest.main()
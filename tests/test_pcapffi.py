@@ -50,6 +50,45 @@ class PcapFfiTests(unittest.TestCase):
         self.assertEqual(len(pkts), 0)
         os.unlink("testXX.pcap")
 
+    def testTimestamps(self):
+        pkt = b'\x00' * 14 + b'hello'
+        ts = 1500000000123456789
+        for precision,expected in ((pf.PcapTstampPrecision.Nano, ts), (pf.PcapTstampPrecision.Micro, 1500000000123456000)):
+            dump = pf.PcapDumper("testXX.pcap", tstamp_precision=precision)
+            dump.write_packet(pkt, ts_ns=ts)
+            dump.write_packet(pkt, ts=2.5)
+            dump.close()
+            reader = pf.PcapReader("testXX.pcap")
+            p1 = reader.recv_packet()
+            p2 = reader.recv_packet()
+            reader.close()
+            self.assertEqual(p1.timestamp_ns, expected)
+            self.assertIsInstance(p1.timestamp_ns, int)
+            self.assertAlmostEqual(p1.timestamp, expected / 1e9)
+            self.assertEqual(p2.timestamp_ns, 2500000000)
+            self.assertEqual(p2.timestamp, 2.5)
+        os.unlink("testXX.pcap")
+
+    def testBufferedDumper(self):
+        pkt = b'\x00' * 14 + b'hello'
+        dump = pf.PcapDumper("testXX.pcap", background=True, buffer_size=4096)
+        for i in range(100):
+            dump.write_packet(pkt, ts_ns=i)
+        dump.flush()
+        dump.close()
+        self.assertEqual(dump.dropped, 0)
+        reader = pf.PcapReader("testXX.pcap")
+        pkts = []
+        while True:
+            p = reader.recv_packet()
+            if p is None:
+                break
+            pkts.append(p)
+        reader.close()
+        self.assertEqual([p.timestamp_ns for p in pkts], list(range(100)))
+        self.assertEqual(pkts[-1].raw, pkt)
+        os.unlink("testXX.pcap")
+
     def testAnotherInstance(self):
         with self.assertRaises(Exception):
             pf._PcapFfi()
@@ -0,0 +1,223 @@
+import unittest
+import os
+import struct
+import tempfile
+import time
+
+from switchyard.lib.packet import *
+from switchyard.pcapfile import PcapFile, PcapPacket, PcapException, PcapWriter
+
+
+def _pkts(n):
+    return [ (Ethernet(src="11:22:33:44:55:66", dst="66:55:44:33:22:11") +
+              IPv4(src="10.0.0.1", dst="10.0.0.2", protocol=IPProtocol.UDP, ttl=64) +
+              UDP(src=1000+i, dst=53) + bytes(i)).to_bytes() for i in range(n) ]
+
+def _pcap(endian, magic, records, linktype=1):
+    data = struct.pack(endian + 'IHHiIII', magic, 2, 4, 0, 0, 65535, linktype)
+    for sec,frac,raw in records:
+        data += struct.pack(endian + 'IIII', sec, frac, len(raw), len(raw)) + raw
+    return data
+
+def _block(endian, btype, body):
+    body += b'\x00' * (-len(body) % 4)
+    total = len(body) + 12
+    return struct.pack(endian + 'II', btype, total) + body + struct.pack(endian + 'I', total)
+
+def _shb(endian):
+    return _block(endian, 0x0a0d0d0a, struct.pack(endian + 'IHHq', 0x1a2b3c4d, 1, 0, -1))
+
+def _idb(endian, linktype, tsresol=None, tsoffset=None):
+    body = struct.pack(endian + 'HHI', linktype, 0, 0)
+    if tsresol is not None:
+        body += struct.pack(endian + 'HHB3x', 9, 1, tsresol)
+    if tsoffset is not None:
+        body += struct.pack(endian + 'HHq', 14, 8, tsoffset)
+    body += struct.pack(endian + 'HH', 0, 0)
+    return _block(endian, 1, body)
+
+def _epb(endian, ifid, units, raw):
+    return _block(endian, 6, struct.pack(endian + '5I', ifid, units >> 32, units & 0xffffffff, len(raw), len(raw)) + raw)
+
+def _spb(endian, raw):
+    return _block(endian, 3, struct.pack(endian + 'I', len(raw)) + raw)
+
+
+class PcapFileTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpfiles = []
+
+    def tearDown(self):
+        for name in self.tmpfiles:
+            os.unlink(name)
+
+    def _write(self, data):
+        fd,name = tempfile.mkstemp(suffix='.pcap')
+        os.write(fd, data)
+        os.close(fd)
+        self.tmpfiles.append(name)
+        return name
+
+    def testPcap(self):
+        raws = _pkts(5)
+        for endian in '<>':
+            for magic,frac,ns in ((0xa1b2c3d4, 250000, 250000000), (0xa1b23c4d, 123456789, 123456789)):
+                records = [ (1000 + i, frac, raw) for i,raw in enumerate(raws) ]
+                name = self._write(_pcap(endian, magic, records))
+                with PcapFile(name) as pf:
+                    self.assertEqual(pf.format, 'pcap')
+                    self.assertEqual(pf.linktype, 1)
+                    pkts = list(pf)
+                    self.assertEqual(len(pkts), 5)
+                    self.assertIsInstance(pkts[0].raw, memoryview)
+                    self.assertEqual([bytes(p.raw) for p in pkts], raws)
+                    self.assertEqual([p.timestamp_ns for p in pkts],
+                        [ (1000 + i) * 1000000000 + ns for i in range(5) ])
+                    self.assertEqual(pkts[2].capture_length, len(raws[2]))
+                    self.assertEqual(Packet(pkts[3].raw)[UDP].src, 1003)
+                    del pkts
+
+    def testTruncatedAndBad(self):
+        raws = _pkts(3)
+        data = _pcap('<', 0xa1b2c3d4, [ (0, 0, raw) for raw in raws ])
+        name = self._write(data[:-10])
+        with PcapFile(name) as pf:
+            self.assertEqual(len(list(pf)), 2)
+        with self.assertRaises(PcapException):
+            PcapFile(self._write(b''))
+        with self.assertRaises(PcapException):
+            PcapFile(self._write(b'\x00' * 100))
+
+    def testPcapng(self):
+        raws = _pkts(6)
+        for endian in '<>':
+            data = _shb(endian) + \
+                _idb(endian, 1) + \
+                _idb(endian, 1, tsresol=9, tsoffset=100) + \
+                _epb(endian, 0, 5000000, raws[0]) + \
+                _epb(endian, 1, 7000000001, raws[1]) + \
+                _spb(endian, raws[2]) + \
+                _block(endian, 5, b'stats') + \
+                _shb(endian) + \
+                _idb(endian, 101, tsresol=0x80 | 10) + \
+                _epb(endian, 0, 3 * 1024, raws[3])
+            name = self._write(data)
+            with PcapFile(name) as pf:
+                self.assertEqual(pf.format, 'pcapng')
+                self.assertEqual(pf.linktype, 1)
+                pkts = list(pf)
+                self.assertEqual([bytes(p.raw) for p in pkts], raws[:4])
+                self.assertEqual([p.timestamp_ns for p in pkts],
+                    [5000000000, 107000000001, 0, 3000000000])
+                self.assertEqual([i.linktype for i in pf.interfaces], [1, 1, 101])
+                self.assertEqual(len(pf), 4)
+                self.assertEqual([pf.interface_of(i) for i in range(4)], [0, 1, 0, 2])
+                self.assertEqual(pf[-1].timestamp_ns, 3000000000)
+                self.assertEqual(bytes(pf[1].raw), raws[1])
+                del pkts
+
+    def testIndex(self):
+        raws = _pkts(100)
+        name = self._write(_pcap('<', 0xa1b23c4d, [ (i, 0, raw) for i,raw in enumerate(raws) ]))
+        with PcapFile(name) as pf:
+            self.assertEqual(len(pf), 100)
+            self.assertEqual(bytes(pf[42].raw), raws[42])
+            self.assertEqual(pf.find(10 * 1000000000), 10)
+            self.assertEqual(pf.find(10 * 1000000000 + 1), 11)
+            self.assertEqual(pf.find(1000 * 1000000000), 100)
+            self.assertEqual([p.timestamp for p in pf.packets(98)], [98.0, 99.0])
+
+            expected = [ Packet(raw)[UDP].src for raw in raws ]
+            for workers in (1, 2):
+                results = list(pf.map_packets(_udp_source, workers=workers, chunksize=7))
+                self.assertEqual(results, expected)
+
+    def _tmpname(self):
+        dirname = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, dirname)
+        return os.path.join(dirname, 'cap.pcap')
+
+    def _read(self, name):
+        with PcapFile(name) as pf:
+            return [ (p.timestamp_ns, bytes(p.raw)) for p in pf ]
+
+    def testWriter(self):
+        raws = _pkts(20)
+        name = self._tmpname()
+        with PcapWriter(name, buffer_size=100) as w:
+            for i,raw in enumerate(raws):
+                w.write(raw, ts_ns=i * 1000000001)
+            self.assertEqual(w.files, [name])
+        self.tmpfiles.append(name)
+        self.assertEqual(self._read(name), [ (i * 1000000001, raw) for i,raw in enumerate(raws) ])
+
+        with PcapWriter(name, nanosecond=False, snaplen=20) as w:
+            w.write(raws[0], ts_ns=1999)
+        with PcapFile(name) as pf:
+            pkt = next(iter(pf))
+            self.assertEqual((pkt.timestamp_ns, pkt.capture_length, pkt.length), (1000, 20, len(raws[0])))
+            del pkt
+
+    def testWriterRotation(self):
+        raws = _pkts(20)
+        name = self._tmpname()
+        size = 24 + 3 * (16 + len(raws[-1]))
+        w = PcapWriter(name, rotate_size=size, keep=2)
+        for i,raw in enumerate(raws):
+            w.write(raw, ts_ns=i)
+        w.close()
+        self.tmpfiles.extend(w.files)
+        stem = name[:-len('.pcap')]
+        self.assertEqual(w.files, [ "{}.{}.pcap".format(stem, i) for i in (5, 6) ])
+        self.assertEqual(sorted(os.listdir(os.path.dirname(name))), ['cap.5.pcap', 'cap.6.pcap'])
+        for f in w.files:
+            self.assertLessEqual(os.path.getsize(f), size)
+        self.assertEqual([raw for ts,raw in self._read(w.files[0]) + self._read(w.files[1])], raws[15:])
+
+        w = PcapWriter(name, rotate_interval=0)
+        for raw in raws[:3]:
+            w.write(raw)
+        w.close()
+        self.tmpfiles.extend(w.files)
+        self.assertEqual([ len(self._read(f)) for f in w.files ], [1, 1, 1])
+
+    def testWriterBackground(self):
+        raws = _pkts(200)
+        name = self._tmpname()
+        w = PcapWriter(name, background=True, queue_size=50)
+        self.tmpfiles.append(name)
+        for i,raw in enumerate(raws[:10]):
+            w.write(raw, ts_ns=i)
+        w.flush()
+        self.assertEqual(len(self._read(name)), 10)
+        for raw in raws[10:]:
+            w.write(raw, ts_ns=0)
+        w.close()
+        self.assertEqual(len(self._read(name)) + w.dropped, 200)
+
+        # flushing or closing again does nothing; writing is an error
+        w.flush()
+        w.close()
+        with self.assertRaises(ValueError):
+            w.write(raws[0])
+
+    def testWriterBackgroundFlushInterval(self):
+        raws = _pkts(3)
+        name = self._tmpname()
+        w = PcapWriter(name, background=True, flush_interval=0.05)
+        self.tmpfiles.append(name)
+        w.write(raws[0], ts_ns=0)
+        # written out by the writer thread, without a flush or close
+        deadline = time.time() + 5
+        while os.path.getsize(name) == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self._read(name)), 1)
+        w.close()
+
+
+def _udp_source(pkt):
+    return Packet(pkt.raw)[UDP].src
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -392,6 +392,11 @@ s.close()
         o.codearg = _parse_codeargs(kwargs.get('codearg', ''))
         o.logfile = _parse_codeargs(kwargs.get('logfile', None))
         o.listif = kwargs.get('listif', False)
+        o.engine = kwargs.get('engine', 'threads')
+        o.backend = kwargs.get('backend', 'pcap')
+        o.queue_limit = kwargs.get('queue_limit', 65536)
+        o.queue_policy = kwargs.get('queue_policy', 'tail')
+        o.workers = kwargs.get('workers', 1)
         return o
 
     @classmethod
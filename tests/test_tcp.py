@@ -57,6 +57,34 @@ class TCPPacketTests(unittest.TestCase):
         with self.assertRaises(Exception):
             x = Packet(raw=b[:-2])
 
+    def testIncrementalChecksum(self):
+        def mkpkt(ipsrc, sport):
+            return Ethernet() + \
+                IPv4(src=ipsrc, dst="10.0.0.2", protocol=IPProtocol.TCP, ttl=64) + \
+                TCP(src=sport, dst=80, seq=1000, ack=2000, window=512, ACK=1) + \
+                bytes(range(256)) * 4
+        p = Packet(raw=mkpkt("10.0.0.1", 40000).to_bytes())
+        ip = p[IPv4]
+        ip.src = "192.0.2.1"
+        p[TCP].src = 1234
+        expected = mkpkt("192.0.2.1", 1234).to_bytes()
+        self.assertEqual(p.to_bytes(), expected)
+        # serialize the rewritten packet again
+        p[TCP].src = 40000
+        buf = bytearray(2048)
+        xlen = p.serialize_into(buf)
+        self.assertEqual(buf[:xlen], mkpkt("192.0.2.1", 40000).to_bytes())
+
+        # a padded frame: the padding ends up in the payload, as before
+        raw = (Ethernet() + IPv4(src="10.0.0.1", protocol=IPProtocol.TCP) +
+               TCP(src=1, dst=2)).to_bytes() + b'\x00' * 6
+        p = Packet(raw=raw)
+        p[IPv4].src = "192.0.2.1"
+        p[IPv4].ttl = 5
+        expected = (Ethernet() + IPv4(src="192.0.2.1", protocol=IPProtocol.TCP, ttl=5) +
+                    TCP(src=1, dst=2) + b'\x00' * 6).to_bytes()
+        self.assertEqual(p.to_bytes(), expected)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -43,6 +43,48 @@ class UDPPacketTests(unittest.TestCase):
         c = checksum(x, start=0, skip_word=1)
         self.assertEqual(c, 65535)
 
+    def testIncrementalChecksum(self):
+        def mkpkt(ipdst, dport, payload=b'\xab' * 999):
+            return Ethernet() + \
+                IPv4(src="10.0.0.1", dst=ipdst, protocol=IPProtocol.UDP, ttl=64) + \
+                UDP(src=5353, dst=dport) + payload
+        p = Packet(raw=mkpkt("10.0.0.2", 53).to_bytes())
+        p[IPv4].dst = "198.51.100.7"
+        p[IPv4].ttl = 64
+        p[UDP].dst = 5300
+        self.assertEqual(p.to_bytes(), mkpkt("198.51.100.7", 5300).to_bytes())
+
+        # the payload changed: the checksum is computed from scratch
+        p[-1] = RawPacketContents(b'\x01' * 10)
+        p[UDP].dst = 53
+        self.assertEqual(p.to_bytes(),
+            mkpkt("198.51.100.7", 53, b'\x01' * 10).to_bytes())
+
+    def testIncrementalChecksumLazy(self):
+        def mkpkt(ipsrc):
+            return Ethernet() + \
+                IPv4(src=ipsrc, dst="10.0.0.2", protocol=IPProtocol.UDP, ttl=64) + \
+                UDP(src=5353, dst=53) + b'\xab' * 99
+        # the IPv4 header is changed before the UDP header is decoded
+        p = Packet(raw=mkpkt("10.0.0.1").to_bytes(), lazy=True)
+        p[IPv4].src = "1.2.3.4"
+        self.assertEqual(p.to_bytes(), mkpkt("1.2.3.4").to_bytes())
+
+        p = Packet(raw=mkpkt("10.0.0.1").to_bytes(), lazy=True)
+        p[IPv4].src = "1.2.3.4"
+        p[UDP].dst = 53
+        self.assertEqual(p.to_bytes(), mkpkt("1.2.3.4").to_bytes())
+
+    def testIncrementalUpdate(self):
+        data = bytearray(range(200))
+        csum = checksum(data)
+        for offset, width in ((0, 2), (10, 4), (100, 2), (198, 2)):
+            old = int.from_bytes(data[offset:offset+width], 'big')
+            data[offset:offset+width] = b'\xff' * width
+            new = int.from_bytes(data[offset:offset+width], 'big')
+            csum = checksum_update(csum, old, new)
+            self.assertEqual(csum, checksum(data))
+
 
 if __name__ == '__main__':
     unittest.main()